@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for Enhanced Image Cropper v1.0.3.C - Kowalski Edition
+Times every editing operation on synthetic images and stores the results as JSON
+
+    python benchmark.py                          # 1, 12 and 50 MP, results in benchmark_results.json
+    python benchmark.py --sizes 1 12 --repeat 3  # quicker run
+    python benchmark.py --baseline old.json      # flag operations that got slower
+    python benchmark.py --compare old.json new.json
+    python benchmark.py --memory --sizes 12       # scripted editing session with memory budgets
+"""
+
+import argparse
+import ctypes
+import gc
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import cv2
+import numpy as np
+from PIL import Image, __version__ as pillow_version
+
+import enhanced_main
+
+# Canvas the display resize fits images into, like the main window
+DISPLAY_SIZE = (1000, 700)
+
+# Images written for the batch throughput benchmark
+BATCH_IMAGES = 8
+
+# A median this much slower than the baseline counts as a regression
+REGRESSION_THRESHOLD = 0.20
+
+# Memory budgets for the scripted editing session, in decoded images
+# (width × height × 3 bytes) unless noted
+PEAK_TRACED_BUDGET = 8.0       # Python/NumPy allocations at their peak during one step
+STEP_RSS_BUDGET = 8.0          # resident memory growth during one step
+LEAK_BUDGET = 256 * 1024       # bytes of Python/NumPy memory one step may keep
+SETUP_RSS_BUDGET = 1.5         # resident memory an operation's first run may keep (thread arenas, codecs)
+LEAK_RSS_BUDGET = 0.1          # resident memory any later run of the operation may keep
+RELEASE_BUDGET = 3.0           # resident memory left once the session is released
+
+
+def synthetic_image(megapixels, seed=0):
+    """Create a 4:3 RGB image of about the given size with gradients, shapes and noise"""
+    width = int(round(np.sqrt(megapixels * 1e6 * 4 / 3)))
+    height = width * 3 // 4
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)
+    rgb = np.empty((height, width, 3), dtype=np.uint8)
+    rgb[:, :, 0] = x[None, :]
+    rgb[:, :, 1] = y[:, None]
+    rgb[:, :, 2] = 96
+    for _ in range(12):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(rgb, center, int(rng.integers(width // 40, width // 8)), color, -1)
+    # Sensor-like noise gives the filters and the denoiser real work
+    noise = rng.integers(-12, 13, size=(height, width, 1), dtype=np.int16)
+    rgb = np.clip(rgb.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    return Image.fromarray(rgb)
+
+
+def trim_heap():
+    """Hand freed heap memory back to the OS where the C library can (glibc)
+
+    Without this, memory that was freed but still sits in malloc's arenas
+    is reused without growing RSS, and looks like no allocation at all.
+    """
+    try:
+        ctypes.CDLL(None).malloc_trim(0)
+    except (OSError, AttributeError, TypeError):
+        pass
+
+
+class MemorySampler:
+    """Track the peak resident memory above a starting point while a block runs
+
+    Worker processes that already exist when the block starts (such as the
+    shared-memory process pool behind Auto Enhance and Noise Reduction) are
+    counted along with this process.
+    """
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak = 0
+        self.stop_event = threading.Event()
+
+    def rss(self):
+        own = enhanced_main.process_rss()
+        if own is None:
+            return None
+        return own + sum(enhanced_main.process_rss(pid) or 0 for pid in self.children)
+
+    def __enter__(self):
+        self.children = enhanced_main.child_pids()
+        self.start = self.rss()
+        self.peak = self.start or 0
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def sample(self):
+        while not self.stop_event.wait(self.interval):
+            self.peak = max(self.peak, self.rss() or 0)
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.rss() or 0)
+
+    @property
+    def peak_bytes(self):
+        """Growth of resident memory at its highest point"""
+        return max(0, self.peak - self.start) if self.start is not None else None
+
+
+def display_resize(image):
+    """Fit an image into the display canvas the way the GUI does"""
+    zoom = min(DISPLAY_SIZE[0] / image.width, DISPLAY_SIZE[1] / image.height)
+    size = (max(1, int(image.width * zoom)), max(1, int(image.height * zoom)))
+    return image.resize(size, Image.Resampling.LANCZOS)
+
+
+def make_batch_operation(image, batch_images):
+    """Return a batch resize over a temporary folder of copies of image, and its cleanup"""
+    temp_dir = tempfile.mkdtemp(prefix="cropper-bench-")
+    input_folder = os.path.join(temp_dir, "in")
+    os.makedirs(input_folder)
+    for i in range(batch_images):
+        image.save(os.path.join(input_folder, f"frame_{i:03d}.jpg"), quality=90)
+    transform = enhanced_main.make_resize_transform(1280, 1280)
+    settings = {"operation": "resize", "width": 1280, "height": 1280, "maintain_ratio": True}
+
+    def run(_):
+        output_folder = os.path.join(temp_dir, "out")
+        shutil.rmtree(output_folder, ignore_errors=True)
+        enhanced_main.run_batch(input_folder, output_folder, transform, settings, "resized_")
+
+    return run, lambda: shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def operations():
+    """Return the benchmarked operations as name -> function(image)"""
+    ops = {
+        "adjustments": lambda image: enhanced_main.apply_adjustments(image, 1.2, 1.3, 1.1, 1.4),
+    }
+    for name in enhanced_main.PIL_FILTERS:
+        ops["filter:" + name.lower().replace(" ", "_")] = \
+            lambda image, name=name: enhanced_main.apply_pil_filter(image, name)
+    ops.update({
+        "auto_enhance": enhanced_main.auto_enhance_image,
+        "noise_reduction": lambda image: enhanced_main.apply_array_op("denoise", image),
+        "histogram_equalization": lambda image: Image.fromarray(enhanced_main.equalize_array(np.asarray(image))),
+        "color_balance": lambda image: Image.fromarray(enhanced_main.color_balance_array(np.asarray(image))),
+        "rotate": lambda image: image.rotate(-15, expand=True, fillcolor=(255, 255, 255)),
+        "display_resize": display_resize,
+        "histogram": enhanced_main.image_statistics,
+        "encode_jpeg": lambda image: enhanced_main.encode_image(image, io.BytesIO(), "JPEG"),
+        "encode_png": lambda image: enhanced_main.encode_image(image, io.BytesIO(), "PNG"),
+        "batch_resize": None,  # built per size, see run_benchmarks
+    })
+    return ops
+
+
+def measure(function, image, repeat, warmup=1):
+    """Run function(image) repeatedly and return its timings in seconds and peak memory"""
+    for _ in range(warmup):
+        function(image)
+    timings = []
+    peak = 0
+    for _ in range(repeat):
+        gc.collect()
+        with MemorySampler() as sampler:
+            start = time.perf_counter()
+            # Keep the result alive until the last sample so it counts towards the peak
+            result = function(image)
+            timings.append(time.perf_counter() - start)
+        del result
+        if sampler.peak_bytes is not None:
+            peak = max(peak, sampler.peak_bytes)
+    return timings, peak
+
+
+def summarize(timings):
+    """Return median, p95 and minimum of timings in milliseconds"""
+    ms = np.array(timings) * 1000
+    return {"median_ms": round(float(np.median(ms)), 3),
+            "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            "min_ms": round(float(ms.min()), 3)}
+
+
+def run_benchmarks(sizes, repeat, selected=None, batch_images=BATCH_IMAGES):
+    """Benchmark the selected operations at each size and return a list of result records"""
+    ops = operations()
+    names = [name for name in ops if not selected or name in selected]
+    results = []
+    for megapixels in sizes:
+        image = synthetic_image(megapixels)
+        print(f"📐 {megapixels} MP ({image.width}×{image.height})")
+        for name in names:
+            cleanup = None
+            function = ops[name]
+            if name == "batch_resize":
+                function, cleanup = make_batch_operation(image, batch_images)
+            try:
+                timings, peak = measure(function, image, repeat)
+            except Exception as e:
+                print(f"   ❌ {name}: {e}")
+                continue
+            finally:
+                if cleanup:
+                    cleanup()
+            record = {"operation": name, "megapixels": megapixels, "size": list(image.size),
+                      "runs": repeat, "peak_mb": round(peak / 1024 / 1024, 1)}
+            record.update(summarize(timings))
+            if name == "batch_resize":
+                record["images_per_s"] = round(batch_images / (record["median_ms"] / 1000), 2)
+            results.append(record)
+            print(f"   {name:<24} median {record['median_ms']:>10.1f} ms   "
+                  f"p95 {record['p95_ms']:>10.1f} ms   peak {record['peak_mb']:>8.1f} MB")
+        del image
+        gc.collect()
+    return results
+
+
+def _session_box(image):
+    """The selection used by selection-only edits: the centre quarter of the image"""
+    return (image.width // 4, image.height // 4, image.width * 3 // 4, image.height * 3 // 4)
+
+
+# Edits of the scripted session, applied in turn: (name, selection only, edit)
+SESSION_EDITS = [
+    ("brightness", False, lambda image: enhanced_main.apply_adjustments(image, brightness=1.1)),
+    ("sharpen", False, lambda image: enhanced_main.apply_pil_filter(image, "Sharpen")),
+    ("blur_selection", True, lambda image: enhanced_main.apply_pil_filter(image, "Blur")),
+    ("equalize", False, lambda image: Image.fromarray(enhanced_main.equalize_array(np.asarray(image)))),
+    ("rotate_90", False, lambda image: image.rotate(90, expand=True)),
+    ("color_balance_selection", True,
+     lambda image: Image.fromarray(enhanced_main.color_balance_array(np.asarray(image)))),
+    ("contrast", False, lambda image: enhanced_main.apply_adjustments(image, contrast=1.2)),
+    ("flip", False, lambda image: image.transpose(Image.FLIP_LEFT_RIGHT)),
+    ("edge_enhance_selection", True, lambda image: enhanced_main.apply_pil_filter(image, "Edge Enhance")),
+    ("auto_enhance", False, lambda image: Image.fromarray(enhanced_main.auto_enhance_array(np.asarray(image)))),
+]
+
+
+def stored_nbytes(image):
+    """Return the memory Pillow really uses for an image's pixels
+
+    Pillow keeps every multi-band mode (RGB included) at four bytes a pixel.
+    """
+    if image.mode.startswith("I;16"):
+        pixel_size = 2
+    elif len(image.getbands()) > 1 or image.mode in ("I", "F"):
+        pixel_size = 4
+    else:
+        pixel_size = 1
+    return image.width * image.height * pixel_size
+
+
+def memory_session(megapixels=12, edits=30, history_limit=enhanced_main.HISTORY_LIMIT, folder=None):
+    """Drive a scripted editing session through the non-GUI core and measure its memory
+
+    The session opens a synthetic image from disk, applies edits from
+    SESSION_EDITS (whole-image edits and selection-only edits, recorded in
+    an EditHistory as the GUI does), undoes and redoes all of them, and
+    exports PNG and JPEG files twice. Each step is measured with tracemalloc,
+    which sees Python and NumPy allocations, and RSS sampling, which also
+    sees Pillow's pixel buffers. Settled RSS (after garbage collection and
+    a heap trim) before and after each step, less the change in pixels the
+    session legitimately holds, gives the memory the step left behind.
+    Returns a report dict.
+    """
+    owns_folder = folder is None
+    folder = folder or tempfile.mkdtemp(prefix="cropper-memory-")
+    source = os.path.join(folder, "session.png")
+    synthetic_image(megapixels).save(source, compress_level=1)
+    # Load every Pillow plugin up front so their one-off imports don't look like leaks
+    Image.init()
+    gc.collect()
+    trim_heap()
+
+    steps = []
+    history = enhanced_main.EditHistory(history_limit)
+    state = {}
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    session_start = enhanced_main.process_rss()
+
+    def held_bytes():
+        # Pixels the session legitimately keeps: the open image and the undo history
+        image = state.get("image")
+        pixels = [step[2] for step in history.steps] + ([image] if image is not None else [])
+        return sum(stored_nbytes(pixel) for pixel in pixels)
+
+    def settled_rss():
+        gc.collect()
+        trim_heap()
+        return enhanced_main.process_rss()
+
+    def step(name, action):
+        held_before = held_bytes()
+        rss_before = settled_rss()
+        traced_before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        with MemorySampler() as sampler:
+            start = time.perf_counter()
+            action()
+            elapsed = time.perf_counter() - start
+        traced_peak = tracemalloc.get_traced_memory()[1] - traced_before
+        rss_after = settled_rss()
+        rss_retained = None
+        if rss_before is not None and rss_after is not None:
+            rss_retained = rss_after - rss_before - (held_bytes() - held_before)
+        steps.append({"operation": name, "seconds": round(elapsed, 4),
+                      "traced_peak": traced_peak,
+                      "traced_retained": tracemalloc.get_traced_memory()[0] - traced_before,
+                      "rss_peak": sampler.peak_bytes, "rss_retained": rss_retained,
+                      "history_bytes": history.nbytes})
+
+    def open_image():
+        state["image"] = enhanced_main.decode_image(source)
+
+    def apply(region, edit):
+        image = state["image"]
+        if region:
+            box = _session_box(image)
+            patch = enhanced_main.process_region(image, box, edit, enhanced_main.FILTER_HALO)
+            history.record_region(image, box)
+            image.paste(patch, box[:2])
+        else:
+            history.record_full(image)
+            state["image"] = edit(image)
+
+    def undo():
+        state["image"] = history.undo(state["image"])
+
+    def redo():
+        state["image"] = history.redo(state["image"])
+
+    def export(extension):
+        enhanced_main.encode_image(state["image"], os.path.join(folder, "export" + extension))
+
+    try:
+        step("open", open_image)
+        image_bytes = enhanced_main.image_nbytes(state["image"])
+        for i in range(edits):
+            name, region, edit = SESSION_EDITS[i % len(SESSION_EDITS)]
+            step(name, lambda: apply(region, edit))
+        while history.can_undo():
+            step("undo", undo)
+        while history.can_redo():
+            step("redo", redo)
+        for _ in range(2):
+            step("export_png", lambda: export(".png"))
+            step("export_jpeg", lambda: export(".jpg"))
+
+        # Drop everything the session holds and see what memory stays behind
+        history.clear()
+        state.clear()
+        gc.collect()
+        trim_heap()
+        released = enhanced_main.process_rss()
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        if owns_folder:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return {"megapixels": megapixels, "edits": edits, "history_limit": history_limit,
+            "image_bytes": image_bytes, "steps": steps,
+            "released_rss": released - session_start if session_start is not None else None}
+
+
+def check_memory_budgets(report):
+    """Return descriptions of every budget a memory session report exceeds"""
+    image_bytes = report["image_bytes"]
+    problems = []
+    seen = set()
+    for number, record in enumerate(report["steps"]):
+        label = f"step {number} ({record['operation']})"
+        # First runs may set up thread arenas and codec state that later runs reuse
+        rss_budget = LEAK_RSS_BUDGET if record["operation"] in seen else SETUP_RSS_BUDGET
+        seen.add(record["operation"])
+        retained = record["rss_retained"]
+        if retained is not None and retained > rss_budget * image_bytes:
+            problems.append(f"{label}: left {retained / image_bytes:.2f} images of resident memory behind")
+        if record["traced_peak"] > PEAK_TRACED_BUDGET * image_bytes:
+            problems.append(f"{label}: allocated {record['traced_peak'] / image_bytes:.1f} images at peak")
+        if record["rss_peak"] is not None and record["rss_peak"] > STEP_RSS_BUDGET * image_bytes:
+            problems.append(f"{label}: resident memory grew {record['rss_peak'] / image_bytes:.1f} images")
+        if record["traced_retained"] > LEAK_BUDGET:
+            problems.append(f"{label}: kept {record['traced_retained'] / 1024:.0f} KB after finishing")
+        if record["history_bytes"] > report["history_limit"] * image_bytes:
+            problems.append(f"{label}: history holds {record['history_bytes'] / image_bytes:.1f} images")
+    released = report["released_rss"]
+    if released is not None and released > RELEASE_BUDGET * image_bytes:
+        problems.append(f"released session still holds {released / image_bytes:.1f} images of memory")
+    return problems
+
+
+def print_memory_report(report):
+    """Print a per-operation summary of a memory session report"""
+    mb = 1024 * 1024
+    print(f"🧠 Memory session: {report['megapixels']} MP, {report['edits']} edits, "
+          f"one image = {report['image_bytes'] / mb:.1f} MB")
+    operations_seen = {}
+    for record in report["steps"]:
+        operations_seen.setdefault(record["operation"], []).append(record)
+    for name, records in operations_seen.items():
+        print(f"   {name:<24} x{len(records):<3} peak {max(r['traced_peak'] for r in records) / mb:>8.1f} MB traced"
+              f"   {max(r['rss_peak'] or 0 for r in records) / mb:>8.1f} MB resident"
+              f"   kept {max(r['traced_retained'] for r in records) / 1024:>8.1f} KB traced"
+              f"   {max(r['rss_retained'] or 0 for r in records) / mb:>6.1f} MB resident")
+    print(f"   history at most {max(r['history_bytes'] for r in report['steps']) / mb:.1f} MB")
+    if report["released_rss"] is not None:
+        print(f"   {report['released_rss'] / mb:.1f} MB resident after release")
+
+
+def environment():
+    """Describe the machine and library versions the results were measured with"""
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "numpy": np.__version__, "opencv": cv2.__version__,
+            "pillow": pillow_version}
+
+
+def load_results(path):
+    """Load a results file as a dict keyed by (operation, megapixels)"""
+    with open(path) as f:
+        data = json.load(f)
+    return {(record["operation"], record["megapixels"]): record for record in data["results"]}
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Print median changes between two result sets and return the regressed keys"""
+    regressions = []
+    print(f"{'operation':<26}{'MP':>6}{'baseline ms':>14}{'current ms':>14}{'change':>10}")
+    for key in sorted(set(baseline) & set(current), key=lambda key: (key[1], key[0])):
+        before, after = baseline[key]["median_ms"], current[key]["median_ms"]
+        change = (after - before) / before if before > 0 else 0.0
+        flag = ""
+        if change > threshold:
+            regressions.append(key)
+            flag = "  ⚠️"
+        print(f"{key[0]:<26}{key[1]:>6}{before:>14.1f}{after:>14.1f}{change:>+10.0%}{flag}")
+    if regressions:
+        print(f"⚠️  {len(regressions)} operations slower than the baseline by more than {threshold:.0%}")
+    else:
+        print("✅ No regressions")
+    return regressions
+
+
+def main(argv=None):
+    """Run the benchmarks or compare two result files; returns an exit code"""
+    parser = argparse.ArgumentParser(description="Benchmark Enhanced Image Cropper operations")
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 12, 50], metavar="MP",
+                        help="image sizes in megapixels (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per operation (default: %(default)s)")
+    parser.add_argument("--operations", nargs="+", metavar="NAME",
+                        help="only run these operations: " + ", ".join(operations()))
+    parser.add_argument("--batch-images", type=int, default=BATCH_IMAGES,
+                        help="images per batch throughput run (default: %(default)s)")
+    parser.add_argument("--output", default="benchmark_results.json", help="results file to write")
+    parser.add_argument("--baseline", help="results file to compare this run against")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="compare two results files without running anything")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="slowdown that counts as a regression (default: %(default)s)")
+    parser.add_argument("--memory", action="store_true",
+                        help="run the scripted editing session at each size and check its memory budgets")
+    parser.add_argument("--edits", type=int, default=30, help="edits in the memory session (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.memory:
+        problems = []
+        for megapixels in args.sizes:
+            report = memory_session(megapixels, args.edits)
+            print_memory_report(report)
+            problems += check_memory_budgets(report)
+        for problem in problems:
+            print(f"⚠️  {problem}")
+        if not problems:
+            print("✅ All memory budgets met")
+        return 1 if problems else 0
+
+    if args.compare:
+        regressions = compare(load_results(args.compare[0]), load_results(args.compare[1]), args.threshold)
+        return 1 if regressions else 0
+
+    unknown = set(args.operations or ()) - set(operations())
+    if unknown:
+        parser.error("unknown operations: " + ", ".join(sorted(unknown)))
+
+    print("⏱️  Enhanced Image Cropper benchmarks")
+    try:
+        results = run_benchmarks(args.sizes, args.repeat, args.operations, args.batch_images)
+    finally:
+        enhanced_main.shutdown_process_pool()
+    with open(args.output, "w") as f:
+        json.dump({"created": datetime.now().isoformat(timespec="seconds"), "environment": environment(),
+                   "results": results}, f, indent=2)
+    print(f"💾 Results saved to {args.output}")
+
+    if args.baseline:
+        regressions = compare(load_results(args.baseline), load_results(args.output), args.threshold)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
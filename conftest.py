@@ -0,0 +1,11 @@
+"""Shared pytest fixtures for test_features.py"""
+
+import pytest
+
+from test_features import make_test_image
+
+
+@pytest.fixture
+def img():
+    """Synthetic RGB image for the feature tests that take one"""
+    return make_test_image()
@@ -35,11 +35,3156 @@ from skimage import restoration, exposure, transform
 import sys
 import threading
 import gc
+import io
+import queue
+import sqlite3
+import time
+import hashlib
+import argparse
+import bisect
+import cProfile
+import functools
+import fnmatch
+import itertools
+import pstats
+import shutil
+import struct
+import zlib
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, CancelledError, as_completed, wait
+import multiprocessing
+from multiprocessing import shared_memory
 
 # Set theme and appearance
 ctk.set_appearance_mode("dark")
 ctk.set_default_color_theme("blue")
 
+# Image file extensions picked up by the folder browser and batch jobs
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
+
+# Bounding box for folder browser thumbnails
+THUMBNAIL_SIZE = (96, 96)
+
+# Number of folder images decoded ahead of the one being edited
+PREFETCH_AHEAD = 3
+
+# Memory budget for decoded images held by the prefetch cache
+PREFETCH_BUDGET = 512 * 1024 * 1024
+
+# Journal of completed batch work, written into each batch output folder
+MANIFEST_NAME = ".batch_manifest.jsonl"
+
+# Batch-wide list of the files written by multi-size exports
+VARIANTS_NAME = "variants.json"
+
+# Default widths for responsive multi-size exports
+DEFAULT_LADDER_WIDTHS = (320, 640, 1280, 2560)
+
+# Encoder settings per profile and Pillow format name. "fast" favours write
+# speed, "small" favours file size and "balanced" sits in between.
+ENCODER_PROFILES = {
+    "fast": {
+        "JPEG": {"quality": 95, "subsampling": "4:2:0"},
+        "PNG": {"compress_level": 1},
+        "WEBP": {"quality": 90, "method": 0},
+        "TIFF": {"compression": "packbits"},
+    },
+    "balanced": {
+        "JPEG": {"quality": 95, "optimize": True},
+        "PNG": {"compress_level": 6},
+        "WEBP": {"quality": 90, "method": 4},
+        "TIFF": {"compression": "tiff_lzw"},
+    },
+    "small": {
+        "JPEG": {"quality": 95, "optimize": True, "progressive": True},
+        "PNG": {"optimize": True},
+        "WEBP": {"quality": 90, "method": 6},
+        "TIFF": {"compression": "tiff_adobe_deflate"},
+    },
+}
+
+# PNG images above this many pixels are deflated in parallel bands
+PARALLEL_ENCODE_PIXELS = 4 * 1024 * 1024
+
+# Minimum delay between crop overlay redraws while dragging (~60 Hz)
+OVERLAY_FRAME_MS = 16
+
+# Size in screen pixels of the crop selection's drag handles
+HANDLE_SIZE = 8
+
+# Crop templates offered in the GUI and batch jobs, as width:height ratios
+CROP_TEMPLATES = {
+    "Square (1:1)": (1, 1),
+    "Portrait (4:5)": (4, 5),
+    "Landscape (16:9)": (16, 9),
+    "Instagram Post (1:1)": (1, 1),
+    "Instagram Story (9:16)": (9, 16),
+    "Facebook Cover (16:9)": (16, 9),
+    "Twitter Header (3:1)": (3, 1),
+    "YouTube Thumbnail (16:9)": (16, 9)
+}
+
+# Longest side of the proxy image that smart crop scores windows on
+SMART_CROP_PROXY = 256
+
+# Longest side of the proxy image that face detection runs on
+FACE_PROXY = 640
+
+# Longest side of the proxy image auto-trim scans for content
+TRIM_PROXY = 512
+
+# Default per-channel difference from the border colour that counts as content
+TRIM_TOLERANCE = 10
+
+# Longest side of the proxy used to find document outlines and skew
+DOCUMENT_PROXY = 800
+
+# Output tile size for the full-resolution perspective warp
+WARP_TILE = 1024
+
+# Largest skew, in degrees, that deskew searches for
+MAX_SKEW = 15
+
+# Number of undo steps kept per image
+HISTORY_LIMIT = 20
+
+# The histogram previews images above this many pixels from a reduced copy
+STATS_PREVIEW_PIXELS = 1024 * 1024
+
+# Idle time before the histogram is refreshed at full resolution
+STATS_DELAY_MS = 250
+
+# Extra pixels read around a selection for the 3x3/5x5 PIL filter kernels
+FILTER_HALO = 2
+
+# Rows per band when a filter edit runs in the background, between progress updates
+EDIT_BAND_ROWS = 256
+
+# Heavy filters on images above this many pixels run in worker processes
+OFFLOAD_PIXELS = 2 * 1024 * 1024
+
+# Frames decoded, adjusted and encoded together by a stack batch
+STACK_FRAMES = 16
+
+# Video containers read and written frame by frame, with the codec each is written with
+VIDEO_CODECS = {".mp4": "mp4v", ".m4v": "mp4v", ".mov": "mp4v", ".avi": "MJPG", ".mkv": "XVID"}
+
+# Frames in flight per worker when processing a frame stream
+FRAME_BUFFER = 2
+
+# CLAHE on images above this many pixels runs in tiled passes over row strips
+CLAHE_TILED_PIXELS = 8 * 1024 * 1024
+CLAHE_STRIP_ROWS = 256
+
+# Upper edges, in milliseconds, of the per-operation timing histogram buckets
+METRICS_BUCKETS_MS = (1, 3, 10, 30, 100, 300, 1000, 3000, 10000)
+
+# Recent timings kept per operation for the median and 95th percentile
+METRICS_SAMPLES = 512
+
+# Seconds between resident memory samples while operation memory is tracked
+MEMORY_SAMPLE_INTERVAL = 0.002
+
+
+def default_cache_dir():
+    """Return the per-user cache directory for the application"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "enhanced-image-cropper")
+
+
+def payload_nbytes(value):
+    """Return the pixel bytes of a PIL image or array, or 0 for anything else"""
+    if isinstance(value, Image.Image):
+        return image_nbytes(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    return 0
+
+
+def child_pids():
+    """Return the ids of this process's direct children, such as process pool workers"""
+    try:
+        import psutil
+        return [child.pid for child in psutil.Process(os.getpid()).children()]
+    except ImportError:
+        pass
+    pids = []
+    try:
+        names = os.listdir("/proc")
+    except OSError:
+        return pids
+    for name in names:
+        if name.isdigit():
+            try:
+                with open(f"/proc/{name}/stat") as f:
+                    # The command name may contain spaces, so split after its closing parenthesis
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == os.getpid():
+                        pids.append(int(name))
+            except (OSError, ValueError, IndexError):
+                continue
+    return pids
+
+
+def process_rss(pid=None):
+    """Return the resident memory of a process (default: this one) in bytes, or None if unknown"""
+    pid = pid or os.getpid()
+    try:
+        import psutil
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    except ImportError:
+        pass
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class OperationMetrics:
+    """Running totals and a timing histogram for one named operation"""
+
+    def __init__(self):
+        self.count = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.nbytes = 0
+        self.peak = 0
+        self.buckets = [0] * (len(METRICS_BUCKETS_MS) + 1)
+        self.samples = deque(maxlen=METRICS_SAMPLES)
+
+    def add(self, wall, cpu, nbytes=0, peak=0):
+        """Record one run of the operation"""
+        self.count += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.nbytes += nbytes
+        self.peak = max(self.peak, peak)
+        self.buckets[bisect.bisect_left(METRICS_BUCKETS_MS, wall * 1000)] += 1
+        self.samples.append(wall)
+
+    def summary(self):
+        """Return the totals as a JSON-friendly dict"""
+        samples = sorted(self.samples)
+        return {
+            "count": self.count,
+            "wall_seconds": self.wall,
+            "cpu_seconds": self.cpu,
+            "mean_ms": self.wall / self.count * 1000 if self.count else 0.0,
+            "median_ms": samples[len(samples) // 2] * 1000 if samples else 0.0,
+            "p95_ms": samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000 if samples else 0.0,
+            "bytes": self.nbytes,
+            "mb_per_second": self.nbytes / self.wall / 1e6 if self.wall > 0 else 0.0,
+            "peak_bytes": self.peak,
+            "histogram": list(self.buckets),
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe, in-process store of per-operation timings
+
+    Memory sampling and cProfile are off by default because both slow
+    every operation down; turn them on while investigating. Peak memory is
+    the growth of the whole process's resident memory (plus that of any
+    worker processes the operation used), sampled every
+    MEMORY_SAMPLE_INTERVAL, so Pillow and NumPy pixel buffers are counted.
+    It is only recorded for outermost operations, and operations that
+    overlap in time, like the stages of a batch, see each other's growth.
+    Memory freed earlier and reused from malloc's arenas does not grow RSS;
+    callers wanting repeatable figures trim the heap between runs, as
+    benchmark.py does.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.operations = {}
+        self.trace_memory = False
+        self.profiling = False
+        self.active = set()
+        self.sampler = None
+        self.sampler_stop = threading.Event()
+        self.profile_stats = None
+        self.local = threading.local()
+
+    def record(self, name, wall, cpu, nbytes=0, peak=0):
+        """Add one timed run of an operation"""
+        with self.lock:
+            metrics = self.operations.get(name)
+            if metrics is None:
+                metrics = self.operations[name] = OperationMetrics()
+            metrics.add(wall, cpu, nbytes, peak)
+
+    def reset(self):
+        """Forget every recorded operation and profile"""
+        with self.lock:
+            self.operations.clear()
+            self.profile_stats = None
+
+    def set_memory_tracing(self, enabled):
+        """Record each operation's peak memory growth, using a sampling thread"""
+        self.trace_memory = enabled and process_rss() is not None
+        if self.trace_memory and self.sampler is None:
+            self.sampler_stop.clear()
+            self.sampler = threading.Thread(target=self._sample_memory, daemon=True)
+            self.sampler.start()
+        elif not self.trace_memory and self.sampler is not None:
+            self.sampler_stop.set()
+            self.sampler.join()
+            self.sampler = None
+
+    def _sample_memory(self):
+        while not self.sampler_stop.wait(MEMORY_SAMPLE_INTERVAL):
+            with self.lock:
+                timers = list(self.active)
+            if timers:
+                rss = process_rss() or 0
+                for timer in timers:
+                    timer.peak_memory = max(timer.peak_memory, rss)
+
+    def set_profiling(self, enabled):
+        """Run every outermost tracked operation under cProfile"""
+        self.profiling = enabled
+
+    def add_profile(self, profile):
+        """Merge a finished cProfile.Profile into the collected statistics"""
+        with self.lock:
+            if self.profile_stats is None:
+                self.profile_stats = pstats.Stats(profile)
+            else:
+                self.profile_stats.add(profile)
+
+    def save_profile(self, path):
+        """Write the collected profile for pstats or snakeviz; return False if empty"""
+        with self.lock:
+            if self.profile_stats is None:
+                return False
+            self.profile_stats.dump_stats(path)
+        return True
+
+    def summary(self):
+        """Return {operation: totals} for every recorded operation"""
+        with self.lock:
+            return {name: metrics.summary() for name, metrics in sorted(self.operations.items())}
+
+    def report(self):
+        """Return a text table of the operations with a timing histogram each"""
+        summary = self.summary()
+        if not summary:
+            return "No operations recorded"
+        bars = " ▁▂▃▄▅▆▇█"
+        edges = [f"{ms}ms" if ms < 1000 else f"{ms // 1000}s" for ms in METRICS_BUCKETS_MS]
+        legend = " ".join(f"<{edge}" for edge in edges) + f" >={edges[-1]}"
+        lines = [f"{'operation':<22} {'count':>6} {'total s':>8} {'median':>9} {'p95':>9} "
+                 f"{'cpu %':>6} {'MB/s':>8} {'peak MB':>8}"]
+        for name, entry in summary.items():
+            cpu_share = entry["cpu_seconds"] / entry["wall_seconds"] * 100 if entry["wall_seconds"] else 0.0
+            lines.append(f"{name:<22} {entry['count']:>6} {entry['wall_seconds']:>8.2f} "
+                         f"{entry['median_ms']:>7.1f}ms {entry['p95_ms']:>7.1f}ms {cpu_share:>6.0f} "
+                         f"{entry['mb_per_second']:>8.1f} {entry['peak_bytes'] / 1e6:>8.1f}")
+            most = max(entry["histogram"])
+            histogram = "".join(bars[math.ceil(count / most * (len(bars) - 1))] for count in entry["histogram"])
+            lines.append(f"{'':<22} |{histogram}|")
+        lines.append(f"Histogram buckets: {legend}")
+        return "\n".join(lines)
+
+
+# Registry every tracked operation reports to
+METRICS = MetricsRegistry()
+
+
+class OperationTimer:
+    """Context manager that times a block and records it in a MetricsRegistry
+
+    Set nbytes inside the block when the size is only known afterwards.
+    CPU time is the calling thread's plus whatever helper threads and worker
+    processes report back through credited() and credit().
+    """
+
+    def __init__(self, name, nbytes=0, registry=None):
+        self.name = name
+        self.nbytes = nbytes
+        self.registry = registry or METRICS
+        self.profile = None
+        self.lock = threading.Lock()
+        self.helper_cpu = 0.0
+        self.helper_memory = 0
+
+    def credit(self, cpu=0.0, memory=0):
+        """Add CPU seconds and memory growth from work done off this thread"""
+        with self.lock:
+            self.helper_cpu += cpu
+            self.helper_memory += memory
+
+    def __enter__(self):
+        registry = self.registry
+        self.stack = getattr(registry.local, "stack", None)
+        if self.stack is None:
+            self.stack = registry.local.stack = []
+        # Nested operations run inside their parent's sample, so only the outermost takes one
+        self.tracing = registry.trace_memory and not self.stack
+        if self.tracing:
+            self.start_memory = self.peak_memory = process_rss() or 0
+            with registry.lock:
+                registry.active.add(self)
+        if registry.profiling and not self.stack:
+            self.profile = cProfile.Profile()
+            try:
+                self.profile.enable()
+            except ValueError:
+                # Another profiler is already running on this thread
+                self.profile = None
+        self.stack.append(self)
+        self.start_cpu = time.thread_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.start
+        cpu = time.thread_time() - self.start_cpu + self.helper_cpu
+        self.stack.pop()
+        if self.profile is not None:
+            self.profile.disable()
+            self.registry.add_profile(self.profile)
+            self.profile = None
+        peak = 0
+        if self.tracing:
+            with self.registry.lock:
+                self.registry.active.discard(self)
+            self.peak_memory = max(self.peak_memory, process_rss() or 0)
+            peak = max(0, self.peak_memory - self.start_memory) + self.helper_memory
+        # Helper work is off the parent's thread too, so pass it up
+        if self.stack:
+            parent = self.stack[-1]
+            with parent.lock:
+                parent.helper_cpu += self.helper_cpu
+                parent.helper_memory = max(parent.helper_memory, self.helper_memory)
+        self.registry.record(self.name, wall, cpu, self.nbytes, peak)
+        return False
+
+
+def current_operation(registry=None):
+    """Return the innermost operation being timed on this thread, or None"""
+    stack = getattr((registry or METRICS).local, "stack", None)
+    return stack[-1] if stack else None
+
+
+def credited(function):
+    """Wrap work handed to a helper thread so its CPU time counts towards the caller's operation"""
+    operation = current_operation()
+    if operation is None:
+        return function
+
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        start = time.thread_time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            operation.credit(time.thread_time() - start)
+    return run
+
+
+def track_operation(name, nbytes=0, registry=None):
+    """Time a block (with track_operation(...):) in the metrics registry"""
+    return OperationTimer(name, nbytes, registry)
+
+
+def tracked(name):
+    """Decorator that records every call of a function as an operation
+
+    Bytes processed are taken from the first image or array argument, or
+    from the result when there is none.
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            nbytes = next((payload_nbytes(arg) for arg in args if payload_nbytes(arg)), 0)
+            with OperationTimer(name, nbytes) as timer:
+                result = function(*args, **kwargs)
+                if not nbytes:
+                    timer.nbytes = payload_nbytes(result)
+            return result
+        return wrapper
+    return decorate
+
+
+def load_rgb_image(path):
+    """Open an image file and convert it to RGB if necessary"""
+    image = Image.open(path)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGB')
+    return image
+
+
+@tracked("decode")
+def decode_image(path):
+    """Open an image file as RGB and force the pixel data to be decoded"""
+    image = load_rgb_image(path)
+    image.load()
+    return image
+
+
+def image_nbytes(image):
+    """Return the approximate memory held by a decoded PIL image"""
+    return image.width * image.height * len(image.getbands())
+
+
+def make_thumbnail(path, size=THUMBNAIL_SIZE):
+    """Decode a file into JPEG-encoded thumbnail bytes"""
+    with Image.open(path) as image:
+        # Let the JPEG decoder downscale in the DCT domain instead of
+        # decoding the full frame and throwing most of it away
+        image.draft("RGB", size)
+        thumb = image.convert("RGB")
+        thumb.thumbnail(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    buffer = io.BytesIO()
+    thumb.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class ThumbnailCache:
+    """Persistent thumbnail store kept in a single SQLite file
+
+    Entries are keyed by path and only returned while the file's mtime and
+    size still match, so edited images get re-rendered automatically.
+    """
+
+    def __init__(self, db_path=None, size=THUMBNAIL_SIZE):
+        if db_path is None:
+            db_path = os.path.join(default_cache_dir(), "thumbnails.db")
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        self.db_path = db_path
+        self.size = size
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS thumbnails ("
+            "path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, data BLOB NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, path, mtime, size):
+        """Return cached thumbnail bytes for a file, or None if stale or missing"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mtime, size, data FROM thumbnails WHERE path = ?", (path,)
+            ).fetchone()
+        if row and row[0] == mtime and row[1] == size:
+            return row[2]
+        return None
+
+    def get_many(self, entries):
+        """Look up (path, mtime, size) entries in bulk and return {path: bytes} for hits"""
+        wanted = {path: (mtime, size) for path, mtime, size in entries}
+        paths = list(wanted)
+        hits = {}
+
+        # Query in chunks to stay under SQLite's bound-parameter limit
+        with self._lock:
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT path, mtime, size, data FROM thumbnails WHERE path IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                for path, mtime, size, data in rows:
+                    if wanted[path] == (mtime, size):
+                        hits[path] = data
+        return hits
+
+    def put(self, path, mtime, size, data):
+        """Store thumbnail bytes for a file"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO thumbnails (path, mtime, size, data) VALUES (?, ?, ?, ?)",
+                (path, mtime, size, data)
+            )
+            self._conn.commit()
+
+    def generate(self, path, mtime, size):
+        """Render a thumbnail for a file, store it and return the bytes"""
+        data = make_thumbnail(path, self.size)
+        self.put(path, mtime, size, data)
+        return data
+
+    def close(self):
+        """Close the underlying database"""
+        with self._lock:
+            self._conn.close()
+
+
+class PrefetchCache:
+    """Decoded-image cache filled by background read-ahead
+
+    Images are evicted least recently used first once their decoded size
+    exceeds the memory budget. Requests for an image that is still being
+    prefetched wait for that decode instead of starting a second one.
+    clear() starts a new generation: decodes still running from before it
+    finish without storing their image.
+    """
+
+    def __init__(self, budget=PREFETCH_BUDGET, workers=2, loader=decode_image):
+        self.budget = budget
+        self.loader = loader
+        self.nbytes = 0
+        self._images = OrderedDict()
+        self._pending = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+    def __contains__(self, path):
+        with self._lock:
+            return path in self._images
+
+    def get(self, path):
+        """Return the decoded image for a path, decoding it now if needed"""
+        with self._lock:
+            image = self._images.get(path)
+            if image is not None:
+                self._images.move_to_end(path)
+                return image
+            future = self._pending.get(path)
+            generation = self._generation
+
+        if future is not None:
+            try:
+                return future.result()
+            except CancelledError:
+                pass
+
+        image = self.loader(path)
+        self._store(path, image, generation)
+        return image
+
+    def prefetch(self, paths):
+        """Decode paths in the background, dropping queued work for other paths"""
+        wanted = set(paths)
+        with self._lock:
+            for path, future in list(self._pending.items()):
+                if path not in wanted and future.cancel():
+                    del self._pending[path]
+
+            for path in paths:
+                if path not in self._images and path not in self._pending:
+                    self._pending[path] = self._pool.submit(self._load, path, self._generation)
+
+    def clear(self):
+        """Drop all cached images and queued prefetches"""
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending = {}
+            self._generation += 1
+            self._images.clear()
+            self.nbytes = 0
+
+    def shutdown(self):
+        """Stop the prefetch workers"""
+        self.clear()
+        self._pool.shutdown(wait=False)
+
+    def _load(self, path, generation):
+        try:
+            image = self.loader(path)
+            self._store(path, image, generation)
+            return image
+        finally:
+            with self._lock:
+                if generation == self._generation:
+                    self._pending.pop(path, None)
+
+    def _store(self, path, image, generation):
+        nbytes = image_nbytes(image)
+        with self._lock:
+            if generation != self._generation or nbytes > self.budget:
+                return
+
+            previous = self._images.pop(path, None)
+            if previous is not None:
+                self.nbytes -= image_nbytes(previous)
+
+            self._images[path] = image
+            self.nbytes += nbytes
+
+            while self.nbytes > self.budget:
+                _, evicted = self._images.popitem(last=False)
+                self.nbytes -= image_nbytes(evicted)
+
+
+def image_format(path):
+    """Return the Pillow format name for a file path's extension"""
+    extension = os.path.splitext(path)[1].lower()
+    image_format = Image.registered_extensions().get(extension)
+    if image_format is None:
+        raise ValueError(f"Unknown image format for {path}")
+    return image_format
+
+
+def encoder_options(image_format, profile="balanced", **overrides):
+    """Return save() keyword arguments for a format under an encoder profile"""
+    if profile not in ENCODER_PROFILES:
+        raise ValueError(f"Unknown encoder profile: {profile}")
+    options = dict(ENCODER_PROFILES[profile].get(image_format.upper(), {}))
+    options.update(overrides)
+    return options
+
+
+def _png_chunk(chunk_type, data):
+    """Build one length-prefixed, CRC-terminated PNG chunk"""
+    return (struct.pack(">I", len(data)) + chunk_type + data +
+            struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def write_png_parallel(image, fp, compress_level=6, workers=None):
+    """Write an 8-bit L/LA/RGB/RGBA image as PNG, deflating row bands in threads
+
+    Every row uses the Up filter. Bands are compressed as raw deflate
+    streams primed with the tail of the previous band and joined with sync
+    flushes, so the result is a single ordinary zlib stream.
+    """
+    color_types = {"L": 0, "RGB": 2, "LA": 4, "RGBA": 6}
+    pixels = np.asarray(image)
+    height = image.height
+    rows = pixels.reshape(height, -1)
+    filtered = np.empty((height, rows.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 0] = 2
+    filtered[0, 1:] = rows[0]
+    np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:], dtype=np.uint8)
+
+    workers = workers or os.cpu_count() or 1
+    band_rows = max(16, -(-height // (workers * 4)))
+    bands = [filtered[start:start + band_rows].tobytes() for start in range(0, height, band_rows)]
+
+    def deflate(index):
+        options = {}
+        if index:
+            options["zdict"] = bands[index - 1][-32768:]
+        compressor = zlib.compressobj(compress_level, zlib.DEFLATED, -15, **options)
+        last = index == len(bands) - 1
+        return compressor.compress(bands[index]) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        compressed = list(pool.map(credited(deflate), range(len(bands))))
+
+    checksum = 1
+    for band in bands:
+        checksum = zlib.adler32(band, checksum)
+    stream = b"\x78\x9c" + b"".join(compressed) + struct.pack(">I", checksum & 0xffffffff)
+
+    header = struct.pack(">IIBBBBB", image.width, height, 8, color_types[image.mode], 0, 0, 0)
+    fp.write(b"\x89PNG\r\n\x1a\n")
+    fp.write(_png_chunk(b"IHDR", header))
+    chunk_size = 8 * 1024 * 1024
+    for start in range(0, len(stream), chunk_size):
+        fp.write(_png_chunk(b"IDAT", stream[start:start + chunk_size]))
+    fp.write(_png_chunk(b"IEND", b""))
+
+
+@tracked("encode")
+def encode_image(image, fp, format=None, profile="balanced", workers=None, **overrides):
+    """Save an image with encoder profile settings
+
+    fp is a path or a binary file object; format defaults to the path's
+    extension. Large PNGs are deflated on several threads unless the profile
+    asks for Pillow's exhaustive optimizer.
+    """
+    if format is None:
+        format = image_format(fp)
+    format = format.upper()
+    options = encoder_options(format, profile, **overrides)
+
+    if (format == "PNG" and not options.get("optimize")
+            and image.mode in ("L", "LA", "RGB", "RGBA")
+            and image.width * image.height >= PARALLEL_ENCODE_PIXELS
+            and not set(image.info) & {"icc_profile", "transparency", "dpi"}
+            and set(options) <= {"compress_level"}):
+        level = options.get("compress_level", 6)
+        if isinstance(fp, (str, bytes, os.PathLike)):
+            with open(fp, "wb") as f:
+                write_png_parallel(image, f, level, workers)
+        else:
+            write_png_parallel(image, fp, level, workers)
+        return
+
+    image.save(fp, format=format, **options)
+
+
+def encode_to_target_size(image, target_bytes, format="JPEG", profile="balanced",
+                          min_quality=10, max_quality=95, tolerance=0.05, strict=False):
+    """Encode a lossy image at the highest quality that fits a byte budget
+
+    Quality is bisected with in-memory encodes, stopping early once a result
+    lands within tolerance of the budget. For WebP the search continues above
+    the best fit with method 6, the slowest and smallest method, which can
+    fit a higher quality than the profile's own method. Returns the encoded
+    bytes and the quality used. If even min_quality at method 6 is over the
+    budget, the smallest encode is returned, or ValueError is raised when
+    strict.
+    """
+    format = format.upper()
+    if format not in ("JPEG", "WEBP"):
+        raise ValueError("Target size needs a lossy format (JPEG or WebP)")
+    if format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    cache = {}
+
+    def encode(quality, **overrides):
+        key = (quality, tuple(sorted(overrides.items())))
+        if key not in cache:
+            buffer = io.BytesIO()
+            image.save(buffer, format=format,
+                       **encoder_options(format, profile, quality=quality, **overrides))
+            cache[key] = buffer.getvalue()
+        return cache[key]
+
+    data = encode(max_quality)
+    if len(data) <= target_bytes:
+        return data, max_quality
+
+    searches = [{}]
+    if format == "WEBP" and encoder_options(format, profile).get("method") != 6:
+        searches.append({"method": 6})
+
+    # Invariant: low fits the budget (or is below min_quality), high does not
+    low, high, best = min_quality - 1, max_quality, None
+    for overrides in searches:
+        while high - low > 1:
+            quality = (low + high) // 2
+            data = encode(quality, **overrides)
+            if len(data) <= target_bytes:
+                low, best = quality, data
+                if len(data) >= target_bytes * (1 - tolerance):
+                    break
+            else:
+                high = quality
+        # Qualities the profile's method missed may still fit with method 6
+        high = max_quality + 1
+
+    if best is None:
+        data = encode(min_quality, **searches[-1])
+        if strict:
+            raise ValueError(f"Smallest encode is {len(data) // 1024}KB, "
+                             f"over the {target_bytes // 1024}KB target")
+        return data, min_quality
+    return best, low
+
+
+def variant_path(output_path, suffix):
+    """Return the path of a named variant next to an output path"""
+    stem, extension = os.path.splitext(output_path)
+    return f"{stem}-{suffix}{extension}"
+
+
+def resize_ladder(image, widths):
+    """Resample an image down a ladder of widths, each from the next larger one
+
+    Returns a dict mapping "<width>w" to the resized image, largest first.
+    Images are never upscaled: widths at or beyond the source collapse into
+    one full-size variant keyed by the source width, so every key matches
+    the pixels behind it.
+    """
+    variants = {}
+    current = image
+    for width in sorted({min(width, image.width) for width in widths}, reverse=True):
+        height = max(1, round(image.height * width / image.width))
+        if current.size != (width, height):
+            current = current.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        variants[f"{width}w"] = current
+    return variants
+
+
+def write_variants(variants, output_path, profile="balanced", target_size=None, workers=None,
+                   **overrides):
+    """Encode named variants in parallel next to output_path
+
+    Returns one manifest entry per written file, smallest first.
+    """
+    def write(item):
+        suffix, image = item
+        path = variant_path(output_path, suffix)
+        if target_size:
+            data, _ = encode_to_target_size(image, target_size, image_format(path), profile, strict=True)
+            with open(path, "wb") as f:
+                f.write(data)
+        else:
+            # Variants already encode side by side, so each keeps to one thread
+            encode_image(image, path, profile=profile, workers=1, **overrides)
+        return {"path": path, "width": image.width, "height": image.height,
+                "bytes": os.path.getsize(path)}
+
+    with ThreadPoolExecutor(max_workers=workers or min(len(variants), os.cpu_count() or 1)) as pool:
+        entries = list(pool.map(credited(write), variants.items()))
+    return sorted(entries, key=lambda entry: entry["width"])
+
+
+def export_variants(image, output_path, widths=DEFAULT_LADDER_WIDTHS, profile="balanced"):
+    """Export a responsive size ladder of one image and a JSON manifest of it
+
+    The manifest is written next to the outputs as <stem>.json, with paths
+    relative to it. Returns the manifest path and entries.
+    """
+    entries = write_variants(resize_ladder(image, widths), output_path, profile)
+    folder = os.path.dirname(os.path.abspath(output_path))
+    manifest_path = os.path.splitext(output_path)[0] + ".json"
+    with open(manifest_path, "w") as f:
+        json.dump({"source": {"width": image.width, "height": image.height},
+                   "variants": [dict(entry, path=os.path.relpath(entry["path"], folder))
+                                for entry in entries]}, f, indent=2)
+    return manifest_path, entries
+
+
+def make_ladder_transform(widths):
+    """Create a batch transform producing a responsive size ladder"""
+    def ladder(image, job):
+        return resize_ladder(image, widths)
+    return ladder
+
+
+class SharedImageBuffer:
+    """A NumPy array backed by multiprocessing shared memory
+
+    The owning process creates the buffer and passes its handle to worker
+    processes, which attach to the same memory instead of receiving a
+    pickled copy. array is a regular ndarray view, so OpenCV can use it
+    directly and PIL can wrap it with to_image().
+    """
+
+    def __init__(self, shape, dtype=np.uint8, name=None):
+        dtype = np.dtype(dtype)
+        self.owner = name is None
+        if self.owner:
+            size = max(1, int(np.prod(shape)) * dtype.itemsize)
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+
+    @classmethod
+    def from_array(cls, array):
+        """Create a shared buffer holding a copy of an array"""
+        buffer = cls(array.shape, array.dtype)
+        buffer.array[...] = array
+        return buffer
+
+    @classmethod
+    def from_image(cls, image):
+        """Create a shared buffer holding a PIL image's pixels"""
+        return cls.from_array(np.asarray(image))
+
+    @classmethod
+    def attach(cls, handle):
+        """Attach to a buffer created by another process"""
+        name, shape, dtype = handle
+        return cls(shape, dtype, name=name)
+
+    @property
+    def handle(self):
+        """Picklable reference to the buffer: (name, shape, dtype)"""
+        return (self.shm.name, self.array.shape, self.array.dtype.str)
+
+    def to_image(self):
+        """Return a PIL image copied out of the buffer"""
+        return Image.fromarray(self.array.copy())
+
+    def close(self):
+        """Detach from the memory, freeing it if this process created it"""
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+_clahe_objects = threading.local()
+
+
+def get_clahe(clip_limit=3.0, grid=(8, 8)):
+    """Return this thread's OpenCV CLAHE object for the given settings"""
+    cache = getattr(_clahe_objects, "cache", None)
+    if cache is None:
+        cache = _clahe_objects.cache = {}
+    key = (clip_limit, tuple(grid))
+    if key not in cache:
+        cache[key] = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tuple(grid))
+    return cache[key]
+
+
+def _reflect_indices(start, stop, size):
+    """Indices start:stop, mirrored past the end of an axis like BORDER_REFLECT_101"""
+    index = np.arange(start, stop)
+    return np.where(index < size, index, 2 * (size - 1) - index)
+
+
+def _clahe_tile_histograms(channel, row, tile, grid_x):
+    """Return the (grid_x, 256) histograms of one row of CLAHE tiles"""
+    height, width = channel.shape
+    tile_w, tile_h = tile
+    top, bottom = row * tile_h, (row + 1) * tile_h
+    if bottom <= height:
+        strip = channel[top:bottom]
+    else:
+        strip = channel[_reflect_indices(top, bottom, height)]
+    if grid_x * tile_w > width:
+        strip = strip[:, _reflect_indices(0, grid_x * tile_w, width)]
+    return np.stack([cv2.calcHist([strip[:, x * tile_w:(x + 1) * tile_w]], [0], None, [256], [0, 256]).ravel()
+                     for x in range(grid_x)])
+
+
+def _clahe_luts(histograms, clip_limit, tile_area):
+    """Turn tile histograms into clipped equalization lookup tables"""
+    histograms = np.rint(histograms).astype(np.int64)
+    if clip_limit > 0:
+        limit = max(int(clip_limit * tile_area / 256), 1)
+        excess = np.maximum(histograms - limit, 0).sum(axis=-1)
+        histograms = np.minimum(histograms, limit) + (excess // 256)[..., None]
+        # Hand out the remainder one count per bin at an even step
+        residual = (excess % 256)[..., None]
+        step = np.maximum(256 // np.maximum(residual, 1), 1)
+        bins = np.arange(256)
+        histograms += (bins % step == 0) & (bins // step < residual)
+    scale = np.float32(255) / np.float32(tile_area)
+    luts = np.rint(np.cumsum(histograms, axis=-1).astype(np.float32) * scale)
+    return np.clip(luts, 0, 255).astype(np.uint8)
+
+
+def _clahe_weights(size, tile_size, tiles):
+    """Return the neighbouring tiles and blend weights along one axis
+
+    The result lists (start, stop, first, second) runs of positions that
+    blend the same pair of tiles, and the weight of the second tile at
+    each position.
+    """
+    position = np.arange(size, dtype=np.float32) * (np.float32(1) / np.float32(tile_size)) - np.float32(0.5)
+    first = np.floor(position)
+    weight = position - first
+    first = first.astype(np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(first)) + 1))
+    stops = np.append(starts[1:], size)
+    runs = [(start, stop, max(first[start], 0), min(first[start] + 1, tiles - 1))
+            for start, stop in zip(starts, stops)]
+    return runs, weight
+
+
+def _clahe_remap(channel, luts, rows, columns, out, start, stop):
+    """Map rows start:stop of channel through bilinearly blended tile tables into out"""
+    row_runs, row_weight = rows
+    column_runs, column_weight = columns
+    for top, bottom, y1, y2 in row_runs:
+        top, bottom = max(top, start), min(bottom, stop)
+        if top >= bottom:
+            continue
+        ya = row_weight[top:bottom, None]
+        for left, right, x1, x2 in column_runs:
+            block = channel[top:bottom, left:right]
+            xa = column_weight[left:right]
+            upper = cv2.LUT(block, luts[y1, x1]) * (1 - xa) + cv2.LUT(block, luts[y1, x2]) * xa
+            lower = cv2.LUT(block, luts[y2, x1]) * (1 - xa) + cv2.LUT(block, luts[y2, x2]) * xa
+            out[top:bottom, left:right] = np.rint(upper * (1 - ya) + lower * ya)
+
+
+def apply_clahe(channel, clip_limit=3.0, grid=(8, 8), workers=None, out=None):
+    """Contrast-limited adaptive histogram equalization of a uint8 channel, in tiled passes
+
+    Gives the same result as cv2.createCLAHE(clip_limit, grid).apply(),
+    but never works on the whole image at once: tile histograms are taken
+    one row of tiles at a time and pixels are remapped in strips of
+    CLAHE_STRIP_ROWS, both spread over a thread pool. channel and out can
+    be np.memmap arrays, so images larger than memory can be processed.
+    """
+    height, width = channel.shape
+    grid_x, grid_y = grid
+    if width % grid_x or height % grid_y:
+        # OpenCV pads both axes with mirrored pixels when either doesn't divide evenly
+        tile = ((width + grid_x - width % grid_x) // grid_x, (height + grid_y - height % grid_y) // grid_y)
+    else:
+        tile = (width // grid_x, height // grid_y)
+    if out is None:
+        out = np.empty((height, width), dtype=np.uint8)
+    rows = _clahe_weights(height, tile[1], grid_y)
+    columns = _clahe_weights(width, tile[0], grid_x)
+    strips = range(0, height, CLAHE_STRIP_ROWS)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        histograms = np.stack(list(pool.map(
+            credited(lambda row: _clahe_tile_histograms(channel, row, tile, grid_x)), range(grid_y))))
+        luts = _clahe_luts(histograms, clip_limit, tile[0] * tile[1])
+        list(pool.map(credited(lambda start: _clahe_remap(channel, luts, rows, columns, out,
+                                                          start, min(start + CLAHE_STRIP_ROWS, height))),
+                      strips))
+    return out
+
+
+def auto_enhance_array(rgb, clip_limit=3.0, grid=(8, 8), workers=None):
+    """Apply CLAHE to the lightness of an RGB array
+
+    Large arrays are converted in strips of CLAHE_STRIP_ROWS: only the
+    lightness channel is kept for the whole frame (CLAHE needs all of its
+    tiles), and it is equalized in place before each strip is rebuilt,
+    so no full-size LAB copy is ever made.
+    """
+    height = rgb.shape[0]
+    if rgb.shape[0] * rgb.shape[1] < CLAHE_TILED_PIXELS:
+        lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB)
+        l, a, b = cv2.split(lab)
+        l = get_clahe(clip_limit, grid).apply(l)
+        return cv2.cvtColor(cv2.merge([l, a, b]), cv2.COLOR_LAB2RGB)
+
+    lightness = np.empty(rgb.shape[:2], dtype=np.uint8)
+    out = np.empty_like(rgb)
+    strips = [(start, min(start + CLAHE_STRIP_ROWS, height)) for start in range(0, height, CLAHE_STRIP_ROWS)]
+
+    def split(strip):
+        start, stop = strip
+        lightness[start:stop] = cv2.cvtColor(rgb[start:stop], cv2.COLOR_RGB2LAB)[:, :, 0]
+
+    def merge(strip):
+        start, stop = strip
+        lab = cv2.cvtColor(rgb[start:stop], cv2.COLOR_RGB2LAB)
+        lab[:, :, 0] = lightness[start:stop]
+        out[start:stop] = cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        list(pool.map(credited(split), strips))
+        # The remap only reads the rows it writes, so it can work in place
+        apply_clahe(lightness, clip_limit, grid, workers, out=lightness)
+        list(pool.map(credited(merge), strips))
+    return out
+
+
+def denoise_array(rgb):
+    """Apply non-local means denoising to an RGB array"""
+    bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+    denoised = cv2.fastNlMeansDenoisingColored(bgr, None, 10, 10, 7, 21)
+    return cv2.cvtColor(denoised, cv2.COLOR_BGR2RGB)
+
+
+# Array operations that worker processes can run on shared buffers, with
+# the number of neighbouring rows each output row depends on. Whole-frame
+# operations such as auto_enhance_array are left out: one band in one
+# worker would only add the copy into shared memory.
+SHARED_OPS = {
+    # Template window 7 plus search window 21
+    "denoise": (denoise_array, 13),
+}
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def _init_worker():
+    # Each worker handles one band, so keep OpenCV from spawning its own threads
+    cv2.setNumThreads(1)
+
+
+def get_process_pool():
+    """Return the shared worker process pool, starting it on first use"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # spawn rather than fork: the GUI process runs Tk and helper threads
+            _process_pool = ProcessPoolExecutor(mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=_init_worker)
+        return _process_pool
+
+
+def shutdown_process_pool():
+    """Stop the worker process pool if it was started"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False)
+            _process_pool = None
+
+
+def _run_shared_band(op_name, source_handle, target_handle, start, stop, measure_memory=False):
+    """Worker entry point: apply an operation to rows start:stop of a shared buffer
+
+    Returns the CPU seconds the band took and how much the worker's
+    resident memory grew (0 unless measure_memory), for the caller's
+    operation metrics.
+    """
+    op, halo = SHARED_OPS[op_name]
+    start_cpu = time.process_time()
+    if measure_memory:
+        start_memory = process_rss() or 0
+    with SharedImageBuffer.attach(source_handle) as source, \
+            SharedImageBuffer.attach(target_handle) as target:
+        top = max(0, start - halo)
+        bottom = min(source.array.shape[0], stop + halo)
+        result = op(source.array[top:bottom])
+        target.array[start:stop] = result[start - top:start - top + stop - start]
+        memory = max(0, (process_rss() or 0) - start_memory) if measure_memory else 0
+    return time.process_time() - start_cpu, memory
+
+
+def run_shared_op(op_name, array, workers=None):
+    """Run a SHARED_OPS operation on an array in worker processes
+
+    The array is copied once into shared memory; workers read it and write
+    their rows of the result by handle, so no pixels are pickled. Returns
+    the result as a new array. Progress is reported to the current task
+    as bands finish, and a cancelled task stops the remaining bands.
+    """
+    op, halo = SHARED_OPS[op_name]
+    pool = get_process_pool()
+    height = array.shape[0]
+    workers = workers or os.cpu_count() or 1
+    band_rows = max(halo * 4, -(-height // workers))
+    bands = [(start, min(start + band_rows, height)) for start in range(0, height, band_rows)]
+
+    with SharedImageBuffer.from_array(array) as source, \
+            SharedImageBuffer(array.shape, array.dtype) as target:
+        operation = current_operation()
+        measure_memory = operation is not None and METRICS.trace_memory
+        futures = [pool.submit(_run_shared_band, op_name, source.handle, target.handle, start, stop,
+                               measure_memory)
+                   for start, stop in bands]
+        for future in wait_for_bands(futures):
+            cpu, memory = future.result()
+            if operation is not None:
+                operation.credit(cpu, memory)
+        return target.array.copy()
+
+
+def apply_array_op(op_name, image):
+    """Apply a SHARED_OPS operation to a PIL image, offloading large images"""
+    with track_operation(op_name, image_nbytes(image)):
+        array = np.asarray(image.convert("RGB"))
+        if image.width * image.height >= OFFLOAD_PIXELS:
+            return Image.fromarray(run_shared_op(op_name, array))
+        op, _ = SHARED_OPS[op_name]
+        return Image.fromarray(op(array))
+
+
+def auto_enhance_image(image):
+    """Apply auto_enhance_array to a PIL image in this process
+
+    CLAHE needs histograms of the whole frame, so it is not split across
+    worker processes; large images use the thread-tiled apply_clahe.
+    """
+    with track_operation("auto_enhance", image_nbytes(image)):
+        return Image.fromarray(auto_enhance_array(np.asarray(image.convert("RGB"))))
+
+
+# Named PIL filters offered in the Filters panel
+PIL_FILTERS = {
+    "Blur": ImageFilter.BLUR,
+    "Sharpen": ImageFilter.SHARPEN,
+    "Edge Enhance": ImageFilter.EDGE_ENHANCE,
+    "Emboss": ImageFilter.EMBOSS,
+    "Smooth": ImageFilter.SMOOTH,
+    "Find Edges": ImageFilter.FIND_EDGES,
+}
+
+
+def apply_pil_filter(image, name):
+    """Apply one of the named PIL_FILTERS to an image"""
+    with track_operation(f"filter:{name}", image_nbytes(image)):
+        return image.filter(PIL_FILTERS[name])
+
+
+@tracked("equalize")
+def equalize_array(rgb):
+    """Equalize the luma histogram of an RGB array"""
+    yuv = cv2.cvtColor(rgb, cv2.COLOR_RGB2YUV)
+    yuv[:, :, 0] = cv2.equalizeHist(yuv[:, :, 0])
+    return cv2.cvtColor(yuv, cv2.COLOR_YUV2RGB)
+
+
+@tracked("color_balance")
+def color_balance_array(rgb):
+    """Balance an RGB array's channels with the gray world assumption"""
+    img_array = rgb.astype(np.float32)
+    means = img_array.reshape(-1, 3).mean(axis=0)
+    gray_world = means.mean()
+    scales = np.where(means > 0, gray_world / np.maximum(means, 1e-6), 1.0)
+    img_array *= scales
+    return np.clip(img_array, 0, 255).astype(np.uint8)
+
+
+@tracked("adjust")
+def apply_adjustments(image, brightness=1.0, contrast=1.0, saturation=1.0, sharpness=1.0):
+    """Apply the Adjustments panel's enhancement chain to an image
+
+    Factors within 0.01 of 1.0 are left out.
+    """
+    # Brightness
+    if abs(brightness - 1.0) > 0.01:
+        image = ImageEnhance.Brightness(image).enhance(brightness)
+    
+    # Contrast
+    if abs(contrast - 1.0) > 0.01:
+        image = ImageEnhance.Contrast(image).enhance(contrast)
+    
+    # Saturation
+    if abs(saturation - 1.0) > 0.01:
+        image = ImageEnhance.Color(image).enhance(saturation)
+    
+    # Sharpness
+    if abs(sharpness - 1.0) > 0.01:
+        image = ImageEnhance.Sharpness(image).enhance(sharpness)
+    return image
+
+
+def stack_luma(stack):
+    """Return PIL's L conversion of every frame in an (N, height, width, 3) stack"""
+    count, height, width = stack.shape[:3]
+    # Viewed as one tall image, the whole stack converts in a single call
+    tall = Image.fromarray(stack.reshape(count * height, width, 3))
+    return np.asarray(tall.convert("L")).reshape(count, height, width)
+
+
+def blend_arrays(degenerate, array, factor):
+    """Image.blend(degenerate, image, factor) on arrays, truncating like PIL"""
+    degenerate = np.asarray(degenerate, dtype=np.float32)
+    blended = degenerate + np.float32(factor) * (array.astype(np.float32) - degenerate)
+    return np.clip(blended, 0, 255).astype(np.uint8)
+
+
+@tracked("adjust_stack")
+def adjust_stack(stack, brightness=1.0, contrast=1.0, saturation=1.0):
+    """Apply the Adjustments panel's brightness, contrast and saturation to a stack of frames
+
+    stack is an (N, height, width, 3) uint8 array and every frame gets the
+    same factors; the result matches running each frame through the
+    ImageEnhance chain. Brightness and contrast only remap levels, so they
+    fold into one lookup table per frame (contrast blends towards each
+    frame's mean luma), broadcast from the level ramp and applied in a
+    single pass. Saturation then blends the whole stack towards its luma
+    at once. As in the panel, factors within 0.01 of 1.0 are left out.
+    """
+    count, height, width = stack.shape[:3]
+    levels = np.arange(256)
+    luts = np.tile(levels.astype(np.uint8), (count, 1))
+    if abs(brightness - 1.0) > 0.01:
+        luts[:] = blend_arrays(0, levels, brightness)
+    if abs(contrast - 1.0) > 0.01:
+        frames = stack
+        if abs(brightness - 1.0) > 0.01:
+            frames = cv2.LUT(stack.reshape(count * height, width * 3), luts[0]).reshape(stack.shape)
+        means = np.floor(stack_luma(frames).mean(axis=(1, 2)) + 0.5)
+        contrast_luts = blend_arrays(means[:, None], levels[None, :], contrast)
+        luts = np.take_along_axis(contrast_luts, luts.astype(np.intp), axis=1)
+
+    result = np.empty_like(stack)
+    for frame, lut, target in zip(stack, luts, result):
+        cv2.LUT(frame.reshape(height, width * 3), lut, dst=target.reshape(height, width * 3))
+    if abs(saturation - 1.0) > 0.01:
+        tall = Image.fromarray(result.reshape(count * height, width, 3))
+        gray = tall.convert("L").convert("RGB")
+        result = np.asarray(Image.blend(gray, tall, saturation)).reshape(stack.shape)
+    return result
+
+
+def expand_box(box, halo, size):
+    """Grow a (x1, y1, x2, y2) box by halo pixels, clamped to an image size"""
+    x1, y1, x2, y2 = box
+    width, height = size
+    return (max(0, x1 - halo), max(0, y1 - halo), min(width, x2 + halo), min(height, y2 + halo))
+
+
+def process_region(image, box, edit, halo=0, band_rows=None):
+    """Run edit on the part of image inside box and return the processed patch
+
+    The region is read with halo extra pixels on each side so neighbourhood
+    filters see the same input they would on the whole image, then trimmed
+    back to box. With band_rows the box is processed in bands of that many
+    rows, each with its own halo, reporting progress to the current task
+    between bands.
+    """
+    if band_rows:
+        x1, y1, x2, y2 = box
+        starts = range(y1, y2, band_rows)
+        patch = None
+        for done, top in enumerate(starts):
+            report_progress(done, len(starts))
+            band = process_region(image, (x1, top, x2, min(top + band_rows, y2)), edit, halo)
+            if patch is None:
+                patch = Image.new(band.mode, (x2 - x1, y2 - y1))
+            patch.paste(band, (0, top - y1))
+        report_progress(len(starts), len(starts))
+        return patch
+    outer = expand_box(box, halo, image.size)
+    result = edit(image.crop(outer))
+    left, top = box[0] - outer[0], box[1] - outer[1]
+    return result.crop((left, top, left + box[2] - box[0], top + box[3] - box[1]))
+
+
+class EditHistory:
+    """Undo/redo history of whole-image states and region patches
+
+    Each step holds the pixels that differ from the current image: the
+    previous image for whole-image edits, or just the previous pixels of
+    the edited box for selection edits. Undo and redo swap a step's pixels
+    with the current ones, so a step always holds the other side of it.
+
+    state is an id for the current image contents. It changes with every
+    recorded edit and returns to the earlier id on undo, so it can key
+    caches of values derived from the image, such as its statistics.
+    """
+
+    def __init__(self, limit=HISTORY_LIMIT):
+        self.limit = limit
+        self.steps = []
+        self.position = 0
+        self.last_state = 0
+        self.state = 0
+
+    def _new_state(self):
+        self.last_state += 1
+        return self.last_state
+
+    def clear(self):
+        """Forget every step"""
+        self.steps = []
+        self.position = 0
+        self.state = self._new_state()
+
+    def mark_changed(self):
+        """Give the image a new state after a change that is not recorded"""
+        self.state = self._new_state()
+
+    def _push(self, step):
+        # Each step also remembers the states on either side of it
+        step += [self.state, self._new_state()]
+        self.state = step[4]
+        del self.steps[self.position:]
+        self.steps.append(step)
+        if len(self.steps) > self.limit:
+            self.steps.pop(0)
+        self.position = len(self.steps)
+
+    def record_full(self, image):
+        """Record the image as it was before a whole-image edit replaces it"""
+        self._push(["full", None, image])
+
+    def record_region(self, image, box):
+        """Record the pixels inside box before an edit pastes over them in place"""
+        self._push(["region", tuple(box), image.crop(box)])
+
+    def _swap(self, step, current):
+        kind, box, pixels = step[:3]
+        if kind == "full":
+            step[2] = current
+            return pixels
+        step[2] = current.crop(box)
+        current.paste(pixels, box[:2])
+        return current
+
+    def can_undo(self):
+        return self.position > 0
+
+    def can_redo(self):
+        return self.position < len(self.steps)
+
+    def undo(self, current):
+        """Return the image before the last step, or None if there is nothing to undo"""
+        if not self.can_undo():
+            return None
+        self.position -= 1
+        step = self.steps[self.position]
+        self.state = step[3]
+        return self._swap(step, current)
+
+    def redo(self, current):
+        """Return the image after the next step, or None if there is nothing to redo"""
+        if not self.can_redo():
+            return None
+        step = self.steps[self.position]
+        self.position += 1
+        self.state = step[4]
+        return self._swap(step, current)
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the stored steps"""
+        return sum(image_nbytes(step[2]) for step in self.steps)
+
+
+# Histogram and summary statistics of one channel; shadows and highlights
+# are the fractions of pixels clipped to 0 and 255
+ChannelStats = namedtuple("ChannelStats", ["histogram", "mean", "std", "min", "max",
+                                           "shadows", "highlights"])
+
+
+def image_statistics(image):
+    """Return ChannelStats for the R, G, B and L (luma) channels of an image
+
+    Only the 256-bin histograms are computed from the pixels; every other
+    statistic is derived from them.
+    """
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    array = np.asarray(image)
+    luma = cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
+    histograms = {
+        "R": cv2.calcHist([array], [0], None, [256], [0, 256]).ravel(),
+        "G": cv2.calcHist([array], [1], None, [256], [0, 256]).ravel(),
+        "B": cv2.calcHist([array], [2], None, [256], [0, 256]).ravel(),
+        "L": np.bincount(luma.ravel(), minlength=256),
+    }
+    levels = np.arange(256, dtype=np.float64)
+    stats = {}
+    for name, histogram in histograms.items():
+        histogram = np.rint(histogram).astype(np.int64)
+        count = histogram.sum()
+        mean = float(histogram @ levels) / count
+        variance = float(histogram @ levels ** 2) / count - mean ** 2
+        used = np.flatnonzero(histogram)
+        stats[name] = ChannelStats(histogram, mean, math.sqrt(max(variance, 0.0)),
+                                   int(used[0]), int(used[-1]),
+                                   histogram[0] / count, histogram[255] / count)
+    return stats
+
+
+def parse_aspect(text):
+    """Return the (width, height) ratio of a template name or a "W:H" string"""
+    if text in CROP_TEMPLATES:
+        return CROP_TEMPLATES[text]
+    try:
+        ratio_w, ratio_h = (int(part) for part in text.split(":"))
+    except ValueError:
+        raise ValueError(f"Unknown crop template: {text}")
+    if ratio_w <= 0 or ratio_h <= 0:
+        raise ValueError(f"Invalid aspect ratio: {text}")
+    return ratio_w, ratio_h
+
+
+def template_size(image_size, ratio):
+    """Return the largest (width, height) with the given ratio that fits an image"""
+    img_w, img_h = image_size
+    ratio_w, ratio_h = ratio
+    if img_w / img_h > ratio_w / ratio_h:
+        # Image is wider, constrain by height
+        return int(img_h * ratio_w / ratio_h), img_h
+    # Image is taller, constrain by width
+    return img_w, int(img_w * ratio_h / ratio_w)
+
+
+def saliency_map(image, proxy_size=SMART_CROP_PROXY):
+    """Return a float32 saliency map of a small proxy of image, and its scale
+
+    The map averages gradient energy with spectral-residual saliency, both
+    normalised to 0..1. scale converts proxy coordinates to image pixels.
+    """
+    scale = max(image.size) / proxy_size
+    proxy = image
+    if scale > 1:
+        # Box-reduce first so the final resample only touches a small image
+        factor = int(scale // 2)
+        if factor > 1:
+            proxy = proxy.reduce(factor)
+        proxy = proxy.resize((max(1, round(image.width / scale)), max(1, round(image.height / scale))),
+                             Image.Resampling.BILINEAR)
+    else:
+        scale = 1.0
+    gray = np.asarray(proxy.convert("L"), dtype=np.float32) / 255.0
+    if gray.max() - gray.min() < 2 / 255:
+        # Featureless: the spectral residual would only pick up rounding noise
+        return np.zeros_like(gray), scale
+
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    energy = cv2.GaussianBlur(cv2.magnitude(gx, gy), (0, 0), 2)
+
+    # Spectral residual on a fixed 64x64 version of the proxy
+    small = cv2.resize(gray, (64, 64), interpolation=cv2.INTER_AREA)
+    spectrum = np.fft.fft2(small)
+    log_amplitude = np.log(np.abs(spectrum) + 1e-6).astype(np.float32)
+    residual = log_amplitude - cv2.blur(log_amplitude, (3, 3))
+    spectral = np.abs(np.fft.ifft2(np.exp(residual + 1j * np.angle(spectrum)))) ** 2
+    spectral = cv2.GaussianBlur(spectral.astype(np.float32), (0, 0), 2.5)
+    spectral = cv2.resize(spectral, (gray.shape[1], gray.shape[0]), interpolation=cv2.INTER_LINEAR)
+
+    def normalise(values):
+        span = values.max() - values.min()
+        return (values - values.min()) / span if span > 0 else np.zeros_like(values)
+
+    return (normalise(energy) + normalise(spectral)) / 2, scale
+
+
+def best_window(saliency, window_w, window_h):
+    """Return the (x, y) of the window_w x window_h window with the most saliency
+
+    Every position is scored at once from an integral image. A small
+    preference for the centre keeps featureless images centred.
+    """
+    height, width = saliency.shape
+    window_w = min(window_w, width)
+    window_h = min(window_h, height)
+    integral = cv2.integral(saliency.astype(np.float64))
+    scores = (integral[window_h:, window_w:] - integral[:-window_h, window_w:]
+              - integral[window_h:, :-window_w] + integral[:-window_h, :-window_w])
+    ys, xs = np.mgrid[0:scores.shape[0], 0:scores.shape[1]]
+    centre_x, centre_y = (width - window_w) / 2, (height - window_h) / 2
+    distance = np.abs(xs - centre_x) / max(1, width) + np.abs(ys - centre_y) / max(1, height)
+    scores = scores - 1e-3 * max(scores.max(), 1e-6) * distance
+    y, x = np.unravel_index(np.argmax(scores), scores.shape)
+    return int(x), int(y)
+
+
+def smart_crop_box(image, ratio):
+    """Return the (x1, y1, x2, y2) crop of the given ratio covering the most salient content"""
+    crop_w, crop_h = template_size(image.size, ratio)
+    saliency, scale = saliency_map(image)
+    window_w = max(1, min(saliency.shape[1], round(crop_w / scale)))
+    window_h = max(1, min(saliency.shape[0], round(crop_h / scale)))
+    x, y = best_window(saliency, window_w, window_h)
+    x1 = min(max(0, round(x * scale)), image.width - crop_w)
+    y1 = min(max(0, round(y * scale)), image.height - crop_h)
+    return (x1, y1, x1 + crop_w, y1 + crop_h)
+
+
+def centered_crop_box(image, ratio):
+    """Return the centred (x1, y1, x2, y2) crop of the given ratio"""
+    crop_w, crop_h = template_size(image.size, ratio)
+    x1 = (image.width - crop_w) // 2
+    y1 = (image.height - crop_h) // 2
+    return (x1, y1, x1 + crop_w, y1 + crop_h)
+
+
+def find_content_bbox(image, tolerance=TRIM_TOLERANCE, proxy_size=TRIM_PROXY):
+    """Return the (x1, y1, x2, y2) box of everything that differs from the border colour
+
+    The border colour is the median of the four corner pixels. Rows and
+    columns are reduced on a box-filtered proxy to find the content roughly,
+    then only strips along each edge are read at full resolution to place
+    it exactly. Returns None when the image is uniform within tolerance.
+    """
+    rgb = image.convert("RGB")
+    width, height = rgb.size
+    corners = [rgb.getpixel(point) for point in
+               ((0, 0), (width - 1, 0), (0, height - 1), (width - 1, height - 1))]
+    background = np.median(np.array(corners, dtype=np.int16), axis=0)
+
+    def content_mask(pixels, threshold):
+        return (np.abs(pixels.astype(np.int16) - background) > threshold).any(axis=2)
+
+    factor = max(1, -(-max(width, height) // proxy_size))
+    proxy = np.asarray(rgb.reduce(factor) if factor > 1 else rgb)
+    # Averaging thins out fine detail, so the proxy uses a lower threshold
+    mask = content_mask(proxy, tolerance / 2 if factor > 1 else tolerance)
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if not len(rows):
+        return None
+    if factor == 1:
+        return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+    # Each proxy pixel covers factor x factor pixels; refine within one proxy
+    # pixel either side of every coarse edge
+    x1, x2 = cols[0] * factor, min(width, (cols[-1] + 1) * factor)
+    y1, y2 = rows[0] * factor, min(height, (rows[-1] + 1) * factor)
+    outer = (max(0, x1 - factor), max(0, y1 - factor), min(width, x2 + factor), min(height, y2 + factor))
+
+    def first_content(box, axis, reverse):
+        strip = content_mask(np.asarray(rgb.crop(box)), tolerance).any(axis=axis)
+        hits = np.flatnonzero(strip)
+        if not len(hits):
+            return None
+        return hits[-1] + 1 if reverse else hits[0]
+
+    left = first_content((outer[0], outer[1], min(width, x1 + factor), outer[3]), 0, False)
+    right = first_content((max(0, x2 - factor), outer[1], outer[2], outer[3]), 0, True)
+    top = first_content((outer[0], outer[1], outer[2], min(height, y1 + factor)), 1, False)
+    bottom = first_content((outer[0], max(0, y2 - factor), outer[2], outer[3]), 1, True)
+    box = (outer[0] + left if left is not None else x1,
+           outer[1] + top if top is not None else y1,
+           max(0, x2 - factor) + right if right is not None else x2,
+           max(0, y2 - factor) + bottom if bottom is not None else y2)
+    return tuple(int(value) for value in box)
+
+
+def make_trim_transform(tolerance=TRIM_TOLERANCE):
+    """Create a batch transform trimming uniform margins from each image"""
+    def trim(image, job):
+        box = find_content_bbox(image, tolerance)
+        return image.crop(box) if box else image
+    return trim
+
+
+def order_quad(points):
+    """Order four (x, y) points as top-left, top-right, bottom-right, bottom-left"""
+    points = np.asarray(points, dtype=np.float32).reshape(4, 2)
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([points[np.argmin(sums)], points[np.argmin(diffs)],
+                     points[np.argmax(sums)], points[np.argmax(diffs)]], dtype=np.float32)
+
+
+def quad_output_size(quad):
+    """Return the (width, height) a quad should be flattened to"""
+    tl, tr, br, bl = order_quad(quad)
+    width = max(np.linalg.norm(tr - tl), np.linalg.norm(br - bl))
+    height = max(np.linalg.norm(bl - tl), np.linalg.norm(br - tr))
+    return max(1, int(round(width))), max(1, int(round(height)))
+
+
+def _document_proxy(image, proxy_size):
+    """Return a grayscale uint8 proxy of image and the proxy-to-image scale"""
+    scale = max(1.0, max(image.size) / proxy_size)
+    proxy = image
+    if scale > 1:
+        proxy = image.resize((max(1, round(image.width / scale)), max(1, round(image.height / scale))),
+                             Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return np.asarray(proxy.convert("L")), scale
+
+
+def detect_document_quad(image, proxy_size=DOCUMENT_PROXY, min_area=0.2):
+    """Find the outline of a document or page, returned as four ordered corners
+
+    Edges are traced on a small proxy and the largest four-sided contour
+    covering at least min_area of the frame wins. Returns None if there is
+    no such outline.
+    """
+    gray, scale = _document_proxy(image, proxy_size)
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    frame_area = gray.shape[0] * gray.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:10]:
+        if cv2.contourArea(contour) < min_area * frame_area:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4 and cv2.isContourConvex(approx):
+            return order_quad(approx.reshape(4, 2) * scale)
+    return None
+
+
+def warp_perspective_tiled(image, quad, size=None, tile=WARP_TILE, workers=None):
+    """Flatten the quad of image into a rectangle, warping output tiles in parallel
+
+    Each tile only reads the part of the source its corners map to, so
+    large images are never remapped in one monolithic call. Progress is
+    reported to the current task tile by tile.
+    """
+    quad = order_quad(quad)
+    width, height = size or quad_output_size(quad)
+    target = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    # Maps output pixels back to source pixels
+    inverse = cv2.getPerspectiveTransform(target, quad)
+    source = np.asarray(image)
+    channels = source.shape[2:] if source.ndim == 3 else ()
+    output = np.empty((height, width) + channels, dtype=source.dtype)
+
+    def warp(origin):
+        x, y = origin
+        tile_w, tile_h = min(tile, width - x), min(tile, height - y)
+        corners = np.array([[[x, y], [x + tile_w, y], [x, y + tile_h], [x + tile_w, y + tile_h]]],
+                           dtype=np.float32)
+        mapped = cv2.perspectiveTransform(corners, inverse)[0]
+        # Two pixels of slack for the interpolation footprint
+        sx1 = int(np.clip(np.floor(mapped[:, 0].min()) - 2, 0, source.shape[1]))
+        sy1 = int(np.clip(np.floor(mapped[:, 1].min()) - 2, 0, source.shape[0]))
+        sx2 = int(np.clip(np.ceil(mapped[:, 0].max()) + 3, 0, source.shape[1]))
+        sy2 = int(np.clip(np.ceil(mapped[:, 1].max()) + 3, 0, source.shape[0]))
+        if sx2 <= sx1 or sy2 <= sy1:
+            output[y:y + tile_h, x:x + tile_w] = 0
+            return
+        shift_source = np.array([[1, 0, -sx1], [0, 1, -sy1], [0, 0, 1]], dtype=np.float64)
+        shift_tile = np.array([[1, 0, x], [0, 1, y], [0, 0, 1]], dtype=np.float64)
+        matrix = shift_source @ inverse @ shift_tile
+        output[y:y + tile_h, x:x + tile_w] = cv2.warpPerspective(
+            np.ascontiguousarray(source[sy1:sy2, sx1:sx2]), matrix, (tile_w, tile_h),
+            flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+
+    origins = [(x, y) for y in range(0, height, tile) for x in range(0, width, tile)]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for future in wait_for_bands([pool.submit(credited(warp), origin) for origin in origins]):
+            future.result()
+    return Image.fromarray(output, image.mode)
+
+
+def deskew_angle(image, proxy_size=DOCUMENT_PROXY, max_angle=MAX_SKEW):
+    """Estimate the skew of a text scan in degrees from its horizontal projection profile
+
+    Text rows give the sharpest row-sum profile when they are level, so
+    the proxy is rotated through a coarse then a fine sweep of angles and
+    the one with the highest profile variance wins. A positive angle means
+    the content is rotated counter-clockwise.
+    """
+    gray, _ = _document_proxy(image, proxy_size)
+    _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    ink = ink.astype(np.float32)
+    centre = (ink.shape[1] / 2, ink.shape[0] / 2)
+
+    def sharpness(angle):
+        matrix = cv2.getRotationMatrix2D(centre, -angle, 1.0)
+        rotated = cv2.warpAffine(ink, matrix, (ink.shape[1], ink.shape[0]), flags=cv2.INTER_NEAREST)
+        return float(np.var(rotated.sum(axis=1)))
+
+    coarse = max(np.arange(-max_angle, max_angle + 0.5, 1.0), key=sharpness)
+    return float(max(np.arange(coarse - 1, coarse + 1.05, 0.1), key=sharpness))
+
+
+def deskew_image(image, angle=None, fillcolor=None):
+    """Rotate a scan level, estimating the angle if not given"""
+    if angle is None:
+        angle = deskew_angle(image)
+    if abs(angle) < 0.05:
+        return image
+    if fillcolor is None:
+        fillcolor = "white" if image.mode in ("RGB", "L") else None
+    return image.rotate(-angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=fillcolor)
+
+
+def make_perspective_transform():
+    """Create a batch transform flattening each image's detected document outline"""
+    def flatten(image, job):
+        quad = detect_document_quad(image)
+        return warp_perspective_tiled(image, quad) if quad is not None else image
+    return flatten
+
+
+def make_deskew_transform():
+    """Create a batch transform levelling each scan"""
+    def deskew(image, job):
+        return deskew_image(image)
+    return deskew
+
+
+_detectors = threading.local()
+
+
+def get_face_detector():
+    """Return this thread's Haar face detector, loading it on first use
+
+    Returns None when OpenCV was installed without its bundled cascades.
+    CascadeClassifier is not safe to share between threads, so each batch
+    worker keeps its own instance for the life of the thread.
+    """
+    if not hasattr(_detectors, "face"):
+        cascades = getattr(getattr(cv2, "data", None), "haarcascades", "")
+        path = os.path.join(cascades, "haarcascade_frontalface_default.xml")
+        detector = cv2.CascadeClassifier(path) if os.path.exists(path) else None
+        _detectors.face = detector if detector is not None and not detector.empty() else None
+    return _detectors.face
+
+
+def detect_faces(image, proxy_size=FACE_PROXY):
+    """Return face boxes as (x, y, w, h) in image pixels, found on a downscaled proxy"""
+    detector = get_face_detector()
+    if detector is None:
+        return []
+    scale = max(1.0, max(image.size) / proxy_size)
+    proxy = image
+    if scale > 1:
+        proxy = image.resize((max(1, round(image.width / scale)), max(1, round(image.height / scale))),
+                             Image.Resampling.BILINEAR, reducing_gap=2.0)
+    gray = cv2.equalizeHist(np.asarray(proxy.convert("L")))
+    faces = detector.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(24, 24))
+    return [tuple(int(round(value * scale)) for value in face) for face in faces]
+
+
+def face_crop_box(image, ratio, faces=None):
+    """Return the template crop framing the detected faces, or the smart crop if there are none
+
+    The crop is centred horizontally on the faces at least half the size of
+    the largest one and leaves headroom by putting their centre 40% of the
+    way down.
+    """
+    if faces is None:
+        faces = detect_faces(image)
+    if not faces:
+        return smart_crop_box(image, ratio)
+    # Frame the main subjects; small detections are mostly background false positives
+    largest = max(w for x, y, w, h in faces)
+    faces = [face for face in faces if face[2] >= largest / 2]
+    crop_w, crop_h = template_size(image.size, ratio)
+    left = min(x for x, y, w, h in faces)
+    top = min(y for x, y, w, h in faces)
+    right = max(x + w for x, y, w, h in faces)
+    bottom = max(y + h for x, y, w, h in faces)
+    x1 = round((left + right) / 2 - crop_w / 2)
+    y1 = round((top + bottom) / 2 - crop_h * 0.4)
+    x1 = min(max(0, x1), image.width - crop_w)
+    y1 = min(max(0, y1), image.height - crop_h)
+    return (x1, y1, x1 + crop_w, y1 + crop_h)
+
+
+def make_template_crop_transform(ratio, smart=True, faces=False):
+    """Create a batch transform cropping each image to a ratio
+
+    Crops are placed on detected faces (falling back to saliency), on the
+    most salient content, or centred.
+    """
+    if faces:
+        place = face_crop_box
+    elif smart:
+        place = smart_crop_box
+    else:
+        place = centered_crop_box
+
+    def crop(image, job):
+        return image.crop(place(image, ratio))
+    return crop
+
+
+# The Task whose work function is running on each TaskRunner thread
+_task_context = threading.local()
+
+
+def current_task():
+    """Return the Task being run on this thread, or None outside a TaskRunner"""
+    return getattr(_task_context, "task", None)
+
+
+def report_progress(done, total):
+    """Report done of total steps to the current task
+
+    Raises CancelledError if the task has been cancelled, so banded and
+    tiled helpers can stop between steps. Does nothing outside a task.
+    """
+    task = current_task()
+    if task is None:
+        return
+    if task.cancelled:
+        raise CancelledError()
+    task.report(done / total, task.message)
+
+
+def wait_for_bands(futures):
+    """Yield futures as they finish, reporting progress to the current task
+
+    If the task is cancelled, bands that have not started are cancelled,
+    running ones are waited for (they may still use shared buffers) and
+    CancelledError is raised.
+    """
+    for done, future in enumerate(as_completed(futures), 1):
+        yield future
+        try:
+            report_progress(done, len(futures))
+        except CancelledError:
+            for pending in futures:
+                pending.cancel()
+            wait(futures)
+            raise
+
+
+class Task:
+    """A unit of background work submitted to a TaskRunner
+
+    The work function receives the task and can call report() with a
+    progress fraction (or None when the total is unknown) and check
+    cancelled to stop early. Helpers it calls report through
+    report_progress(), which finds the task with current_task().
+    """
+
+    def __init__(self, name, on_done=None, on_error=None):
+        self.name = name
+        self.on_done = on_done
+        self.on_error = on_error
+        self.cancel_event = threading.Event()
+        self.progress = None
+        self.message = ""
+        self.future = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        """Ask the work function to stop"""
+        self.cancel_event.set()
+
+    def report(self, progress=None, message=""):
+        """Record progress from the worker thread"""
+        self.progress = progress
+        self.message = message
+
+
+class TaskRunner:
+    """Runs work on a thread pool and delivers results on the polling thread
+
+    Callbacks never run on the worker threads: poll() is called from the
+    Tk event loop (via root.after) and invokes on_done or on_error there,
+    so they are free to touch widgets and application state.
+    """
+
+    def __init__(self, workers=2):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.finished = queue.Queue()
+        self.active = []
+
+    def submit(self, name, work, on_done=None, on_error=None):
+        """Run work(task) in the pool and return the Task"""
+        task = Task(name, on_done, on_error)
+        task.future = self.pool.submit(self._run, work, task)
+        task.future.add_done_callback(lambda future: self.finished.put(task))
+        self.active.append(task)
+        return task
+
+    @staticmethod
+    def _run(work, task):
+        _task_context.task = task
+        try:
+            return work(task)
+        finally:
+            _task_context.task = None
+
+    def poll(self):
+        """Deliver finished tasks to their callbacks; return True while work is pending"""
+        while True:
+            try:
+                task = self.finished.get_nowait()
+            except queue.Empty:
+                break
+            self.active.remove(task)
+            try:
+                result = task.future.result()
+            except Exception as e:
+                if task.on_error:
+                    task.on_error(e)
+                else:
+                    print(f"❌ {task.name} failed: {e}")
+            else:
+                if task.on_done:
+                    task.on_done(result)
+        return bool(self.active)
+
+    def cancel_all(self):
+        """Ask every active task to stop"""
+        for task in self.active:
+            task.cancel()
+            task.future.cancel()
+
+    def shutdown(self):
+        """Cancel outstanding work and stop the pool"""
+        self.cancel_all()
+        self.pool.shutdown(wait=False)
+
+
+# Cursor shown over each crop handle, and over the selection body
+CROP_CURSORS = {
+    "nw": "top_left_corner", "n": "top_side", "ne": "top_right_corner", "e": "right_side",
+    "se": "bottom_right_corner", "s": "bottom_side", "sw": "bottom_left_corner", "w": "left_side",
+    "move": "fleur",
+}
+
+
+def crop_handle_points(box):
+    """Return the centre of each drag handle of a (x1, y1, x2, y2) box"""
+    x1, y1, x2, y2 = box
+    xm, ym = (x1 + x2) / 2, (y1 + y2) / 2
+    return {"nw": (x1, y1), "n": (xm, y1), "ne": (x2, y1), "e": (x2, ym),
+            "se": (x2, y2), "s": (xm, y2), "sw": (x1, y2), "w": (x1, ym)}
+
+
+def hit_test_crop(box, x, y, radius=HANDLE_SIZE):
+    """Return the handle name under (x, y), "move" inside the box, or None"""
+    for name, (hx, hy) in crop_handle_points(box).items():
+        if abs(x - hx) <= radius and abs(y - hy) <= radius:
+            return name
+    x1, y1, x2, y2 = box
+    if x1 < x < x2 and y1 < y < y2:
+        return "move"
+    return None
+
+
+def drag_crop_box(box, mode, dx, dy, bounds):
+    """Return box moved or resized by (dx, dy) for a drag mode, kept inside bounds
+
+    mode is "move" or a handle name; resizing past the opposite edge flips
+    the box instead of inverting it.
+    """
+    x1, y1, x2, y2 = box
+    width, height = bounds
+    if mode == "move":
+        dx = min(max(dx, -x1), width - x2)
+        dy = min(max(dy, -y1), height - y2)
+        return (x1 + dx, y1 + dy, x2 + dx, y2 + dy)
+    if "w" in mode:
+        x1 += dx
+    if "e" in mode:
+        x2 += dx
+    if "n" in mode:
+        y1 += dy
+    if "s" in mode:
+        y2 += dy
+    x1, x2 = sorted((min(max(x1, 0), width), min(max(x2, 0), width)))
+    y1, y2 = sorted((min(max(y1, 0), height), min(max(y2, 0), height)))
+    return (x1, y1, x2, y2)
+
+
+def make_resize_transform(width, height, maintain_ratio=True):
+    """Build a batch transform that resizes images to width x height"""
+    def resize(image, job):
+        if maintain_ratio:
+            image.thumbnail((width, height), Image.Resampling.LANCZOS)
+            return image
+        return image.resize((width, height), Image.Resampling.LANCZOS)
+    return resize
+
+
+# A single unit of batch work: one input file and where its result goes.
+# mtime and size are filled in when the job source already has a stat result.
+BatchJob = namedtuple("BatchJob", ["input_path", "output_path", "mtime", "size"],
+                      defaults=(None, None))
+
+
+def matches_patterns(relative_path, patterns):
+    """Check a relative path or its file name against glob patterns"""
+    relative_path = relative_path.replace(os.sep, "/")
+    name = relative_path.rsplit("/", 1)[-1]
+    return any(fnmatch.fnmatch(relative_path, pattern) or fnmatch.fnmatch(name, pattern)
+               for pattern in patterns)
+
+
+def scan_images(root, recursive=True, include=None, exclude=None, skip_dirs=()):
+    """Lazily yield (DirEntry, relative_path) for image files under root
+
+    Directories are walked depth-first with os.scandir and entries are
+    yielded as soon as they are read, so consumers can start work before
+    the tree has been listed. include/exclude are glob patterns matched
+    against the path relative to root or the bare file name; excluded
+    directories are not descended into.
+    """
+    skip_dirs = {os.path.abspath(d) for d in skip_dirs}
+    stack = [(os.path.abspath(root), "")]
+
+    while stack:
+        folder, relative_folder = stack.pop()
+        try:
+            it = os.scandir(folder)
+        except OSError as e:
+            print(f"⚠️  Could not scan {folder}: {e}")
+            continue
+
+        with it:
+            for entry in it:
+                relative_path = os.path.join(relative_folder, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if (recursive and entry.path not in skip_dirs
+                            and not (exclude and matches_patterns(relative_path, exclude))):
+                        stack.append((entry.path, relative_path))
+                elif entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    if include and not matches_patterns(relative_path, include):
+                        continue
+                    if exclude and matches_patterns(relative_path, exclude):
+                        continue
+                    yield entry, relative_path
+
+
+def iter_batch_jobs(input_folder, output_folder, prefix, recursive=False, include=None, exclude=None):
+    """Lazily build batch jobs for a folder, mirroring its tree in the output folder"""
+    # Never pick up our own results when the output lives inside the input
+    for entry, relative_path in scan_images(input_folder, recursive, include, exclude,
+                                            skip_dirs=(output_folder,)):
+        sub_folder, filename = os.path.split(relative_path)
+        stat = entry.stat()
+        yield BatchJob(entry.path,
+                       os.path.join(output_folder, sub_folder, f"{prefix}{filename}"),
+                       stat.st_mtime, stat.st_size)
+
+
+def content_digest(data):
+    """Return a hex digest identifying file content"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def settings_digest(settings):
+    """Return a hex digest identifying a set of batch operation settings"""
+    encoded = json.dumps(settings, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+def perceptual_hash(data, hash_size=16):
+    """Return a difference hash of an encoded image from a tiny decoded proxy"""
+    with Image.open(io.BytesIO(data)) as image:
+        size = image.size
+        image.draft("L", (hash_size * 4, hash_size * 4))
+        proxy = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = np.asarray(proxy, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return size, np.packbits(bits).tobytes().hex()
+
+
+def pixel_digest(data):
+    """Return a hex digest of an encoded image's pixels as the batch pipeline decodes them"""
+    with Image.open(io.BytesIO(data)) as image:
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGB')
+        header = f"{image.mode} {image.width}x{image.height}".encode("ascii")
+        return content_digest(header + image.tobytes())
+
+
+def link_output(source, target):
+    """Hard-link an existing output to another path, copying across filesystems"""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+class BatchResult:
+    """Outcome of a batch pipeline run"""
+
+    def __init__(self):
+        self.processed = 0
+        self.linked = 0
+        self.outputs = {}
+        self.skipped = 0
+        self.failed = []
+        self.cancelled = False
+        self.elapsed = 0.0
+
+
+class BatchManifest:
+    """Append-only JSONL journal of batch results kept in the output folder
+
+    Every finished or failed input gets a line recording its content hash,
+    mtime and size and the digest of the operation settings. A resumed run
+    skips inputs whose latest record is a success with the same hash and
+    settings and whose output still exists; an incremental run can make
+    the same decision from mtime and size alone without reading the file.
+    """
+
+    def __init__(self, output_folder, settings, resume=True):
+        self.path = os.path.join(output_folder, MANIFEST_NAME)
+        self.settings = settings_digest(settings)
+        self.records = {}
+        self._lock = threading.Lock()
+
+        if resume and os.path.exists(self.path):
+            lines = self._load()
+            # Rewrite the journal once superseded lines dominate it
+            if lines > 2 * len(self.records) + 100:
+                self._compact()
+            self._file = open(self.path, "a", encoding="utf-8")
+        else:
+            self._file = open(self.path, "w", encoding="utf-8")
+
+    def _load(self):
+        lines = 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                lines += 1
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash can leave a torn final line behind
+                    continue
+                self.records[record["input"]] = record
+        return lines
+
+    def _compact(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for record in self.records.values():
+                f.write(json.dumps(record) + "\n")
+        os.replace(temp_path, self.path)
+
+    def is_done(self, job, digest):
+        """Check whether a job already completed with the same input and settings"""
+        record = self.records.get(job.input_path)
+        return (record is not None
+                and record["status"] == "done"
+                and record["hash"] == digest
+                and record["settings"] == self.settings
+                and record["output"] == job.output_path
+                and self._outputs_exist(job, record))
+
+    def is_unchanged(self, job, mtime, size):
+        """Check whether a job completed for an input with the same mtime and size"""
+        record = self.records.get(job.input_path)
+        return (record is not None
+                and record["status"] == "done"
+                and record.get("mtime") == mtime
+                and record.get("size") == size
+                and record["settings"] == self.settings
+                and record["output"] == job.output_path
+                and self._outputs_exist(job, record))
+
+    def _outputs_exist(self, job, record):
+        # Size ladders never write output_path itself, only the listed variants
+        paths = record.get("outputs") or [job.output_path]
+        return all(os.path.exists(path) for path in paths)
+
+    def recorded_outputs(self, job):
+        """Return the variant paths journalled for a job, or None"""
+        record = self.records.get(job.input_path)
+        return record.get("outputs") if record else None
+
+    def record_done(self, job, digest, mtime=None, size=None, outputs=None):
+        """Journal a successfully written output, or the variant paths written for it"""
+        record = {"input": job.input_path, "output": job.output_path, "status": "done",
+                  "hash": digest, "mtime": mtime, "size": size,
+                  "settings": self.settings, "time": time.time()}
+        if outputs:
+            record["outputs"] = list(outputs)
+        self._write(record)
+
+    def record_failed(self, job, error, digest=None):
+        """Journal an input that could not be processed"""
+        self._write({"input": job.input_path, "output": job.output_path, "status": "failed",
+                     "hash": digest, "settings": self.settings, "error": str(error),
+                     "time": time.time()})
+
+    def failures(self):
+        """Return the latest failure records"""
+        with self._lock:
+            return [r for r in self.records.values() if r["status"] == "failed"]
+
+    def _write(self, record):
+        with self._lock:
+            self.records[record["input"]] = record
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def close(self):
+        """Close the journal file"""
+        with self._lock:
+            self._file.close()
+
+
+class BatchPipeline:
+    """Streaming read -> transform -> encode batch processor
+
+    Reader threads pull file bytes off disk, transform workers decode and
+    edit the images, and writer threads encode and save the results. The
+    stages are joined by bounded queues, so a slow stage applies
+    backpressure instead of letting decoded frames pile up in memory.
+    Jobs are consumed lazily, so processing starts with the first file.
+
+    transform_fn(image, job) receives a decoded RGB image and returns the
+    image to write, or a dict of suffix -> image to write several variants
+    of it (listed per input in result.outputs). Outputs are encoded with
+    the given encoder profile, with save_kwargs overriding individual
+    settings; target_size instead searches for the highest JPEG/WebP
+    quality that fits in that many bytes.
+
+    With a manifest, skip_unchanged="hash" skips inputs whose content hash
+    was already processed and skip_unchanged="stat" first tries a cheaper
+    mtime/size comparison before reading the file.
+
+    dedup="exact" processes byte-identical inputs once and hard-links the
+    result to every duplicate's output path; dedup="perceptual" also
+    merges inputs that decode to the same pixels, using a hash of tiny
+    decoded proxies to find candidates so only those are fully decoded
+    and compared.
+
+    Pillow releases the GIL while decoding, resampling and encoding, so
+    thread pools keep disk and all cores busy together.
+    """
+
+    def __init__(self, transform_fn, readers=2, workers=None, writers=2, queue_size=8,
+                 profile="balanced", save_kwargs=None, target_size=None, manifest=None,
+                 skip_unchanged=None, dedup=None, on_progress=None, cancel_event=None):
+        if skip_unchanged and manifest is None:
+            raise ValueError("skip_unchanged needs a manifest")
+        self.transform = transform_fn
+        self.readers = readers
+        self.workers = workers or os.cpu_count() or 1
+        self.writers = writers
+        self.queue_size = queue_size
+        self.profile = profile
+        self.save_kwargs = save_kwargs or {}
+        self.target_size = target_size
+        self.manifest = manifest
+        self.skip_unchanged = skip_unchanged
+        self.dedup = dedup
+        self.on_progress = on_progress
+        self.cancel_event = cancel_event or threading.Event()
+
+    def run(self, jobs):
+        """Process an iterable of BatchJob and return a BatchResult"""
+        result = BatchResult()
+        start = time.perf_counter()
+
+        read_queue = queue.Queue(self.queue_size)
+        write_queue = queue.Queue(self.queue_size)
+        job_iter = iter(jobs)
+        iter_lock = threading.Lock()
+        result_lock = threading.Lock()
+        scan_errors = []
+
+        def next_job():
+            with iter_lock:
+                if self.cancel_event.is_set() or scan_errors:
+                    return None
+                try:
+                    return next(job_iter, None)
+                except Exception as e:
+                    scan_errors.append(e)
+                    return None
+
+        # Dedup key -> groups of [first job, duplicates waiting on it, outcome,
+        # outputs, pixel digest]; perceptual keys hold one group per distinct
+        # pixel content among inputs whose proxies hash the same
+        dedup_groups = {}
+        dedup_lock = threading.Lock()
+
+        def record(job, digest=None, error=None, skipped=False, linked=False, outputs=None):
+            with result_lock:
+                if skipped:
+                    result.skipped += 1
+                elif error is None:
+                    result.processed += 1
+                    if linked:
+                        result.linked += 1
+                    if outputs:
+                        result.outputs[job.input_path] = outputs
+                else:
+                    result.failed.append((job.input_path, str(error)))
+
+            if self.manifest is not None and not skipped:
+                if error is None:
+                    paths = [entry["path"] for entry in outputs] if outputs else None
+                    self.manifest.record_done(job, digest, job.mtime, job.size, paths)
+                else:
+                    self.manifest.record_failed(job, error, digest)
+            if self.on_progress:
+                self.on_progress(result)
+
+        def claim_duplicate(key, job, digest, data):
+            """Attach a job to an earlier one with the same content
+
+            Returns None if the job was handled as a duplicate, or the new
+            group the job leads and must settle through finish().
+            """
+            with dedup_lock:
+                groups = dedup_groups.setdefault(key, [])
+                pixels = None
+                if groups and self.dedup == "perceptual":
+                    # Proxy hashes collide for similar images, so compare real pixels
+                    pixels = pixel_digest(data)
+                    for candidate in groups:
+                        if candidate[4] is None:
+                            with open(candidate[0].input_path, "rb") as f:
+                                candidate[4] = pixel_digest(f.read())
+                    matches = [candidate for candidate in groups if candidate[4] == pixels]
+                else:
+                    matches = groups
+                if not matches:
+                    group = [job, [], None, None, pixels]
+                    groups.append(group)
+                    return group
+                group = matches[0]
+                if group[2] is None:
+                    group[1].append((job, digest))
+                    return None
+                first, outcome, outputs = group[0], group[2], group[3]
+            resolve_duplicate(first, job, digest, outcome, outputs)
+            return None
+
+        def resolve_duplicate(first, job, digest, outcome, outputs=None):
+            if outcome == "done":
+                linked_outputs = None
+                try:
+                    if outputs:
+                        # Variants share the output path's stem, so swap it
+                        first_stem = os.path.splitext(first.output_path)[0]
+                        job_stem = os.path.splitext(job.output_path)[0]
+                        linked_outputs = [dict(entry, path=job_stem + entry["path"][len(first_stem):])
+                                          for entry in outputs]
+                        for entry, linked_entry in zip(outputs, linked_outputs):
+                            link_output(entry["path"], linked_entry["path"])
+                    else:
+                        link_output(first.output_path, job.output_path)
+                except Exception as e:
+                    record(job, digest, e)
+                    return
+                record(job, digest, linked=True, outputs=linked_outputs)
+            else:
+                record(job, digest, f"duplicate of {first.input_path}: {outcome}")
+
+        def finish(job, digest, group, error=None, outputs=None):
+            """Record a processed job and settle any duplicates waiting on it"""
+            record(job, digest, error, outputs=outputs)
+            if group is None:
+                return
+            with dedup_lock:
+                group[2] = "done" if error is None else str(error)
+                group[3] = outputs
+                waiting, group[1] = group[1], []
+            for duplicate, duplicate_digest in waiting:
+                resolve_duplicate(job, duplicate, duplicate_digest, group[2], outputs)
+
+        def dedup_key(job, digest, data):
+            extension = os.path.splitext(job.output_path)[1].lower()
+            if self.dedup == "perceptual":
+                return ("perceptual", extension) + perceptual_hash(data)
+            return ("exact", extension, digest)
+
+        def read_stage():
+            while True:
+                job = next_job()
+                if job is None:
+                    return
+                digest = None
+                try:
+                    if self.manifest is not None and job.mtime is None:
+                        stat = os.stat(job.input_path)
+                        job = job._replace(mtime=stat.st_mtime, size=stat.st_size)
+                    if (self.skip_unchanged == "stat"
+                            and self.manifest.is_unchanged(job, job.mtime, job.size)):
+                        record(job, skipped=True)
+                        continue
+
+                    with track_operation("read") as operation:
+                        with open(job.input_path, "rb") as f:
+                            data = f.read()
+                        operation.nbytes = len(data)
+
+                    if self.manifest is not None or self.dedup:
+                        digest = content_digest(data)
+                    if self.manifest is not None:
+                        if self.skip_unchanged and self.manifest.is_done(job, digest):
+                            # Touched but identical: refresh the stat fields so
+                            # the next incremental run skips it without reading
+                            if self.skip_unchanged == "stat":
+                                self.manifest.record_done(job, digest, job.mtime, job.size,
+                                                          self.manifest.recorded_outputs(job))
+                            record(job, skipped=True)
+                            continue
+
+                    group = None
+                    if self.dedup:
+                        group = claim_duplicate(dedup_key(job, digest, data), job, digest, data)
+                        if group is None:
+                            continue
+                except Exception as e:
+                    record(job, digest, e)
+                    continue
+                read_queue.put((job, digest, group, data))
+
+        def transform_stage():
+            while True:
+                item = read_queue.get()
+                if item is None:
+                    return
+                job, digest, group, data = item
+                if self.cancel_event.is_set():
+                    continue
+                try:
+                    with track_operation("decode") as operation:
+                        image = Image.open(io.BytesIO(data))
+                        if image.mode in ('RGBA', 'LA', 'P'):
+                            image = image.convert('RGB')
+                        image.load()
+                        operation.nbytes = image_nbytes(image)
+                    with track_operation("transform", image_nbytes(image)):
+                        image = self.transform(image, job)
+                except Exception as e:
+                    finish(job, digest, group, e)
+                    continue
+                write_queue.put((job, digest, group, image))
+
+        created_dirs = set()
+
+        def write_stage():
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    return
+                job, digest, group, image = item
+                if self.cancel_event.is_set():
+                    continue
+                outputs = None
+                try:
+                    output_dir = os.path.dirname(job.output_path)
+                    if output_dir not in created_dirs:
+                        os.makedirs(output_dir, exist_ok=True)
+                        created_dirs.add(output_dir)
+                    nbytes = (sum(image_nbytes(variant) for variant in image.values())
+                              if isinstance(image, dict) else image_nbytes(image))
+                    with track_operation("write", nbytes):
+                        if isinstance(image, dict):
+                            outputs = write_variants(image, job.output_path, self.profile,
+                                                     self.target_size, **self.save_kwargs)
+                        elif self.target_size:
+                            data, _ = encode_to_target_size(image, self.target_size,
+                                                            image_format(job.output_path), self.profile,
+                                                            strict=True)
+                            with open(job.output_path, "wb") as f:
+                                f.write(data)
+                        else:
+                            encode_image(image, job.output_path, profile=self.profile, **self.save_kwargs)
+                except Exception as e:
+                    finish(job, digest, group, e)
+                    continue
+                finish(job, digest, group, outputs=outputs)
+
+        def start_threads(target, count):
+            threads = [threading.Thread(target=target, daemon=True) for _ in range(count)]
+            for thread in threads:
+                thread.start()
+            return threads
+
+        readers = start_threads(read_stage, self.readers)
+        workers = start_threads(transform_stage, self.workers)
+        writers = start_threads(write_stage, self.writers)
+
+        # Shut the stages down in order once the one upstream has drained
+        for thread in readers:
+            thread.join()
+        for _ in workers:
+            read_queue.put(None)
+        for thread in workers:
+            thread.join()
+        for _ in writers:
+            write_queue.put(None)
+        for thread in writers:
+            thread.join()
+
+        result.cancelled = self.cancel_event.is_set()
+        result.elapsed = time.perf_counter() - start
+        if scan_errors:
+            raise scan_errors[0]
+        return result
+
+def run_batch(input_folder, output_folder, transform_fn, settings, prefix, resume=False,
+              incremental=None, recursive=False, include=None, exclude=None, dedup=None,
+              profile="balanced", save_kwargs=None, target_size=None, on_progress=None,
+              cancel_event=None):
+    """Run a folder batch job, journalling results in the output folder
+
+    resume skips inputs whose content hash was already processed with the
+    same settings. incremental="stat" makes that decision from mtime and
+    size where possible, so unchanged files are not even read, and
+    incremental="hash" always compares content hashes. recursive, include
+    and exclude control which files the scanner picks up, and dedup
+    processes duplicate inputs only once: "exact" for byte-identical
+    files, "perceptual" also for files that decode to the same pixels.
+    With target_size, outputs are written as JPEG (WebP inputs stay WebP)
+    at the highest quality that fits in that many bytes.
+    """
+    save_kwargs = save_kwargs or {}
+    # Absolute paths keep manifest records valid across working directories
+    input_folder = os.path.abspath(input_folder)
+    output_folder = os.path.abspath(output_folder)
+    os.makedirs(output_folder, exist_ok=True)
+    jobs = iter_batch_jobs(input_folder, output_folder, prefix, recursive, include, exclude)
+    if target_size:
+        jobs = (job if job.output_path.lower().endswith(('.jpg', '.jpeg', '.webp'))
+                else job._replace(output_path=os.path.splitext(job.output_path)[0] + ".jpg")
+                for job in jobs)
+    if incremental == "stat":
+        skip_unchanged = "stat"
+    elif incremental == "hash" or resume:
+        skip_unchanged = "hash"
+    else:
+        skip_unchanged = None
+
+    manifest = BatchManifest(output_folder, dict(settings, profile=profile, save=save_kwargs,
+                                                 target_size=target_size),
+                             resume=skip_unchanged is not None)
+    try:
+        pipeline = BatchPipeline(transform_fn, profile=profile, save_kwargs=save_kwargs,
+                                 target_size=target_size, manifest=manifest,
+                                 skip_unchanged=skip_unchanged, dedup=dedup,
+                                 on_progress=on_progress, cancel_event=cancel_event)
+        result = pipeline.run(jobs)
+    finally:
+        manifest.close()
+    if result.outputs:
+        write_variants_manifest(output_folder, input_folder, result.outputs)
+    return result
+
+
+def run_stack_batch(input_folder, output_folder, brightness=1.0, contrast=1.0, saturation=1.0,
+                    prefix="adjusted_", recursive=False, include=None, exclude=None,
+                    profile="balanced", frames=STACK_FRAMES, workers=None, on_progress=None,
+                    cancel_event=None):
+    """Apply the same brightness, contrast and saturation to a folder of frames, in stacks
+
+    Meant for bursts and timelapses: up to frames inputs are decoded in
+    parallel, same-sized frames are adjusted together with adjust_stack in
+    one vectorized pass, and the results are encoded in parallel while the
+    next stack is being decoded. Frames of another size form their own
+    stack. Returns a BatchResult; there is no manifest, so jobs cannot be
+    resumed.
+    """
+    input_folder = os.path.abspath(input_folder)
+    output_folder = os.path.abspath(output_folder)
+    os.makedirs(output_folder, exist_ok=True)
+    jobs = iter_batch_jobs(input_folder, output_folder, prefix, recursive, include, exclude)
+    cancel_event = cancel_event or threading.Event()
+    result = BatchResult()
+    start = time.perf_counter()
+
+    def read(job):
+        return np.asarray(decode_image(job.input_path))
+
+    def write(job, frame):
+        os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+        encode_image(Image.fromarray(frame), job.output_path, profile=profile)
+
+    def collect(futures):
+        for job, future in futures:
+            try:
+                future.result()
+                result.processed += 1
+            except Exception as e:
+                result.failed.append((job.input_path, str(e)))
+            if on_progress:
+                on_progress(result)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        def submit_reads():
+            return [(job, pool.submit(read, job)) for job in itertools.islice(jobs, frames)]
+
+        reads = submit_reads()
+        writes = []
+        while reads and not cancel_event.is_set():
+            stacks = {}
+            for job, future in reads:
+                try:
+                    frame = future.result()
+                except Exception as e:
+                    result.failed.append((job.input_path, str(e)))
+                    continue
+                stacks.setdefault(frame.shape, []).append((job, frame))
+
+            # Decode the next stack while this one is adjusted and encoded,
+            # but finish the previous writes first to bound memory
+            reads = submit_reads()
+            collect(writes)
+            writes = []
+            for members in stacks.values():
+                adjusted = adjust_stack(np.stack([frame for _, frame in members]),
+                                        brightness, contrast, saturation)
+                writes += [(job, pool.submit(write, job, frame))
+                           for (job, _), frame in zip(members, adjusted)]
+        collect(writes)
+        for _, future in reads:
+            future.cancel()
+
+    result.cancelled = cancel_event.is_set()
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def is_video(path):
+    """Check whether a path names a video container we can read and write"""
+    return os.path.splitext(path)[1].lower() in VIDEO_CODECS
+
+
+def open_video(path):
+    """Open a local video file for reading, refusing URLs, devices and pipelines"""
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Video file not found: {path}")
+    capture = cv2.VideoCapture(os.path.abspath(path), cv2.CAP_FFMPEG)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video: {path}")
+    return capture
+
+
+def video_properties(path):
+    """Return the frame rate, (width, height) and approximate frame count of a video file"""
+    capture = open_video(path)
+    try:
+        size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        return capture.get(cv2.CAP_PROP_FPS) or 25.0, size, int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        capture.release()
+
+
+def read_frames(source, cancel_event=None):
+    """Lazily yield RGB frames from a video file or a folder of images
+
+    Folders are read in file name order, so numbered timelapse frames come
+    out in sequence. Only one frame is decoded per step of the generator.
+    """
+    if os.path.isdir(source):
+        paths = sorted(entry.path for entry, _ in scan_images(source, recursive=False))
+        for path in paths:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            yield decode_image(path)
+        return
+
+    capture = open_video(source)
+    try:
+        while cancel_event is None or not cancel_event.is_set():
+            with track_operation("decode") as operation:
+                ok, frame = capture.read()
+                if ok:
+                    image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                    operation.nbytes = image_nbytes(image)
+            if not ok:
+                return
+            yield image
+    finally:
+        capture.release()
+
+
+def map_frames(transform_fn, frames, workers=None, buffer=None):
+    """Yield transform_fn(frame) for a stream of frames, in order, using a thread pool
+
+    At most buffer frames (FRAME_BUFFER per worker by default) are decoded
+    or in flight at once, so memory stays bounded however long the stream.
+    """
+    workers = workers or os.cpu_count() or 1
+    buffer = buffer or workers * FRAME_BUFFER
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            for frame in frames:
+                pending.append(pool.submit(transform_fn, frame))
+                if len(pending) >= buffer:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def write_video(frames, path, fps):
+    """Encode a stream of same-sized RGB frames into a local video file and return the count"""
+    fourcc = cv2.VideoWriter_fourcc(*VIDEO_CODECS[os.path.splitext(path)[1].lower()])
+    writer = None
+    count = 0
+    try:
+        for frame in frames:
+            if writer is None:
+                size = frame.size
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                writer = cv2.VideoWriter(path, fourcc, fps, size)
+                if not writer.isOpened():
+                    raise ValueError(f"Could not write video: {path}")
+            elif frame.size != size:
+                raise ValueError(f"Frame {count} is {frame.size[0]}×{frame.size[1]}, "
+                                 f"expected {size[0]}×{size[1]}")
+            with track_operation("write", image_nbytes(frame)):
+                writer.write(cv2.cvtColor(np.asarray(frame.convert("RGB")), cv2.COLOR_RGB2BGR))
+            count += 1
+    finally:
+        if writer is not None:
+            writer.release()
+    return count
+
+
+def make_frame_transform(box=None, rotation=0, brightness=1.0, contrast=1.0, saturation=1.0,
+                         sharpness=1.0, filter_name=None):
+    """Build a per-frame transform: crop, rotate, adjust, then an optional PIL_FILTERS filter"""
+    def transform_frame(frame):
+        if box:
+            frame = frame.crop(box)
+        if rotation:
+            frame = frame.rotate(-rotation, expand=True, fillcolor=(255, 255, 255))
+        frame = apply_adjustments(frame, brightness, contrast, saturation, sharpness)
+        if filter_name:
+            frame = apply_pil_filter(frame, filter_name)
+        return frame
+    return transform_frame
+
+
+def run_frames(source, target, transform_fn, fps=None, profile="balanced", workers=None,
+               on_progress=None, cancel_event=None):
+    """Stream the frames of a video file or image folder through transform_fn into target
+
+    target is a video file (its extension picks the codec) or a folder that
+    receives numbered images. Frames are decoded one at a time, transformed
+    in parallel with bounded buffering and written in order, so nothing is
+    ever extracted to disk first. The output keeps the source frame rate
+    unless fps is given (folders default to 25 fps). Returns a BatchResult
+    counting frames.
+    """
+    cancel_event = cancel_event or threading.Event()
+    result = BatchResult()
+    start = time.perf_counter()
+    if fps is None:
+        fps = 25.0 if os.path.isdir(source) else video_properties(source)[0]
+
+    def counted(frames):
+        for frame in frames:
+            result.processed += 1
+            if on_progress:
+                on_progress(result)
+            yield frame
+
+    frames = map_frames(transform_fn, read_frames(source, cancel_event), workers)
+    if is_video(target):
+        write_video(counted(frames), target, fps)
+    else:
+        os.makedirs(target, exist_ok=True)
+        # Encoding is CPU work too, so it runs on the frame workers as well
+        numbered = enumerate(frames, 1)
+        writes = map_frames(lambda item: encode_image(item[1], os.path.join(target, f"frame_{item[0]:06d}.png"),
+                                                      profile=profile),
+                            numbered, workers)
+        for _ in counted(writes):
+            pass
+
+    result.cancelled = cancel_event.is_set()
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def write_variants_manifest(output_folder, input_folder, outputs):
+    """Merge multi-size export entries into the output folder's variants.json"""
+    manifest_path = os.path.join(output_folder, VARIANTS_NAME)
+    variants = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            variants = json.load(f)
+    for input_path, entries in outputs.items():
+        variants[os.path.relpath(input_path, input_folder)] = [
+            dict(entry, path=os.path.relpath(entry["path"], output_folder)) for entry in entries
+        ]
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump(variants, f, indent=2, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+def batch_throughput(result):
+    """Describe a batch result's processing rate, overall and per CPU core"""
+    handled = result.processed + len(result.failed)
+    rate = handled / result.elapsed if result.elapsed > 0 else 0.0
+    return f"{rate:.1f} images/s ({rate / (os.cpu_count() or 1):.2f} images/s per core)"
+
+
+def batch_summary(result):
+    """Describe a batch result in one line"""
+    summary = f"Processed {result.processed} images"
+    if result.linked:
+        summary += f" ({result.linked} duplicates linked)"
+    if result.skipped:
+        summary += f", skipped {result.skipped} unchanged"
+    if result.failed:
+        summary += f", {len(result.failed)} failed"
+    if result.cancelled:
+        summary += " (cancelled)"
+    return summary
+
+
+def run_batch_cli(argv):
+    """Run a batch job from the command line and return an exit code"""
+    parser = argparse.ArgumentParser(
+        prog="enhanced_main.py batch",
+        description="Crop, resize, straighten, adjust or export size ladders of every image in a folder "
+                    "without starting the GUI"
+    )
+    subparsers = parser.add_subparsers(dest="operation", required=True)
+
+    crop_parser = subparsers.add_parser("crop", help="crop every image to a box or template")
+    crop_area = crop_parser.add_mutually_exclusive_group(required=True)
+    crop_area.add_argument("--box", type=int, nargs=4,
+                           metavar=("X1", "Y1", "X2", "Y2"), help="crop box in pixels")
+    crop_area.add_argument("--trim", type=int, nargs="?", const=TRIM_TOLERANCE, metavar="TOLERANCE",
+                           help="trim uniform margins, treating colours within TOLERANCE of the "
+                                f"border as margin (default {TRIM_TOLERANCE})")
+    crop_area.add_argument("--template", metavar="NAME|W:H",
+                           help="largest crop of a template's aspect ratio, e.g. 16:9 or 'Portrait (4:5)'")
+    crop_parser.add_argument("--smart", action="store_true",
+                             help="place template crops on the most salient content instead of the centre")
+    crop_parser.add_argument("--faces", action="store_true",
+                             help="centre template crops on detected faces, falling back to --smart placement")
+
+    resize_parser = subparsers.add_parser("resize", help="resize every image")
+    resize_parser.add_argument("--width", type=int, required=True)
+    resize_parser.add_argument("--height", type=int, required=True)
+    resize_parser.add_argument("--stretch", action="store_true",
+                               help="ignore the aspect ratio instead of fitting inside the box")
+
+    sizes_parser = subparsers.add_parser("sizes", help="export a responsive ladder of widths")
+    sizes_parser.add_argument("--widths", type=int, nargs="+", default=list(DEFAULT_LADDER_WIDTHS),
+                              help="output widths in pixels (default: %(default)s)")
+
+    deskew_parser = subparsers.add_parser("deskew", help="level skewed text scans")
+    perspective_parser = subparsers.add_parser("perspective",
+                                               help="flatten the document outline found in each photo")
+
+    adjust_parser = subparsers.add_parser("adjust", help="apply the same brightness, contrast and "
+                                                         "saturation to a burst or timelapse")
+    adjust_parser.add_argument("input_folder")
+    adjust_parser.add_argument("output_folder")
+    adjust_parser.add_argument("--brightness", type=float, default=1.0)
+    adjust_parser.add_argument("--contrast", type=float, default=1.0)
+    adjust_parser.add_argument("--saturation", type=float, default=1.0)
+    adjust_parser.add_argument("--frames", type=int, default=STACK_FRAMES,
+                               help="frames adjusted together in one stack (default: %(default)s)")
+    adjust_parser.add_argument("--recursive", "-r", action="store_true",
+                               help="descend into subfolders and mirror them in the output folder")
+    adjust_parser.add_argument("--include", action="append", metavar="GLOB",
+                               help="only process files matching this pattern (repeatable)")
+    adjust_parser.add_argument("--exclude", action="append", metavar="GLOB",
+                               help="skip files and folders matching this pattern (repeatable)")
+    adjust_parser.add_argument("--profile", choices=sorted(ENCODER_PROFILES), default="balanced",
+                               help="encoder settings: fast writes, small files or balanced (default)")
+
+    video_parser = subparsers.add_parser("video", help="crop, rotate, adjust and filter the frames of a "
+                                                       "video file or image folder")
+    video_parser.add_argument("source", help="local video file or folder of frames")
+    video_parser.add_argument("target", help="video file (" + ", ".join(sorted(VIDEO_CODECS)) +
+                                             ") or folder for numbered PNG frames")
+    video_parser.add_argument("--box", type=int, nargs=4, metavar=("X1", "Y1", "X2", "Y2"),
+                              help="crop box in pixels")
+    video_parser.add_argument("--rotate", type=float, default=0, metavar="DEGREES")
+    video_parser.add_argument("--brightness", type=float, default=1.0)
+    video_parser.add_argument("--contrast", type=float, default=1.0)
+    video_parser.add_argument("--saturation", type=float, default=1.0)
+    video_parser.add_argument("--sharpness", type=float, default=1.0)
+    video_parser.add_argument("--filter", choices=sorted(PIL_FILTERS), help="PIL filter applied last")
+    video_parser.add_argument("--fps", type=float, help="output frame rate (default: the source's)")
+    video_parser.add_argument("--profile", choices=sorted(ENCODER_PROFILES), default="balanced",
+                              help="encoder settings for frame folders (default: balanced)")
+
+    for sub in (crop_parser, resize_parser, sizes_parser, deskew_parser, perspective_parser):
+        sub.add_argument("input_folder")
+        sub.add_argument("output_folder")
+        sub.add_argument("--resume", action="store_true",
+                         help="skip inputs the manifest in the output folder records as done")
+        sub.add_argument("--incremental", nargs="?", const="stat", choices=("stat", "hash"),
+                         help="only process new or changed inputs, compared by mtime/size "
+                              "(default) or content hash")
+        sub.add_argument("--recursive", "-r", action="store_true",
+                         help="descend into subfolders and mirror them in the output folder")
+        sub.add_argument("--include", action="append", metavar="GLOB",
+                         help="only process files matching this pattern (repeatable)")
+        sub.add_argument("--exclude", action="append", metavar="GLOB",
+                         help="skip files and folders matching this pattern (repeatable)")
+        sub.add_argument("--dedup", nargs="?", const="exact", choices=("exact", "perceptual"),
+                         help="process duplicate inputs once and hard-link the result "
+                              "(byte-identical by default, or perceptual: same decoded pixels)")
+        sub.add_argument("--profile", choices=sorted(ENCODER_PROFILES), default="balanced",
+                         help="encoder settings: fast writes, small files or balanced (default)")
+        sub.add_argument("--target-kb", type=int, metavar="KB",
+                         help="write JPEG/WebP at the highest quality under this size")
+
+    for sub in subparsers.choices.values():
+        sub.add_argument("--metrics", action="store_true",
+                         help="print per-operation timings, throughput and peak memory afterwards")
+        sub.add_argument("--cprofile", metavar="FILE",
+                         help="profile every operation with cProfile and save the stats to FILE")
+
+    args = parser.parse_args(argv)
+    METRICS.reset()
+    METRICS.set_memory_tracing(args.metrics)
+    METRICS.set_profiling(bool(args.cprofile))
+    try:
+        return run_batch_operation(parser, args)
+    finally:
+        if args.metrics:
+            print(METRICS.report())
+        if args.cprofile and METRICS.save_profile(args.cprofile):
+            print(f"💾 Profile saved to {args.cprofile}")
+        METRICS.set_profiling(False)
+        METRICS.set_memory_tracing(False)
+
+
+def run_batch_operation(parser, args):
+    """Run the batch job described by run_batch_cli's parsed arguments"""
+    def report(result):
+        done = result.processed + result.skipped + len(result.failed)
+        if done % 100 == 0:
+            print(f"   {done} images handled...")
+
+    if args.operation == "adjust":
+        try:
+            result = run_stack_batch(args.input_folder, args.output_folder, args.brightness,
+                                     args.contrast, args.saturation, recursive=args.recursive,
+                                     include=args.include, exclude=args.exclude, profile=args.profile,
+                                     frames=max(1, args.frames), on_progress=report)
+        except KeyboardInterrupt:
+            print("\n🛑 Batch interrupted")
+            return 130
+        print(f"✅ Batch adjust completed: {batch_summary(result)} in {result.elapsed:.1f}s, "
+              f"{batch_throughput(result)}")
+        for input_path, error in result.failed:
+            print(f"⚠️  {input_path}: {error}")
+        return 1 if result.failed else 0
+
+    if args.operation == "video":
+        # Only extensionless paths and existing folders are frame folders, so a
+        # typo or an unsupported container like .webm is not silently turned into one
+        extension = os.path.splitext(args.target)[1]
+        if extension and not is_video(args.target) and not os.path.isdir(args.target):
+            parser.error(f"cannot write {extension} video; use " + ", ".join(sorted(VIDEO_CODECS)) +
+                         " or a folder name without an extension for PNG frames")
+        transform_fn = make_frame_transform(tuple(args.box) if args.box else None, args.rotate,
+                                            args.brightness, args.contrast, args.saturation,
+                                            args.sharpness, args.filter)
+        try:
+            result = run_frames(args.source, args.target, transform_fn, fps=args.fps, profile=args.profile,
+                                on_progress=report)
+        except KeyboardInterrupt:
+            print("\n🛑 Video processing interrupted")
+            return 130
+        except (OSError, ValueError) as e:
+            print(f"❌ {e}")
+            return 1
+        print(f"✅ Processed {result.processed} frames in {result.elapsed:.1f}s")
+        return 0
+
+    if args.operation == "crop" and args.trim is not None:
+        transform_fn = make_trim_transform(args.trim)
+        settings = {"operation": "trim", "tolerance": args.trim}
+        prefix = "trimmed_"
+    elif args.operation == "crop" and args.template:
+        try:
+            ratio = parse_aspect(args.template)
+        except ValueError as e:
+            parser.error(str(e))
+        transform_fn = make_template_crop_transform(ratio, args.smart, args.faces)
+        settings = {"operation": "crop", "template": list(ratio), "smart": args.smart, "faces": args.faces}
+        prefix = "cropped_"
+    elif args.operation == "crop":
+        if args.smart or args.faces:
+            parser.error("--smart and --faces need --template")
+        box = tuple(args.box)
+        transform_fn = lambda img, job: img.crop(box)
+        settings = {"operation": "crop", "box": list(box)}
+        prefix = "cropped_"
+    elif args.operation == "deskew":
+        transform_fn = make_deskew_transform()
+        settings = {"operation": "deskew"}
+        prefix = "deskewed_"
+    elif args.operation == "perspective":
+        transform_fn = make_perspective_transform()
+        settings = {"operation": "perspective"}
+        prefix = "corrected_"
+    elif args.operation == "sizes":
+        transform_fn = make_ladder_transform(args.widths)
+        settings = {"operation": "sizes", "widths": sorted(args.widths)}
+        prefix = ""
+    else:
+        transform_fn = make_resize_transform(args.width, args.height, not args.stretch)
+        settings = {"operation": "resize", "width": args.width, "height": args.height,
+                    "maintain_ratio": not args.stretch}
+        prefix = "resized_"
+
+    try:
+        result = run_batch(args.input_folder, args.output_folder, transform_fn, settings, prefix,
+                           resume=args.resume, incremental=args.incremental,
+                           recursive=args.recursive, include=args.include, exclude=args.exclude,
+                           dedup=args.dedup, profile=args.profile,
+                           target_size=args.target_kb * 1024 if args.target_kb else None,
+                           on_progress=report)
+    except KeyboardInterrupt:
+        print("\n🛑 Batch interrupted - rerun with --resume to continue")
+        return 130
+
+    print(f"✅ Batch {args.operation} completed: {batch_summary(result)} in {result.elapsed:.1f}s, "
+          f"{batch_throughput(result)}")
+    if result.failed:
+        manifest_path = os.path.join(args.output_folder, MANIFEST_NAME)
+        print(f"⚠️  {len(result.failed)} failures recorded in {manifest_path}")
+        return 1
+    return 0
+
+
 class EnhancedImageCropper:
     def __init__(self):
         self.root = ctk.CTk()
@@ -56,16 +3201,44 @@ class EnhancedImageCropper:
         self.displayed_image = None
         self.tk_image = None
         self.crop_coords = None
-        self.rect = None
+        self.crop_overlay = {}
+        self.crop_drag = None
+        self.crop_motion = None
+        self.corner_points = None
+        self.image_item = None
         self.start_x = None
         self.start_y = None
         self.zoom_factor = 1.0
         self.rotation_angle = 0
-        self.history = []
-        self.history_index = -1
+        self.history = EditHistory()
         self.templates = self.load_templates()
         self.processing = False
-        
+
+        # Folder browser state
+        self.current_path = None
+        self.folder_files = []
+        self.folder_positions = {}
+        self.browser_thumbs = {}
+        self.browser_items = {}
+        self.browser_columns = 0
+        self.browser_generation = 0
+        self.browser_futures = []
+        self.thumbnail_cache = None
+        self.thumbnail_pool = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+        self.thumbnail_queue = queue.Queue()
+        self.prefetch_cache = PrefetchCache()
+        self.browse_step = 1
+
+        # Background tasks; image edits run one at a time, guarded by self.processing
+        self.task_runner = TaskRunner()
+        self.batch_task = None
+
+        # Histogram statistics, keyed by history state so undo/redo reuses them
+        self.stats_cache = OrderedDict()
+        self.stats_runner = TaskRunner(workers=1)
+        self.stats_job = None
+        self.histogram_lines = {}
+
         # Setup UI
         self.setup_ui()
         self.setup_canvas()
@@ -138,19 +3311,17 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         main_container = ctk.CTkFrame(self.root)
         main_container.pack(fill="both", expand=True, padx=10, pady=10)
         
-        # Left panel for tools
-        self.left_panel = ctk.CTkFrame(main_container, width=280)
+        # Left panel for tools (scrollable so the folder browser fits)
+        self.left_panel = ctk.CTkScrollableFrame(main_container, width=280)
         self.left_panel.pack(side="left", fill="y", padx=(0, 10))
-        self.left_panel.pack_propagate(False)
         
         # Center panel for image display
         self.center_panel = ctk.CTkFrame(main_container)
         self.center_panel.pack(side="left", fill="both", expand=True, padx=(0, 10))
         
         # Right panel for properties
-        self.right_panel = ctk.CTkFrame(main_container, width=250)
+        self.right_panel = ctk.CTkScrollableFrame(main_container, width=250)
         self.right_panel.pack(side="right", fill="y")
-        self.right_panel.pack_propagate(False)
         
         self.setup_left_panel()
         self.setup_center_panel()
@@ -168,7 +3339,41 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         ctk.CTkButton(file_frame, text="Open Image", command=self.open_image).pack(fill="x", pady=2)
         ctk.CTkButton(file_frame, text="Save Image", command=self.save_image).pack(fill="x", pady=2)
         ctk.CTkButton(file_frame, text="Export As...", command=self.export_image).pack(fill="x", pady=2)
-        
+        ctk.CTkButton(file_frame, text="Export Sizes...", command=self.export_sizes).pack(fill="x", pady=2)
+
+        # Folder Browser
+        browser_frame = ctk.CTkFrame(self.left_panel)
+        browser_frame.pack(fill="x", padx=10, pady=10)
+
+        ctk.CTkLabel(browser_frame, text="🗂️ Folder Browser", font=ctk.CTkFont(size=16, weight="bold")).pack(pady=5)
+
+        ctk.CTkButton(browser_frame, text="Open Folder", command=self.open_folder).pack(fill="x", pady=2)
+
+        nav_buttons = ctk.CTkFrame(browser_frame)
+        nav_buttons.pack(fill="x", pady=2)
+
+        ctk.CTkButton(nav_buttons, text="◀ Previous", width=70, command=self.previous_image).pack(side="left", padx=2)
+        ctk.CTkButton(nav_buttons, text="Next ▶", width=70, command=self.next_image).pack(side="left", padx=2)
+
+        strip_frame = ctk.CTkFrame(browser_frame)
+        strip_frame.pack(fill="x", pady=2)
+
+        self.browser_canvas = tk.Canvas(strip_frame, height=240, bg="#2b2b2b", highlightthickness=0)
+        browser_scrollbar = ttk.Scrollbar(strip_frame, orient="vertical", command=self.on_browser_scroll)
+        self.browser_canvas.configure(yscrollcommand=browser_scrollbar.set)
+
+        browser_scrollbar.pack(side="right", fill="y")
+        self.browser_canvas.pack(side="left", fill="both", expand=True)
+
+        self.browser_canvas.bind("<Button-1>", self.on_browser_click)
+        self.browser_canvas.bind("<Configure>", lambda event: self.render_browser())
+        self.browser_canvas.bind("<MouseWheel>", self.on_browser_wheel)
+        self.browser_canvas.bind("<Button-4>", self.on_browser_wheel)
+        self.browser_canvas.bind("<Button-5>", self.on_browser_wheel)
+
+        self.browser_label = ctk.CTkLabel(browser_frame, text="No folder open")
+        self.browser_label.pack(pady=2)
+
         # Crop Templates
         template_frame = ctk.CTkFrame(self.left_panel)
         template_frame.pack(fill="x", padx=10, pady=10)
@@ -176,14 +3381,20 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         ctk.CTkLabel(template_frame, text="📐 Crop Templates", font=ctk.CTkFont(size=16, weight="bold")).pack(pady=5)
         
         self.template_var = ctk.StringVar(value="Custom")
-        template_options = ["Custom", "Square (1:1)", "Portrait (4:5)", "Landscape (16:9)", 
-                           "Instagram Post (1:1)", "Instagram Story (9:16)", "Facebook Cover (16:9)",
-                           "Twitter Header (3:1)", "YouTube Thumbnail (16:9)"]
+        template_options = ["Custom"] + list(CROP_TEMPLATES)
         
         self.template_menu = ctk.CTkOptionMenu(template_frame, variable=self.template_var, 
                                               values=template_options, command=self.apply_template)
         self.template_menu.pack(fill="x", pady=2)
         
+        # Place template crops on the most salient content instead of the centre
+        self.smart_crop_var = ctk.BooleanVar(value=True)
+        ctk.CTkCheckBox(template_frame, text="Smart placement", variable=self.smart_crop_var,
+                        command=lambda: self.apply_template(self.template_var.get())).pack(anchor="w", pady=2)
+        self.face_crop_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(template_frame, text="Centre on faces", variable=self.face_crop_var,
+                        command=lambda: self.apply_template(self.template_var.get())).pack(anchor="w", pady=2)
+        
         # Custom dimensions
         dim_frame = ctk.CTkFrame(template_frame)
         dim_frame.pack(fill="x", pady=5)
@@ -209,6 +3420,16 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         ctk.CTkLabel(basic_frame, text="✂️ Basic Operations", font=ctk.CTkFont(size=16, weight="bold")).pack(pady=5)
         
         ctk.CTkButton(basic_frame, text="Crop Selection", command=self.crop_image).pack(fill="x", pady=2)
+        ctk.CTkButton(basic_frame, text="Auto Trim", command=self.auto_trim).pack(fill="x", pady=2)
+        
+        self.trim_tolerance_label = ctk.CTkLabel(basic_frame, text=f"Trim tolerance: {TRIM_TOLERANCE}")
+        self.trim_tolerance_label.pack()
+        self.trim_tolerance_slider = ctk.CTkSlider(
+            basic_frame, from_=0, to=100, number_of_steps=100,
+            command=lambda value: self.trim_tolerance_label.configure(text=f"Trim tolerance: {int(value)}")
+        )
+        self.trim_tolerance_slider.pack(fill="x", pady=2)
+        self.trim_tolerance_slider.set(TRIM_TOLERANCE)
         ctk.CTkButton(basic_frame, text="Reset Image", command=self.reset_image).pack(fill="x", pady=2)
         ctk.CTkButton(basic_frame, text="Undo", command=self.undo).pack(fill="x", pady=2)
         ctk.CTkButton(basic_frame, text="Redo", command=self.redo).pack(fill="x", pady=2)
@@ -289,6 +3510,33 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
     def setup_right_panel(self):
         """Setup right panel with image adjustments and filters"""
         
+        # Background task progress
+        task_frame = ctk.CTkFrame(self.right_panel)
+        task_frame.pack(fill="x", padx=10, pady=10)
+        
+        ctk.CTkLabel(task_frame, text="⏳ Tasks", font=ctk.CTkFont(size=16, weight="bold")).pack(pady=5)
+        
+        self.task_label = ctk.CTkLabel(task_frame, text="Idle")
+        self.task_label.pack(fill="x")
+        self.task_progress = ctk.CTkProgressBar(task_frame)
+        self.task_progress.pack(fill="x", pady=2)
+        self.task_progress.set(0)
+        self.task_cancel_button = ctk.CTkButton(task_frame, text="Cancel", command=self.cancel_tasks,
+                                                state="disabled")
+        self.task_cancel_button.pack(fill="x", pady=2)
+        
+        # Histogram and channel statistics
+        histogram_frame = ctk.CTkFrame(self.right_panel)
+        histogram_frame.pack(fill="x", padx=10, pady=10)
+        
+        ctk.CTkLabel(histogram_frame, text="📊 Histogram", font=ctk.CTkFont(size=16, weight="bold")).pack(pady=5)
+        
+        self.histogram_canvas = tk.Canvas(histogram_frame, height=100, bg="#1a1a1a", highlightthickness=0)
+        self.histogram_canvas.pack(fill="x", pady=2)
+        self.stats_label = ctk.CTkLabel(histogram_frame, text="No image loaded", justify="left",
+                                        font=ctk.CTkFont(size=11))
+        self.stats_label.pack(fill="x", pady=2)
+        
         # Image Adjustments
         adj_frame = ctk.CTkFrame(self.right_panel)
         adj_frame.pack(fill="x", padx=10, pady=10)
@@ -348,6 +3596,10 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         for text, command in filter_buttons:
             ctk.CTkButton(filter_frame, text=text, command=command).pack(fill="x", pady=1)
         
+        # Restrict filters and advanced operations to the crop selection
+        self.selection_only_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(filter_frame, text="Selection only", variable=self.selection_only_var).pack(anchor="w", pady=2)
+        
         # Advanced Features
         advanced_frame = ctk.CTkFrame(self.right_panel)
         advanced_frame.pack(fill="x", padx=10, pady=10)
@@ -358,7 +3610,10 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
             ("Auto Enhance", self.auto_enhance),
             ("Noise Reduction", self.noise_reduction),
             ("Histogram Eq", self.histogram_equalization),
-            ("Color Balance", self.color_balance)
+            ("Color Balance", self.color_balance),
+            ("Deskew", self.deskew),
+            ("Auto Perspective", self.auto_perspective),
+            ("Pick Corners", self.pick_corners)
         ]
         
         for text, command in advanced_buttons:
@@ -372,28 +3627,52 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         
         ctk.CTkButton(batch_frame, text="Batch Crop", command=self.batch_crop).pack(fill="x", pady=1)
         ctk.CTkButton(batch_frame, text="Batch Resize", command=self.batch_resize).pack(fill="x", pady=1)
+        ctk.CTkButton(batch_frame, text="Batch Sizes", command=self.batch_sizes).pack(fill="x", pady=1)
+        ctk.CTkButton(batch_frame, text="Batch Trim", command=self.batch_trim).pack(fill="x", pady=1)
+        ctk.CTkButton(batch_frame, text="Batch Adjust", command=self.batch_adjust).pack(fill="x", pady=1)
+        ctk.CTkButton(batch_frame, text="Process Video...", command=self.process_video).pack(fill="x", pady=1)
+        ctk.CTkButton(batch_frame, text="Batch Deskew",
+                      command=lambda: self.batch_document("deskew")).pack(fill="x", pady=1)
+        ctk.CTkButton(batch_frame, text="Batch Perspective",
+                      command=lambda: self.batch_document("perspective")).pack(fill="x", pady=1)
+
+        self.batch_recursive_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(batch_frame, text="Include subfolders", variable=self.batch_recursive_var).pack(anchor="w", pady=2)
+
+        self.batch_dedup_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(batch_frame, text="Skip duplicate files", variable=self.batch_dedup_var).pack(anchor="w", pady=2)
+        
+        # Per-operation timings and profiling
+        performance_frame = ctk.CTkFrame(self.right_panel)
+        performance_frame.pack(fill="x", padx=10, pady=10)
+        
+        ctk.CTkLabel(performance_frame, text="📈 Performance", font=ctk.CTkFont(size=16, weight="bold")).pack(pady=5)
+        
+        ctk.CTkButton(performance_frame, text="Show Metrics", command=self.show_metrics).pack(fill="x", pady=1)
+        ctk.CTkButton(performance_frame, text="Reset Metrics", command=self.reset_metrics).pack(fill="x", pady=1)
+        ctk.CTkButton(performance_frame, text="Save Profile...", command=self.save_profile).pack(fill="x", pady=1)
+        
+        self.profiling_var = ctk.BooleanVar(value=False)
+        ctk.CTkCheckBox(performance_frame, text="Profile operations", variable=self.profiling_var,
+                        command=self.toggle_profiling).pack(anchor="w", pady=2)
     
     def setup_canvas(self):
         """Setup canvas bindings for cropping"""
         self.canvas.bind("<Button-1>", self.start_crop)
         self.canvas.bind("<B1-Motion>", self.update_crop)
         self.canvas.bind("<ButtonRelease-1>", self.end_crop)
+        self.canvas.bind("<Motion>", self.on_canvas_hover)
         self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
         self.canvas.bind("<Button-4>", self.on_mouse_wheel)
         self.canvas.bind("<Button-5>", self.on_mouse_wheel)
+
+        # Page Up/Down step through the open folder
+        self.root.bind("<Prior>", lambda event: self.previous_image())
+        self.root.bind("<Next>", lambda event: self.next_image())
     
     def load_templates(self):
         """Load crop templates"""
-        return {
-            "Square (1:1)": (1, 1),
-            "Portrait (4:5)": (4, 5),
-            "Landscape (16:9)": (16, 9),
-            "Instagram Post (1:1)": (1, 1),
-            "Instagram Story (9:16)": (9, 16),
-            "Facebook Cover (16:9)": (16, 9),
-            "Twitter Header (3:1)": (3, 1),
-            "YouTube Thumbnail (16:9)": (16, 9)
-        }
+        return dict(CROP_TEMPLATES)
     
     def load_presets(self):
         """Load application presets"""
@@ -410,13 +3689,8 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
     def save_to_history(self):
         """Save current state to history for undo/redo"""
         if self.current_image:
-            # Keep only last 20 states for memory efficiency
-            if len(self.history) >= 20:
-                self.history.pop(0)
-                
-            self.history = self.history[:self.history_index + 1]
-            self.history.append(self.current_image.copy())
-            self.history_index = len(self.history) - 1
+            # Edits replace current_image with a new image, so no copy is needed
+            self.history.record_full(self.current_image)
     
     def open_image(self):
         """Open and load an image file"""
@@ -433,32 +3707,283 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
             )
             
             if file_path:
-                # Load image
-                image = Image.open(file_path)
-                
-                # Convert to RGB if necessary
-                if image.mode in ('RGBA', 'LA', 'P'):
-                    image = image.convert('RGB')
-                
-                self.original_image = image
-                self.current_image = image.copy()
-                self.history = [image.copy()]
-                self.history_index = 0
-                
-                # Reset adjustments
-                self.reset_adjustments_silent()
-                
-                # Display image
-                self.display_image()
-                self.update_info_label()
-                
-                print(f"✅ Image loaded: {file_path}")
-                print(f"   Size: {image.size}, Mode: {image.mode}")
-                
+                self.load_image_path(file_path)
+
         except Exception as e:
             messagebox.showerror("Error", f"Could not open image: {str(e)}")
             print(f"❌ Error opening image: {e}")
-    
+
+    def load_image_path(self, file_path):
+        """Load an image file into the editor"""
+        with track_operation("open") as operation:
+            image = self.prefetch_cache.get(file_path)
+            operation.nbytes = image_nbytes(image)
+
+        self.original_image = image
+        self.current_image = image.copy()
+        self.history.clear()
+        self.current_path = file_path
+
+        # Reset adjustments
+        self.reset_adjustments_silent()
+
+        # Display image
+        self.display_image()
+        self.update_info_label()
+        self.highlight_browser_selection()
+        self.prefetch_neighbours()
+
+        print(f"✅ Image loaded: {file_path}")
+        print(f"   Size: {image.size}, Mode: {image.mode}")
+
+    # Folder browser functions
+    def open_folder(self):
+        """Open a folder in the thumbnail browser"""
+        if self.processing:
+            return
+
+        folder = filedialog.askdirectory(title="Select image folder")
+        if folder:
+            try:
+                self.load_folder(folder)
+            except Exception as e:
+                messagebox.showerror("Error", f"Could not open folder: {str(e)}")
+                print(f"❌ Error opening folder: {e}")
+
+    def load_folder(self, folder):
+        """List a folder and populate the browser from the thumbnail cache"""
+        entries = []
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    stat = entry.stat()
+                    entries.append((entry.path, stat.st_mtime, stat.st_size))
+        entries.sort(key=lambda e: e[0].lower())
+
+        # Drop work queued for the previous folder
+        for future in self.browser_futures:
+            future.cancel()
+        self.browser_futures = []
+        self.browser_generation += 1
+
+        if self.thumbnail_cache is None:
+            self.thumbnail_cache = ThumbnailCache()
+
+        self.prefetch_cache.clear()
+        self.folder_files = [path for path, _, _ in entries]
+        self.folder_positions = {path: i for i, path in enumerate(self.folder_files)}
+        self.browser_thumbs = self.thumbnail_cache.get_many(entries)
+
+        # Render whatever is missing in the background
+        generation = self.browser_generation
+        for path, mtime, size in entries:
+            if path not in self.browser_thumbs:
+                future = self.thumbnail_pool.submit(self.thumbnail_cache.generate, path, mtime, size)
+                future.add_done_callback(
+                    lambda f, p=path: self.thumbnail_queue.put((generation, p, f))
+                )
+                self.browser_futures.append(future)
+
+        self.clear_browser()
+        self.browser_canvas.yview_moveto(0)
+        self.render_browser()
+        self.update_browser_label()
+        if self.browser_futures:
+            self.root.after(50, self.poll_thumbnails)
+
+        cached = len(entries) - len(self.browser_futures)
+        print(f"✅ Folder opened: {folder} ({len(entries)} images, {cached} cached thumbnails)")
+
+    def next_image(self):
+        """Open the next image in the folder"""
+        self.step_folder(1)
+
+    def previous_image(self):
+        """Open the previous image in the folder"""
+        self.step_folder(-1)
+
+    def step_folder(self, step):
+        """Move through the open folder by step images"""
+        if self.processing or not self.folder_files:
+            return
+
+        index = self.folder_positions.get(self.current_path, -step) + step
+        if not 0 <= index < len(self.folder_files):
+            return
+
+        self.browse_step = step
+        try:
+            self.load_image_path(self.folder_files[index])
+            self.scroll_browser_to(index)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not open image: {str(e)}")
+            print(f"❌ Error opening image: {e}")
+
+    def prefetch_neighbours(self):
+        """Decode the images around the current one ahead of navigation"""
+        index = self.folder_positions.get(self.current_path)
+        if index is None:
+            return
+
+        # Read ahead in the direction of travel and keep one image behind
+        step = self.browse_step
+        ahead = [index + step * i for i in range(1, PREFETCH_AHEAD + 1)]
+        indices = ahead + [index - step]
+        paths = [self.folder_files[i] for i in indices if 0 <= i < len(self.folder_files)]
+        self.prefetch_cache.prefetch(paths)
+
+    def scroll_browser_to(self, index):
+        """Scroll the browser strip so the given cell is visible"""
+        canvas = self.browser_canvas
+        cell = THUMBNAIL_SIZE[0] + 8
+        rows = (len(self.folder_files) + self.browser_columns - 1) // max(1, self.browser_columns)
+        if not rows:
+            return
+
+        row_top = (index // max(1, self.browser_columns)) * cell
+        view_top = canvas.canvasy(0)
+        view_bottom = canvas.canvasy(canvas.winfo_height())
+        if row_top < view_top or row_top + cell > view_bottom:
+            canvas.yview_moveto(row_top / (rows * cell))
+            self.render_browser()
+
+    def poll_thumbnails(self):
+        """Collect thumbnails finished by the background pool"""
+        for _ in range(64):
+            try:
+                generation, path, future = self.thumbnail_queue.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self.browser_generation or future.cancelled():
+                continue
+            try:
+                self.browser_thumbs[path] = future.result()
+            except Exception as e:
+                self.browser_thumbs[path] = None
+                print(f"⚠️  Could not create thumbnail for {path}: {e}")
+
+            # Redraw the cell if it is on screen
+            index = self.folder_positions.get(path)
+            if index in self.browser_items:
+                self.remove_browser_cell(index)
+                self.render_browser()
+
+        self.update_browser_label()
+        if any(not f.done() for f in self.browser_futures) or not self.thumbnail_queue.empty():
+            self.root.after(50, self.poll_thumbnails)
+
+    def update_browser_label(self):
+        """Update the folder browser status label"""
+        if not self.folder_files:
+            self.browser_label.configure(text="No folder open")
+            return
+        pending = sum(1 for f in self.browser_futures if not f.done())
+        text = f"{len(self.folder_files)} images"
+        if pending:
+            text += f" | {pending} thumbnails pending"
+        self.browser_label.configure(text=text)
+
+    def clear_browser(self):
+        """Remove all thumbnail cells from the browser canvas"""
+        self.browser_canvas.delete("all")
+        self.browser_items = {}
+
+    def remove_browser_cell(self, index):
+        """Remove a single thumbnail cell from the browser canvas"""
+        item_ids, _ = self.browser_items.pop(index)
+        for item_id in item_ids:
+            self.browser_canvas.delete(item_id)
+
+    def render_browser(self):
+        """Draw the thumbnail cells currently scrolled into view"""
+        canvas = self.browser_canvas
+        cell = THUMBNAIL_SIZE[0] + 8
+        columns = max(1, canvas.winfo_width() // cell)
+
+        # Column count changed with the panel width, lay out from scratch
+        if columns != self.browser_columns:
+            self.browser_columns = columns
+            self.clear_browser()
+
+        count = len(self.folder_files)
+        rows = (count + columns - 1) // columns
+        canvas.configure(scrollregion=(0, 0, columns * cell, rows * cell))
+
+        first_row = int(canvas.canvasy(0)) // cell
+        last_row = int(canvas.canvasy(canvas.winfo_height())) // cell
+        visible = range(first_row * columns, min(count, (last_row + 1) * columns))
+
+        # Only keep PhotoImages for visible cells so large folders stay cheap
+        for index in list(self.browser_items):
+            if index not in visible:
+                self.remove_browser_cell(index)
+
+        for index in visible:
+            if index in self.browser_items:
+                continue
+            x = (index % columns) * cell + cell // 2
+            y = (index // columns) * cell + cell // 2
+            path = self.folder_files[index]
+            data = self.browser_thumbs.get(path)
+
+            if data:
+                photo = ImageTk.PhotoImage(Image.open(io.BytesIO(data)))
+                item_ids = [canvas.create_image(x, y, anchor="center", image=photo)]
+            else:
+                photo = None
+                half = THUMBNAIL_SIZE[0] // 2
+                item_ids = [
+                    canvas.create_rectangle(x - half, y - half, x + half, y + half, outline="#555555"),
+                    # "?" marks files that failed to decode, "…" ones still rendering
+                    canvas.create_text(x, y, text="?" if path in self.browser_thumbs else "…", fill="#888888")
+                ]
+            self.browser_items[index] = (item_ids, photo)
+
+        self.highlight_browser_selection()
+
+    def highlight_browser_selection(self):
+        """Outline the browser cell of the image being edited"""
+        canvas = self.browser_canvas
+        canvas.delete("selected")
+        index = self.folder_positions.get(self.current_path)
+        if index is None or not self.browser_columns:
+            return
+        cell = THUMBNAIL_SIZE[0] + 8
+        x = (index % self.browser_columns) * cell
+        y = (index // self.browser_columns) * cell
+        canvas.create_rectangle(x + 2, y + 2, x + cell - 2, y + cell - 2,
+                                outline="#1f6aa5", width=3, tags="selected")
+
+    def on_browser_scroll(self, *args):
+        """Scroll the browser strip and draw newly exposed thumbnails"""
+        self.browser_canvas.yview(*args)
+        self.render_browser()
+
+    def on_browser_wheel(self, event):
+        """Handle mouse wheel scrolling in the browser strip"""
+        if event.delta > 0 or event.num == 4:
+            self.browser_canvas.yview_scroll(-1, "units")
+        else:
+            self.browser_canvas.yview_scroll(1, "units")
+        self.render_browser()
+        # Keep the enclosing scrollable panel from scrolling as well
+        return "break"
+
+    def on_browser_click(self, event):
+        """Open the image under the cursor in the browser strip"""
+        if self.processing or not self.folder_files:
+            return
+        cell = THUMBNAIL_SIZE[0] + 8
+        column = int(self.browser_canvas.canvasx(event.x)) // cell
+        row = int(self.browser_canvas.canvasy(event.y)) // cell
+        index = row * self.browser_columns + column
+        if column < self.browser_columns and 0 <= index < len(self.folder_files):
+            try:
+                self.load_image_path(self.folder_files[index])
+            except Exception as e:
+                messagebox.showerror("Error", f"Could not open image: {str(e)}")
+                print(f"❌ Error opening image: {e}")
+
     def save_image(self):
         """Save the current image"""
         if not self.current_image:
@@ -481,12 +4006,7 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
             )
             
             if file_path:
-                # Save with optimization
-                save_kwargs = {"optimize": True}
-                if file_path.lower().endswith(('.jpg', '.jpeg')):
-                    save_kwargs["quality"] = 95
-                    
-                self.current_image.save(file_path, **save_kwargs)
+                encode_image(self.current_image, file_path)
                 print(f"✅ Image saved: {file_path}")
                 messagebox.showinfo("Success", f"Image saved successfully to {file_path}")
                 
@@ -506,7 +4026,7 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         # Create export dialog
         export_window = ctk.CTkToplevel(self.root)
         export_window.title("Export Settings")
-        export_window.geometry("400x300")
+        export_window.geometry("400x500")
         export_window.transient(self.root)
         export_window.grab_set()
         
@@ -524,7 +4044,7 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         quality_frame = ctk.CTkFrame(export_window)
         quality_frame.pack(fill="x", padx=20, pady=10)
         
-        ctk.CTkLabel(quality_frame, text="Quality (JPEG only):", font=ctk.CTkFont(size=14, weight="bold")).pack(anchor="w")
+        ctk.CTkLabel(quality_frame, text="Quality (JPEG/WebP):", font=ctk.CTkFont(size=14, weight="bold")).pack(anchor="w")
         quality_var = ctk.IntVar(value=95)
         quality_slider = ctk.CTkSlider(quality_frame, from_=10, to=100, variable=quality_var)
         quality_slider.pack(fill="x", pady=5)
@@ -536,6 +4056,24 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         
         quality_slider.configure(command=update_quality_label)
         
+        # Encoder profile
+        profile_frame = ctk.CTkFrame(export_window)
+        profile_frame.pack(fill="x", padx=20, pady=10)
+        
+        ctk.CTkLabel(profile_frame, text="Encoder:", font=ctk.CTkFont(size=14, weight="bold")).pack(anchor="w")
+        profile_var = ctk.StringVar(value="balanced")
+        ctk.CTkOptionMenu(profile_frame, variable=profile_var,
+                          values=["fast", "balanced", "small"]).pack(fill="x", pady=5)
+        
+        # Target file size
+        target_frame = ctk.CTkFrame(export_window)
+        target_frame.pack(fill="x", padx=20, pady=10)
+        
+        ctk.CTkLabel(target_frame, text="Target size in KB (JPEG/WebP, optional):",
+                     font=ctk.CTkFont(size=14, weight="bold")).pack(anchor="w")
+        target_entry = ctk.CTkEntry(target_frame, placeholder_text="e.g. 200")
+        target_entry.pack(fill="x", pady=5)
+        
         # Buttons
         button_frame = ctk.CTkFrame(export_window)
         button_frame.pack(fill="x", padx=20, pady=20)
@@ -548,11 +4086,29 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
                 )
                 
                 if file_path:
-                    save_kwargs = {"optimize": True}
-                    if format_var.get() == "JPEG":
+                    target_text = target_entry.get().strip()
+                    if target_text:
+                        target_bytes = int(target_text) * 1024
+                        data, quality = encode_to_target_size(self.current_image, target_bytes,
+                                                              format_var.get(), profile_var.get())
+                        with open(file_path, "wb") as f:
+                            f.write(data)
+                        print(f"✅ Image exported: {file_path} ({len(data) // 1024}KB at quality {quality})")
+                        if len(data) > target_bytes:
+                            messagebox.showwarning("Warning", f"Could not reach {target_text}KB; "
+                                                   f"exported {len(data) // 1024}KB at quality {quality}")
+                        else:
+                            messagebox.showinfo("Success", f"Image exported at quality {quality} "
+                                                f"({len(data) // 1024}KB)")
+                        export_window.destroy()
+                        return
+                    
+                    save_kwargs = {}
+                    if format_var.get() in ("JPEG", "WebP"):
                         save_kwargs["quality"] = quality_var.get()
                     
-                    self.current_image.save(file_path, format=format_var.get(), **save_kwargs)
+                    encode_image(self.current_image, file_path, format=format_var.get(),
+                                 profile=profile_var.get(), **save_kwargs)
                     print(f"✅ Image exported: {file_path}")
                     messagebox.showinfo("Success", f"Image exported successfully!")
                     export_window.destroy()
@@ -563,6 +4119,50 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         ctk.CTkButton(button_frame, text="Export", command=do_export).pack(side="left", padx=5)
         ctk.CTkButton(button_frame, text="Cancel", command=export_window.destroy).pack(side="right", padx=5)
     
+    def ask_widths(self, title):
+        """Ask for a list of output widths, returning None if cancelled"""
+        default = " ".join(str(width) for width in DEFAULT_LADDER_WIDTHS)
+        dialog = ctk.CTkInputDialog(text=f"Output widths in pixels (default {default}):", title=title)
+        text = dialog.get_input()
+        if text is None:
+            return None
+        try:
+            widths = [int(width) for width in text.replace(",", " ").split()] or list(DEFAULT_LADDER_WIDTHS)
+        except ValueError:
+            messagebox.showerror("Error", "Please enter widths as whole numbers")
+            return None
+        if min(widths) <= 0:
+            messagebox.showerror("Error", "Widths must be positive")
+            return None
+        return widths
+
+    def export_sizes(self):
+        """Export the current image at several widths with a JSON manifest"""
+        if not self.current_image:
+            messagebox.showwarning("Warning", "No image to export")
+            return
+            
+        widths = self.ask_widths("Export Sizes")
+        if not widths:
+            return
+            
+        try:
+            file_path = filedialog.asksaveasfilename(
+                title="Base name for the exported sizes",
+                defaultextension=".jpg",
+                filetypes=[("JPEG files", "*.jpg"), ("WebP files", "*.webp"), ("PNG files", "*.png")]
+            )
+            if not file_path:
+                return
+                
+            manifest_path, entries = export_variants(self.current_image, file_path, widths)
+            print(f"✅ Exported {len(entries)} sizes: {manifest_path}")
+            messagebox.showinfo("Success", f"Exported {len(entries)} sizes.\nManifest: {manifest_path}")
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Export failed: {str(e)}")
+            print(f"❌ Error exporting sizes: {e}")
+    
     def display_image(self):
         """Display current image on canvas"""
         if not self.current_image:
@@ -583,20 +4183,27 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
             
             # Resize image for display
             if display_width > 0 and display_height > 0:
-                self.displayed_image = self.current_image.resize(
-                    (display_width, display_height), 
-                    Image.Resampling.LANCZOS
-                )
-                self.tk_image = ImageTk.PhotoImage(self.displayed_image)
+                with track_operation("display", image_nbytes(self.current_image)):
+                    self.displayed_image = self.current_image.resize(
+                        (display_width, display_height), 
+                        Image.Resampling.LANCZOS
+                    )
+                    self.tk_image = ImageTk.PhotoImage(self.displayed_image)
                 
-                # Clear canvas and display image
-                self.canvas.delete("all")
-                self.canvas.create_image(
-                    display_width // 2, 
-                    display_height // 2, 
-                    anchor="center", 
-                    image=self.tk_image
-                )
+                # Swap the picture in place; the crop overlay items stay put
+                if self.image_item is None:
+                    self.image_item = self.canvas.create_image(
+                        display_width // 2, 
+                        display_height // 2, 
+                        anchor="center", 
+                        image=self.tk_image
+                    )
+                else:
+                    self.canvas.coords(self.image_item, display_width // 2, display_height // 2)
+                    self.canvas.itemconfigure(self.image_item, image=self.tk_image)
+                self.draw_crop_overlay()
+                self.draw_corner_markers()
+                self.update_histogram()
                 
                 # Update scroll region
                 self.canvas.configure(scrollregion=(0, 0, display_width, display_height))
@@ -608,6 +4215,88 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         except Exception as e:
             print(f"❌ Error displaying image: {e}")
     
+    # Histogram functions
+    def statistics_key(self):
+        """Return the cache key of the current image's statistics"""
+        return self.history.state, id(self.current_image), self.current_image.size
+    
+    def statistics_preview(self):
+        """Return a small copy of the current image for a quick histogram"""
+        image = self.current_image
+        if self.displayed_image is not None and \
+                self.displayed_image.width * self.displayed_image.height < image.width * image.height:
+            image = self.displayed_image
+        factor = math.ceil(math.sqrt(image.width * image.height / STATS_PREVIEW_PIXELS))
+        return image.reduce(factor) if factor > 1 else image
+    
+    def update_histogram(self):
+        """Show the current image's statistics, from the cache or a quick preview"""
+        if not self.current_image:
+            return
+        stats = self.stats_cache.get(self.statistics_key())
+        if stats is not None:
+            self.stats_cache.move_to_end(self.statistics_key())
+            self.draw_histogram(stats, preview=False)
+            return
+            
+        self.draw_histogram(image_statistics(self.statistics_preview()), preview=True)
+        # Refresh at full resolution once the image stops changing
+        if self.stats_job is not None:
+            self.root.after_cancel(self.stats_job)
+        self.stats_job = self.root.after(STATS_DELAY_MS, self.refresh_statistics)
+    
+    def refresh_statistics(self):
+        """Compute full-resolution statistics of the current image in the background"""
+        self.stats_job = None
+        if not self.current_image:
+            return
+            
+        key = self.statistics_key()
+        source = self.current_image
+        # Region edits and undo/redo paste into current_image in place, so the
+        # worker measures a snapshot that still matches key
+        snapshot = source.copy()
+        
+        def done(stats):
+            self.stats_cache[key] = stats
+            while len(self.stats_cache) > HISTORY_LIMIT + 2:
+                self.stats_cache.popitem(last=False)
+            if self.current_image is source and self.statistics_key() == key:
+                self.draw_histogram(stats, preview=False)
+        
+        self.stats_runner.submit("Statistics", lambda task: image_statistics(snapshot), done)
+        if len(self.stats_runner.active) == 1:
+            self.root.after(50, self.poll_statistics)
+    
+    def poll_statistics(self):
+        """Deliver finished statistics to the histogram panel"""
+        if self.stats_runner.poll():
+            self.root.after(50, self.poll_statistics)
+    
+    def draw_histogram(self, stats, preview):
+        """Draw the channel histograms and summary statistics"""
+        width = max(self.histogram_canvas.winfo_width(), 200)
+        height = int(self.histogram_canvas.cget("height"))
+        # Scale to the tallest bin away from the ends, so clipping spikes don't flatten the rest
+        peak = max(int(stats[name].histogram[1:255].max()) for name in stats) or 1
+        xs = np.linspace(0, width - 1, 256)
+        colors = {"R": "#ff5555", "G": "#55dd55", "B": "#5599ff", "L": "#dddddd"}
+        for name, color in colors.items():
+            ys = height - 1 - np.minimum(stats[name].histogram / peak, 1.0) * (height - 2)
+            points = np.column_stack((xs, ys)).ravel().tolist()
+            if name in self.histogram_lines:
+                self.histogram_canvas.coords(self.histogram_lines[name], *points)
+            else:
+                self.histogram_lines[name] = self.histogram_canvas.create_line(*points, fill=color)
+                
+        luma = stats["L"]
+        text = (f"Mean R/G/B: {stats['R'].mean:.0f} / {stats['G'].mean:.0f} / {stats['B'].mean:.0f}\n"
+                f"Luma: mean {luma.mean:.0f}, σ {luma.std:.0f}, range {luma.min}–{luma.max}\n"
+                f"Clipped: {luma.shadows:.1%} shadows, {luma.highlights:.1%} highlights")
+        if preview:
+            text += "\n(preview)"
+        self.stats_label.configure(text=text)
+    
     def update_info_label(self):
         """Update image information label"""
         if self.current_image:
@@ -654,56 +4343,109 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
     
     # Crop functionality
     def start_crop(self, event):
-        """Start crop selection"""
+        """Start a new crop selection, or grab a handle or the body of the current one"""
         if not self.current_image:
             return
             
         self.start_x = self.canvas.canvasx(event.x)
         self.start_y = self.canvas.canvasy(event.y)
+        x = self.start_x / self.zoom_factor
+        y = self.start_y / self.zoom_factor
+        
+        if self.corner_points is not None:
+            self.add_corner_point(x, y)
+            return
         
-        if self.rect:
-            self.canvas.delete(self.rect)
+        mode = None
+        if self.crop_coords:
+            mode = hit_test_crop(self.crop_coords, x, y, HANDLE_SIZE / self.zoom_factor)
+        if mode is None:
+            # Start a fresh selection by dragging its bottom-right corner
+            x = min(max(x, 0), self.current_image.width)
+            y = min(max(y, 0), self.current_image.height)
+            self.crop_coords = (x, y, x, y)
+            mode = "se"
+        self.crop_drag = (mode, self.crop_coords)
+        self.draw_crop_overlay()
     
     def update_crop(self, event):
-        """Update crop selection"""
-        if not self.current_image or not self.start_x:
+        """Queue a crop drag update, redrawing at most once per frame"""
+        if not self.current_image or not self.crop_drag:
             return
             
-        cur_x = self.canvas.canvasx(event.x)
-        cur_y = self.canvas.canvasy(event.y)
-        
-        if self.rect:
-            self.canvas.delete(self.rect)
+        pending = self.crop_motion is not None
+        self.crop_motion = (self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        if not pending:
+            self.root.after(OVERLAY_FRAME_MS, self.flush_crop_motion)
+    
+    def flush_crop_motion(self):
+        """Apply the latest queued drag position to the selection"""
+        if self.crop_motion is None or not self.crop_drag:
+            self.crop_motion = None
+            return
             
-        self.rect = self.canvas.create_rectangle(
-            self.start_x, self.start_y, cur_x, cur_y,
-            outline="red", width=2
-        )
+        cur_x, cur_y = self.crop_motion
+        self.crop_motion = None
+        mode, box = self.crop_drag
+        dx = (cur_x - self.start_x) / self.zoom_factor
+        dy = (cur_y - self.start_y) / self.zoom_factor
+        self.crop_coords = drag_crop_box(box, mode, dx, dy, self.current_image.size)
+        self.draw_crop_overlay()
     
     def end_crop(self, event):
         """End crop selection"""
-        if not self.current_image or not self.start_x:
+        if not self.current_image or not self.crop_drag:
             return
             
-        end_x = self.canvas.canvasx(event.x)
-        end_y = self.canvas.canvasy(event.y)
-        
-        # Calculate crop coordinates
-        img_width, img_height = self.current_image.size
-        display_width = int(img_width * self.zoom_factor)
-        display_height = int(img_height * self.zoom_factor)
-        
-        # Convert canvas coordinates to image coordinates
-        x1 = max(0, min(self.start_x, end_x) / self.zoom_factor)
-        y1 = max(0, min(self.start_y, end_y) / self.zoom_factor)
-        x2 = min(img_width, max(self.start_x, end_x) / self.zoom_factor)
-        y2 = min(img_height, max(self.start_y, end_y) / self.zoom_factor)
+        self.crop_motion = (self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        self.flush_crop_motion()
+        self.crop_drag = None
         
+        x1, y1, x2, y2 = self.crop_coords
         if abs(x2 - x1) > 10 and abs(y2 - y1) > 10:  # Minimum selection size
             self.crop_coords = (int(x1), int(y1), int(x2), int(y2))
+        else:
+            self.crop_coords = None
+        self.draw_crop_overlay()
+    
+    def on_canvas_hover(self, event):
+        """Show a move or resize cursor over the crop selection"""
+        mode = None
+        if self.crop_coords and not self.crop_drag:
+            x = self.canvas.canvasx(event.x) / self.zoom_factor
+            y = self.canvas.canvasy(event.y) / self.zoom_factor
+            mode = hit_test_crop(self.crop_coords, x, y, HANDLE_SIZE / self.zoom_factor)
+        cursor = CROP_CURSORS.get(mode, "")
+        if self.canvas.cget("cursor") != cursor:
+            self.canvas.configure(cursor=cursor)
+    
+    def draw_crop_overlay(self):
+        """Move the persistent crop rectangle and handles to the current selection"""
+        overlay = self.crop_overlay
+        if not overlay:
+            overlay["rect"] = self.canvas.create_rectangle(0, 0, 0, 0, outline="red", width=2,
+                                                           state="hidden", tags="overlay")
+            for name in CROP_CURSORS:
+                if name != "move":
+                    overlay[name] = self.canvas.create_rectangle(0, 0, 0, 0, outline="red", fill="white",
+                                                                 state="hidden", tags="overlay")
+        
+        if not self.crop_coords:
+            self.canvas.itemconfigure("overlay", state="hidden")
+            return
+            
+        box = [value * self.zoom_factor for value in self.crop_coords]
+        self.canvas.coords(overlay["rect"], *box)
+        half = HANDLE_SIZE / 2
+        for name, (hx, hy) in crop_handle_points(box).items():
+            self.canvas.coords(overlay[name], hx - half, hy - half, hx + half, hy + half)
+        self.canvas.itemconfigure("overlay", state="normal")
+        self.canvas.tag_raise("overlay")
         
     def crop_image(self):
         """Crop the image based on selection"""
+        if self.processing:
+            return
         if not self.current_image or not self.crop_coords:
             messagebox.showwarning("Warning", "Please make a selection first")
             return
@@ -714,14 +4456,32 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
             self.display_image()
             self.update_info_label()
             self.crop_coords = None
-            if self.rect:
-                self.canvas.delete(self.rect)
-                self.rect = None
+            self.draw_crop_overlay()
             print("✅ Image cropped successfully")
             
         except Exception as e:
             messagebox.showerror("Error", f"Could not crop image: {str(e)}")
     
+    def auto_trim(self):
+        """Select the content inside uniform margins and crop to it"""
+        if not self.current_image or self.processing:
+            return
+            
+        try:
+            box = find_content_bbox(self.current_image, int(self.trim_tolerance_slider.get()))
+            if box is None:
+                messagebox.showinfo("Info", "The image has no content to trim to")
+                return
+            if box == (0, 0) + self.current_image.size:
+                print("⚠️  No margins found to trim")
+                return
+                
+            self.crop_coords = box
+            self.crop_image()
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not trim image: {str(e)}")
+    
     def apply_template(self, template):
         """Apply a crop template"""
         if template == "Custom":
@@ -735,23 +4495,21 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
             self.height_entry.delete(0, 'end')
             
             if self.current_image:
-                img_w, img_h = self.current_image.size
-                
                 # Calculate dimensions maintaining aspect ratio
-                if img_w / img_h > ratio_w / ratio_h:
-                    # Image is wider, constrain by height
-                    new_h = img_h
-                    new_w = int(img_h * ratio_w / ratio_h)
-                else:
-                    # Image is taller, constrain by width
-                    new_w = img_w
-                    new_h = int(img_w * ratio_h / ratio_w)
+                new_w, new_h = template_size(self.current_image.size, (ratio_w, ratio_h))
                 
                 self.width_entry.insert(0, str(new_w))
                 self.height_entry.insert(0, str(new_h))
                 
-                # Auto-apply template
-                self.apply_custom_dimensions()
+                if self.smart_crop_var.get() or self.face_crop_var.get():
+                    start = time.perf_counter()
+                    place = face_crop_box if self.face_crop_var.get() else smart_crop_box
+                    self.crop_coords = place(self.current_image, (ratio_w, ratio_h))
+                    self.draw_crop_overlay()
+                    print(f"✅ Smart crop suggested in {(time.perf_counter() - start) * 1000:.0f}ms")
+                else:
+                    # Auto-apply template
+                    self.apply_custom_dimensions()
     
     def apply_custom_dimensions(self):
         """Apply custom crop dimensions"""
@@ -771,21 +4529,7 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
                 self.crop_coords = (x1, y1, x2, y2)
                 
                 # Visualize crop area
-                display_width = int(img_w * self.zoom_factor)
-                display_height = int(img_h * self.zoom_factor)
-                
-                canvas_x1 = x1 * self.zoom_factor
-                canvas_y1 = y1 * self.zoom_factor
-                canvas_x2 = x2 * self.zoom_factor
-                canvas_y2 = y2 * self.zoom_factor
-                
-                if self.rect:
-                    self.canvas.delete(self.rect)
-                
-                self.rect = self.canvas.create_rectangle(
-                    canvas_x1, canvas_y1, canvas_x2, canvas_y2,
-                    outline="red", width=2
-                )
+                self.draw_crop_overlay()
                 
         except ValueError:
             messagebox.showerror("Error", "Please enter valid numeric dimensions")
@@ -816,7 +4560,7 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
     
     def quick_rotate(self, angle):
         """Quick rotate by 90 degree increments"""
-        if not self.current_image:
+        if not self.current_image or self.processing:
             return
             
         try:
@@ -835,7 +4579,7 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
     
     def flip_horizontal(self):
         """Flip image horizontally"""
-        if not self.current_image:
+        if not self.current_image or self.processing:
             return
             
         try:
@@ -849,7 +4593,7 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
     
     def flip_vertical(self):
         """Flip image vertically"""
-        if not self.current_image:
+        if not self.current_image or self.processing:
             return
             
         try:
@@ -899,29 +4643,10 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
             sharpness = self.sharpness_slider.get()
             
             # Apply adjustments
-            img = self.original_image.copy()
-            
-            # Brightness
-            if abs(brightness - 1.0) > 0.01:
-                enhancer = ImageEnhance.Brightness(img)
-                img = enhancer.enhance(brightness)
-            
-            # Contrast
-            if abs(contrast - 1.0) > 0.01:
-                enhancer = ImageEnhance.Contrast(img)
-                img = enhancer.enhance(contrast)
-            
-            # Saturation
-            if abs(saturation - 1.0) > 0.01:
-                enhancer = ImageEnhance.Color(img)
-                img = enhancer.enhance(saturation)
-            
-            # Sharpness
-            if abs(sharpness - 1.0) > 0.01:
-                enhancer = ImageEnhance.Sharpness(img)
-                img = enhancer.enhance(sharpness)
+            img = apply_adjustments(self.original_image.copy(), brightness, contrast, saturation, sharpness)
             
             self.current_image = img
+            self.history.mark_changed()
             self.display_image()
             
         except Exception as e:
@@ -936,6 +4661,7 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         
         if self.original_image:
             self.current_image = self.original_image.copy()
+            self.history.mark_changed()
             self.display_image()
         print("✅ Adjustments reset")
     
@@ -949,201 +4675,232 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
     # Filter functions
     def apply_blur(self):
         """Apply blur filter"""
-        if not self.current_image:
-            return
-        try:
-            self.save_to_history()
-            self.current_image = self.current_image.filter(ImageFilter.BLUR)
-            self.display_image()
-            print("✅ Blur filter applied")
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not apply blur: {str(e)}")
+        self.run_filter("Blur", "Blur filter applied")
     
     def apply_sharpen(self):
         """Apply sharpen filter"""
-        if not self.current_image:
-            return
-        try:
-            self.save_to_history()
-            self.current_image = self.current_image.filter(ImageFilter.SHARPEN)
-            self.display_image()
-            print("✅ Sharpen filter applied")
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not apply sharpen: {str(e)}")
+        self.run_filter("Sharpen", "Sharpen filter applied")
     
     def apply_edge_enhance(self):
         """Apply edge enhance filter"""
-        if not self.current_image:
-            return
-        try:
-            self.save_to_history()
-            self.current_image = self.current_image.filter(ImageFilter.EDGE_ENHANCE)
-            self.display_image()
-            print("✅ Edge enhance filter applied")
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not apply edge enhance: {str(e)}")
+        self.run_filter("Edge Enhance", "Edge enhance filter applied")
     
     def apply_emboss(self):
         """Apply emboss filter"""
-        if not self.current_image:
-            return
-        try:
-            self.save_to_history()
-            self.current_image = self.current_image.filter(ImageFilter.EMBOSS)
-            self.display_image()
-            print("✅ Emboss filter applied")
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not apply emboss: {str(e)}")
+        self.run_filter("Emboss", "Emboss filter applied")
     
     def apply_smooth(self):
         """Apply smooth filter"""
-        if not self.current_image:
-            return
-        try:
-            self.save_to_history()
-            self.current_image = self.current_image.filter(ImageFilter.SMOOTH)
-            self.display_image()
-            print("✅ Smooth filter applied")
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not apply smooth: {str(e)}")
+        self.run_filter("Smooth", "Smooth filter applied")
     
     def apply_find_edges(self):
         """Apply find edges filter"""
-        if not self.current_image:
-            return
-        try:
-            self.save_to_history()
-            self.current_image = self.current_image.filter(ImageFilter.FIND_EDGES)
-            self.display_image()
-            print("✅ Find edges filter applied")
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not apply find edges: {str(e)}")
+        self.run_filter("Find Edges", "Find edges filter applied")
     
     # Advanced processing functions
     def auto_enhance(self):
         """Apply automatic enhancement using CLAHE"""
-        if not self.current_image:
-            return
-            
-        try:
-            self.save_to_history()
-            
-            # Convert PIL to OpenCV
-            cv_image = cv2.cvtColor(np.array(self.current_image), cv2.COLOR_RGB2BGR)
-            
-            # Convert to LAB color space
-            lab = cv2.cvtColor(cv_image, cv2.COLOR_BGR2LAB)
-            l, a, b = cv2.split(lab)
-            
-            # Apply CLAHE to L channel
-            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-            l_enhanced = clahe.apply(l)
-            
-            # Merge channels
-            enhanced_lab = cv2.merge([l_enhanced, a, b])
-            enhanced_bgr = cv2.cvtColor(enhanced_lab, cv2.COLOR_LAB2BGR)
-            enhanced_rgb = cv2.cvtColor(enhanced_bgr, cv2.COLOR_BGR2RGB)
-            
-            # Convert back to PIL
-            self.current_image = Image.fromarray(enhanced_rgb)
-            self.display_image()
-            print("✅ Auto enhancement applied")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not apply auto enhancement: {str(e)}")
+        # CLAHE on the lightness channel, in a worker process for large images
+        self.run_edit("Auto enhancement", auto_enhance_image,
+                      "Auto enhancement applied")
     
     def noise_reduction(self):
         """Apply noise reduction using Non-local Means Denoising"""
-        if not self.current_image:
-            return
-            
-        try:
-            self.save_to_history()
-            
-            # Convert PIL to OpenCV
-            cv_image = cv2.cvtColor(np.array(self.current_image), cv2.COLOR_RGB2BGR)
-            
-            # Apply denoising
-            denoised = cv2.fastNlMeansDenoisingColored(cv_image, None, 10, 10, 7, 21)
-            denoised_rgb = cv2.cvtColor(denoised, cv2.COLOR_BGR2RGB)
-            
-            # Convert back to PIL
-            self.current_image = Image.fromarray(denoised_rgb)
-            self.display_image()
-            print("✅ Noise reduction applied")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not apply noise reduction: {str(e)}")
+        # Non-local means, split into bands across worker processes for large images
+        self.run_edit("Noise reduction", lambda image: apply_array_op("denoise", image),
+                      "Noise reduction applied", SHARED_OPS["denoise"][1])
     
     def histogram_equalization(self):
         """Apply histogram equalization"""
-        if not self.current_image:
-            return
-            
-        try:
-            self.save_to_history()
-            
-            # Convert PIL to OpenCV
-            cv_image = cv2.cvtColor(np.array(self.current_image), cv2.COLOR_RGB2BGR)
-            
-            # Convert to YUV
-            yuv = cv2.cvtColor(cv_image, cv2.COLOR_BGR2YUV)
-            yuv[:,:,0] = cv2.equalizeHist(yuv[:,:,0])
-            
-            # Convert back to BGR then RGB
-            equalized_bgr = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR)
-            equalized_rgb = cv2.cvtColor(equalized_bgr, cv2.COLOR_BGR2RGB)
-            
-            # Convert back to PIL
-            self.current_image = Image.fromarray(equalized_rgb)
-            self.display_image()
-            print("✅ Histogram equalization applied")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not apply histogram equalization: {str(e)}")
+        self.run_edit("Histogram equalization",
+                      lambda image: Image.fromarray(equalize_array(np.asarray(image.convert("RGB")))),
+                      "Histogram equalization applied")
     
     def color_balance(self):
         """Apply automatic color balance using gray world assumption"""
-        if not self.current_image:
+        self.run_edit("Color balance",
+                      lambda image: Image.fromarray(color_balance_array(np.asarray(image.convert("RGB")))),
+                      "Color balance applied")
+    
+    def deskew(self):
+        """Level a skewed scan using its projection profile"""
+        self.run_edit("Deskew", lambda image: deskew_image(image), "Deskew applied", selection=False)
+    
+    def auto_perspective(self):
+        """Detect the document outline and flatten it"""
+        if not self.current_image or self.processing:
             return
             
         try:
-            self.save_to_history()
-            
-            # Convert PIL to numpy array
-            img_array = np.array(self.current_image).astype(np.float32)
-            
-            # Calculate mean for each channel
-            mean_r = np.mean(img_array[:,:,0])
-            mean_g = np.mean(img_array[:,:,1])
-            mean_b = np.mean(img_array[:,:,2])
-            
-            # Calculate gray world average
-            gray_world = (mean_r + mean_g + mean_b) / 3
-            
-            # Calculate correction factors
-            scale_r = gray_world / mean_r if mean_r > 0 else 1
-            scale_g = gray_world / mean_g if mean_g > 0 else 1
-            scale_b = gray_world / mean_b if mean_b > 0 else 1
+            quad = detect_document_quad(self.current_image)
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not detect document: {str(e)}")
+            return
+        if quad is None:
+            messagebox.showinfo("Perspective Correction",
+                                "No document outline found. Use Pick Corners to mark it by hand.")
+            return
+        self.run_edit("Perspective correction", lambda image: warp_perspective_tiled(image, quad),
+                      "Perspective corrected", selection=False)
+    
+    def pick_corners(self):
+        """Start marking the four corners of a quad to flatten"""
+        if not self.current_image or self.processing:
+            return
+        self.corner_points = []
+        self.crop_coords = None
+        self.draw_crop_overlay()
+        self.draw_corner_markers()
+        messagebox.showinfo("Perspective Correction",
+                            "Click the four corners of the area to straighten, in any order.")
+    
+    def add_corner_point(self, x, y):
+        """Record one picked corner and warp once all four are placed"""
+        x = min(max(x, 0), self.current_image.width - 1)
+        y = min(max(y, 0), self.current_image.height - 1)
+        self.corner_points.append((x, y))
+        self.draw_corner_markers()
+        if len(self.corner_points) < 4:
+            return
             
-            # Apply corrections
-            img_array[:,:,0] *= scale_r
-            img_array[:,:,1] *= scale_g
-            img_array[:,:,2] *= scale_b
+        quad = self.corner_points
+        self.corner_points = None
+        self.draw_corner_markers()
+        self.run_edit("Perspective correction", lambda image: warp_perspective_tiled(image, quad),
+                      "Perspective corrected", selection=False)
+    
+    def draw_corner_markers(self):
+        """Redraw the picked perspective corners at the current zoom"""
+        self.canvas.delete("corners")
+        for x, y in self.corner_points or ():
+            cx, cy = x * self.zoom_factor, y * self.zoom_factor
+            self.canvas.create_oval(cx - 5, cy - 5, cx + 5, cy + 5, outline="yellow", width=2, tags="corners")
+    
+    # Background task functions
+    def run_filter(self, name, message):
+        """Apply one of the PIL_FILTERS in the background"""
+        self.run_edit(name, lambda image: apply_pil_filter(image, name), message, FILTER_HALO,
+                      band_rows=EDIT_BAND_ROWS)
+    
+    def run_edit(self, name, edit, message, halo=0, selection=True, band_rows=None):
+        """Run edit(image) on the task pool and commit its result when it finishes
+
+        Only one edit runs at a time. The result is discarded if the edit is
+        cancelled or the image was replaced while it ran. In "Selection only"
+        mode just the selected box (plus halo pixels of context) is processed
+        and pasted back, and history keeps only that box; edits that change
+        the image size pass selection=False to always use the whole image.
+        With band_rows the edit runs in bands of that many rows (each with
+        its halo) that report progress and stop early when cancelled.
+        """
+        if not self.current_image or self.processing:
+            return
             
-            # Clip values and convert back
-            img_array = np.clip(img_array, 0, 255).astype(np.uint8)
-            self.current_image = Image.fromarray(img_array)
+        source = self.current_image
+        box = None
+        if selection and self.selection_only_var.get() and self.crop_coords:
+            box = tuple(int(value) for value in self.crop_coords)
+            run = lambda: process_region(source, box, edit, halo, band_rows)
+        elif band_rows:
+            run = lambda: process_region(source, (0, 0) + source.size, edit, halo, band_rows)
+        else:
+            run = lambda: edit(source)
+        
+        def work(task):
+            with track_operation(f"edit:{name}", image_nbytes(source)):
+                return run()
+        self.processing = True
+        
+        def done(result):
+            self.processing = False
+            if task.cancelled or self.current_image is not source:
+                print(f"⚠️  {name} discarded")
+                return
+            if box:
+                self.history.record_region(self.current_image, box)
+                self.current_image.paste(result, box[:2])
+            else:
+                self.save_to_history()
+                self.current_image = result
             self.display_image()
-            print("✅ Color balance applied")
+            self.update_info_label()
+            print(f"✅ {message}")
+        
+        def failed(error):
+            self.processing = False
+            if isinstance(error, CancelledError):
+                print(f"⚠️  {name} cancelled")
+                return
+            messagebox.showerror("Error", f"Could not apply {name.lower()}: {str(error)}")
+        
+        task = self.start_task(name, work, done, failed)
+    
+    def run_batch_task(self, title, output_folder, *args, batch=run_batch, **kwargs):
+        """Run a batch job on the task pool with progress and cancel support"""
+        if self.batch_task is not None:
+            messagebox.showwarning("Warning", "A batch job is already running")
+            return
             
-        except Exception as e:
-            messagebox.showerror("Error", f"Could not apply color balance: {str(e)}")
+        def work(task):
+            def progress(result):
+                done = result.processed + result.skipped + len(result.failed)
+                task.report(None, f"{done} images")
+            return batch(*args, on_progress=progress, cancel_event=task.cancel_event, **kwargs)
+        
+        def done(result):
+            self.batch_task = None
+            if not (result.processed or result.skipped or result.failed or result.cancelled):
+                messagebox.showinfo("Info", "No image files found in selected folder")
+                return
+            self.show_batch_result(title, output_folder, result)
+        
+        def failed(error):
+            self.batch_task = None
+            if isinstance(error, CancelledError):
+                print(f"⚠️  {title} cancelled")
+                return
+            messagebox.showerror("Error", f"{title} failed: {str(error)}")
+        
+        self.batch_task = self.start_task(title, work, done, failed)
+    
+    def start_task(self, name, work, on_done, on_error):
+        """Submit background work and start polling for its result"""
+        task = self.task_runner.submit(name, work, on_done, on_error)
+        self.task_cancel_button.configure(state="normal")
+        if len(self.task_runner.active) == 1:
+            self.root.after(50, self.poll_tasks)
+        return task
+    
+    def poll_tasks(self):
+        """Deliver finished background tasks and refresh the progress display"""
+        pending = self.task_runner.poll()
+        if pending:
+            task = self.task_runner.active[-1]
+            text = f"{task.name}: {task.message}" if task.message else f"{task.name}..."
+            self.task_label.configure(text=text)
+            if task.progress is None:
+                # Unknown total: bounce the bar to show the task is alive
+                self.task_progress.set((time.monotonic() % 2.0) / 2.0)
+            else:
+                self.task_progress.set(task.progress)
+            self.root.after(50, self.poll_tasks)
+        else:
+            self.task_label.configure(text="Idle")
+            self.task_progress.set(0)
+            self.task_cancel_button.configure(state="disabled")
+    
+    def cancel_tasks(self):
+        """Cancel all running background tasks"""
+        self.task_runner.cancel_all()
+        self.task_label.configure(text="Cancelling...")
+        print("🛑 Cancelling background tasks")
     
     # Batch processing functions
     def batch_crop(self):
         """Batch crop multiple images"""
-        if not self.crop_coords:
+        template = self.template_var.get()
+        smart = (self.smart_crop_var.get() or self.face_crop_var.get()) and template in CROP_TEMPLATES
+        if not self.crop_coords and not smart:
             messagebox.showwarning("Warning", "Please set crop area first")
             return
             
@@ -1156,37 +4913,22 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
             if not output_folder:
                 return
             
-            # Get image files
-            image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
-            image_files = [f for f in os.listdir(input_folder) 
-                          if f.lower().endswith(image_extensions)]
-            
-            if not image_files:
-                messagebox.showinfo("Info", "No image files found in selected folder")
-                return
-            
             # Process images
-            processed = 0
-            for filename in image_files:
-                try:
-                    input_path = os.path.join(input_folder, filename)
-                    output_path = os.path.join(output_folder, f"cropped_{filename}")
-                    
-                    # Load and crop image
-                    img = Image.open(input_path)
-                    if img.mode in ('RGBA', 'LA', 'P'):
-                        img = img.convert('RGB')
-                    
-                    cropped = img.crop(self.crop_coords)
-                    cropped.save(output_path, optimize=True, quality=95)
-                    processed += 1
-                    
-                except Exception as e:
-                    print(f"Error processing {filename}: {e}")
-                    continue
-            
-            messagebox.showinfo("Success", f"Batch crop completed! Processed {processed} images.")
-            print(f"✅ Batch crop completed: {processed} images processed")
+            if smart:
+                # Each image gets its own template crop around its salient content
+                ratio = CROP_TEMPLATES[template]
+                faces = self.face_crop_var.get()
+                crop = make_template_crop_transform(ratio, faces=faces)
+                settings = {"operation": "crop", "template": list(ratio), "smart": True, "faces": faces}
+            else:
+                crop_coords = tuple(self.crop_coords)
+                crop = lambda img, job: img.crop(crop_coords)
+                settings = {"operation": "crop", "box": list(crop_coords)}
+            self.run_batch_task("Batch crop", output_folder,
+                                input_folder, output_folder, crop,
+                                settings, "cropped_", resume=self.ask_resume(output_folder),
+                                recursive=self.batch_recursive_var.get(),
+                                dedup="exact" if self.batch_dedup_var.get() else None)
             
         except Exception as e:
             messagebox.showerror("Error", f"Batch crop failed: {str(e)}")
@@ -1235,34 +4977,14 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
                     if not output_folder:
                         return
                     
-                    # Get image files
-                    image_extensions = ('.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.webp')
-                    image_files = [f for f in os.listdir(input_folder) 
-                                  if f.lower().endswith(image_extensions)]
-                    
-                    processed = 0
-                    for filename in image_files:
-                        try:
-                            input_path = os.path.join(input_folder, filename)
-                            output_path = os.path.join(output_folder, f"resized_{filename}")
-                            
-                            img = Image.open(input_path)
-                            if img.mode in ('RGBA', 'LA', 'P'):
-                                img = img.convert('RGB')
-                            
-                            if maintain_ratio.get():
-                                img.thumbnail((new_width, new_height), Image.Resampling.LANCZOS)
-                            else:
-                                img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                            
-                            img.save(output_path, optimize=True, quality=95)
-                            processed += 1
-                            
-                        except Exception as e:
-                            print(f"Error processing {filename}: {e}")
-                            continue
-                    
-                    messagebox.showinfo("Success", f"Batch resize completed! Processed {processed} images.")
+                    resize = make_resize_transform(new_width, new_height, maintain_ratio.get())
+                    settings = {"operation": "resize", "width": new_width, "height": new_height,
+                                "maintain_ratio": maintain_ratio.get()}
+                    self.run_batch_task("Batch resize", output_folder,
+                                        input_folder, output_folder, resize, settings, "resized_",
+                                        resume=self.ask_resume(output_folder),
+                                        recursive=self.batch_recursive_var.get(),
+                                        dedup="exact" if self.batch_dedup_var.get() else None)
                     resize_window.destroy()
                     
                 except ValueError:
@@ -1280,12 +5002,160 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         except Exception as e:
             messagebox.showerror("Error", f"Could not open batch resize: {str(e)}")
     
+    def batch_trim(self):
+        """Batch trim uniform margins from every image in a folder"""
+        try:
+            input_folder = filedialog.askdirectory(title="Select input folder")
+            if not input_folder:
+                return
+                
+            output_folder = filedialog.askdirectory(title="Select output folder")
+            if not output_folder:
+                return
+            
+            tolerance = int(self.trim_tolerance_slider.get())
+            settings = {"operation": "trim", "tolerance": tolerance}
+            self.run_batch_task("Batch trim", output_folder,
+                                input_folder, output_folder, make_trim_transform(tolerance), settings,
+                                "trimmed_", resume=self.ask_resume(output_folder),
+                                recursive=self.batch_recursive_var.get(),
+                                dedup="exact" if self.batch_dedup_var.get() else None)
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Batch trim failed: {str(e)}")
+    
+    def batch_adjust(self):
+        """Batch apply the current brightness, contrast and saturation to a folder of frames"""
+        try:
+            input_folder = filedialog.askdirectory(title="Select input folder")
+            if not input_folder:
+                return
+                
+            output_folder = filedialog.askdirectory(title="Select output folder")
+            if not output_folder:
+                return
+            
+            # Same-sized frames are adjusted together as stacks
+            self.run_batch_task("Batch adjust", output_folder,
+                                input_folder, output_folder, self.brightness_slider.get(),
+                                self.contrast_slider.get(), self.saturation_slider.get(),
+                                recursive=self.batch_recursive_var.get(), batch=run_stack_batch)
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Batch adjust failed: {str(e)}")
+    
+    def process_video(self):
+        """Apply the crop selection and current adjustments to every frame of a video"""
+        try:
+            video_types = " ".join(f"*{ext}" for ext in sorted(VIDEO_CODECS))
+            source = filedialog.askopenfilename(
+                title="Select a video",
+                filetypes=[("Video files", video_types), ("All files", "*.*")]
+            )
+            if not source:
+                return
+                
+            target = filedialog.asksaveasfilename(
+                title="Save processed video",
+                defaultextension=".mp4",
+                filetypes=[("Video files", video_types)]
+            )
+            if not target:
+                return
+            if not is_video(target):
+                messagebox.showwarning("Warning", f"Please save as one of: {', '.join(sorted(VIDEO_CODECS))}")
+                return
+            
+            box = tuple(int(value) for value in self.crop_coords) if self.crop_coords else None
+            transform_fn = make_frame_transform(box, 0, self.brightness_slider.get(), self.contrast_slider.get(),
+                                                 self.saturation_slider.get(), self.sharpness_slider.get())
+            self.run_batch_task("Video processing", os.path.dirname(target),
+                                source, target, transform_fn, batch=run_frames)
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Video processing failed: {str(e)}")
+    
+    def batch_document(self, operation):
+        """Batch deskew or perspective-correct every scan in a folder"""
+        try:
+            input_folder = filedialog.askdirectory(title="Select input folder")
+            if not input_folder:
+                return
+                
+            output_folder = filedialog.askdirectory(title="Select output folder")
+            if not output_folder:
+                return
+            
+            if operation == "deskew":
+                title, transform_fn, prefix = "Batch deskew", make_deskew_transform(), "deskewed_"
+            else:
+                title, transform_fn, prefix = "Batch perspective", make_perspective_transform(), "corrected_"
+            self.run_batch_task(title, output_folder,
+                                input_folder, output_folder, transform_fn, {"operation": operation}, prefix,
+                                resume=self.ask_resume(output_folder),
+                                recursive=self.batch_recursive_var.get(),
+                                dedup="exact" if self.batch_dedup_var.get() else None)
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Batch {operation} failed: {str(e)}")
+    
+    def batch_sizes(self):
+        """Batch export a responsive size ladder of every image in a folder"""
+        widths = self.ask_widths("Batch Sizes")
+        if not widths:
+            return
+            
+        try:
+            input_folder = filedialog.askdirectory(title="Select input folder")
+            if not input_folder:
+                return
+                
+            output_folder = filedialog.askdirectory(title="Select output folder")
+            if not output_folder:
+                return
+            
+            settings = {"operation": "sizes", "widths": sorted(widths)}
+            self.run_batch_task("Batch sizes", output_folder,
+                                input_folder, output_folder, make_ladder_transform(widths), settings, "",
+                                resume=self.ask_resume(output_folder),
+                                recursive=self.batch_recursive_var.get(),
+                                dedup="exact" if self.batch_dedup_var.get() else None)
+            
+        except Exception as e:
+            messagebox.showerror("Error", f"Batch sizes failed: {str(e)}")
+    
+    def ask_resume(self, output_folder):
+        """Ask whether to resume when an output folder holds a previous batch run"""
+        if not os.path.exists(os.path.join(output_folder, MANIFEST_NAME)):
+            return False
+        return messagebox.askyesno(
+            "Resume Batch",
+            "This output folder contains a previous batch run.\n"
+            "Skip images that were already processed with the same settings?"
+        )
+
+    def show_batch_result(self, title, output_folder, result):
+        """Report a finished batch job"""
+        summary = batch_summary(result)
+        manifest_path = os.path.join(output_folder, MANIFEST_NAME)
+        if result.failed and os.path.exists(manifest_path):
+            messagebox.showwarning(title, f"{title} completed! {summary}.\n"
+                                          f"Failures are recorded in {manifest_path}")
+        elif result.failed:
+            failures = "\n".join(f"{os.path.basename(path)}: {error}" for path, error in result.failed[:5])
+            messagebox.showwarning(title, f"{title} completed! {summary}.\n{failures}")
+        else:
+            messagebox.showinfo("Success", f"{title} completed! {summary}.")
+        print(f"✅ {title} completed: {summary} in {result.elapsed:.1f}s, {batch_throughput(result)}")
+
     # History functions
     def undo(self):
         """Undo last operation"""
-        if self.history_index > 0:
-            self.history_index -= 1
-            self.current_image = self.history[self.history_index].copy()
+        if self.processing:
+            return
+        image = self.history.undo(self.current_image)
+        if image is not None:
+            self.current_image = image
             self.display_image()
             self.update_info_label()
             print("✅ Undo successful")
@@ -1294,9 +5164,11 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
     
     def redo(self):
         """Redo last undone operation"""
-        if self.history_index < len(self.history) - 1:
-            self.history_index += 1
-            self.current_image = self.history[self.history_index].copy()
+        if self.processing:
+            return
+        image = self.history.redo(self.current_image)
+        if image is not None:
+            self.current_image = image
             self.display_image()
             self.update_info_label()
             print("✅ Redo successful")
@@ -1341,8 +5213,7 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
             
             self.original_image = image
             self.current_image = image.copy()
-            self.history = [image.copy()]
-            self.history_index = 0
+            self.history.clear()
             
             self.reset_adjustments_silent()
             self.display_image()
@@ -1354,9 +5225,69 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
         except Exception as e:
             print(f"⚠️  Could not load test image: {e}")
     
+    # Performance functions
+    def show_metrics(self):
+        """Show per-operation timings and histograms in a window"""
+        metrics_window = ctk.CTkToplevel(self.root)
+        metrics_window.title("Performance")
+        metrics_window.geometry("820x500")
+        metrics_window.transient(self.root)
+        
+        textbox = ctk.CTkTextbox(metrics_window, font=ctk.CTkFont(family="Courier", size=12), wrap="none")
+        textbox.pack(fill="both", expand=True, padx=10, pady=10)
+        
+        def refresh():
+            textbox.configure(state="normal")
+            textbox.delete("1.0", "end")
+            textbox.insert("1.0", METRICS.report())
+            textbox.configure(state="disabled")
+        
+        refresh()
+        ctk.CTkButton(metrics_window, text="Refresh", command=refresh).pack(pady=(0, 10))
+    
+    def reset_metrics(self):
+        """Forget the recorded timings and profile"""
+        METRICS.reset()
+        print("✅ Metrics reset")
+    
+    def toggle_profiling(self):
+        """Turn cProfile and memory tracing on or off for every operation"""
+        enabled = self.profiling_var.get()
+        METRICS.set_profiling(enabled)
+        METRICS.set_memory_tracing(enabled)
+        print(f"✅ Profiling {'enabled' if enabled else 'disabled'}")
+    
+    def save_profile(self):
+        """Save the collected cProfile statistics"""
+        file_path = filedialog.asksaveasfilename(
+            title="Save profile",
+            defaultextension=".prof",
+            filetypes=[("Profile files", "*.prof")]
+        )
+        if not file_path:
+            return
+        try:
+            if not METRICS.save_profile(file_path):
+                messagebox.showinfo("Info", "No profile recorded - tick \"Profile operations\" first")
+                return
+            print(f"💾 Profile saved: {file_path}")
+        except Exception as e:
+            messagebox.showerror("Error", f"Could not save profile: {str(e)}")
+    
     def cleanup(self):
         """Clean up resources"""
         try:
+            # Stop background thumbnail work
+            for future in self.browser_futures:
+                future.cancel()
+            self.thumbnail_pool.shutdown(wait=False)
+            self.prefetch_cache.shutdown()
+            if self.thumbnail_cache is not None:
+                self.thumbnail_cache.close()
+            self.task_runner.shutdown()
+            self.stats_runner.shutdown()
+            shutdown_process_pool()
+
             # Force garbage collection
             gc.collect()
             print("🧹 Resources cleaned up")
@@ -1366,6 +5297,10 @@ Built with Python, tkinter, CustomTkinter, OpenCV, and PIL
 
 def main():
     """Main function to run the Enhanced Image Cropper"""
+    # "batch" runs a headless batch job instead of the GUI
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(run_batch_cli(sys.argv[2:]))
+
     try:
         app = EnhancedImageCropper()
         app.run()
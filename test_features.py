@@ -10,33 +10,26 @@ import numpy as np
 from PIL import Image, ImageEnhance, ImageFilter
 import cv2
 from skimage import restoration, exposure
+import contextlib
+import inspect
+import io
+import json
+import pstats
 import tempfile
+import threading
 import time
 
+import benchmark
+import enhanced_main
+
 def test_image_operations():
     """Test basic image operations"""
     print("🧪 Testing Image Operations...")
     
-    # Load test image
-    test_image_path = "/home/desmond/Pictures/Penguins Of Madagascar/Kowalski.png"
-    if not os.path.exists(test_image_path):
-        print("❌ Test image not found!")
-        return False
-    
-    try:
-        # Test image loading
-        img = Image.open(test_image_path)
-        print(f"✅ Image loaded: {img.size} pixels, mode: {img.mode}")
-        
-        # Convert to RGB if necessary
-        if img.mode in ('RGBA', 'LA', 'P'):
-            img = img.convert('RGB')
-            print("✅ Image converted to RGB")
-        
-        return img
-    except Exception as e:
-        print(f"❌ Image loading failed: {e}")
-        return None
+    img = make_test_image()
+    print(f"✅ Image created: {img.size} pixels, mode: {img.mode}")
+    assert img.mode == "RGB" and img.size == (640, 480)
+    return img
 
 def test_crop_operations(img):
     """Test cropping operations"""
@@ -272,48 +265,888 @@ def test_batch_operations(img):
         return False
 
 def test_memory_optimization():
-    """Test memory efficiency"""
-    print("🧪 Testing Memory Optimization...")
-    
+    """Test memory budgets over a scripted editing session on a large image"""
+    # Open, 30 edits, undo and redo all of them, export: on a 12 MP image
+    report = benchmark.memory_session(megapixels=12, edits=30)
+    benchmark.print_memory_report(report)
+    operations = [record["operation"] for record in report["steps"]]
+    assert operations[0] == "open" and operations[-2:] == ["export_png", "export_jpeg"]
+    assert operations.count("undo") == operations.count("redo") == report["history_limit"]
+
+    problems = benchmark.check_memory_budgets(report)
+    assert not problems, "; ".join(problems)
+
+    # A pixel buffer kept alive by a repeated operation is caught by the per-step RSS check
+    if report["steps"][0]["rss_retained"] is not None:
+        leaky = dict(report, steps=[dict(record) for record in report["steps"]])
+        later_brightness = [record for record in leaky["steps"] if record["operation"] == "brightness"][1]
+        later_brightness["rss_retained"] = report["image_bytes"] * 4 // 3
+        assert any("brightness" in problem for problem in benchmark.check_memory_budgets(leaky))
+
+    # Selection-only edits keep just their box in history, not a whole image
+    selection_steps = [i for i, name in enumerate(operations) if name.endswith("_selection")]
+    for i in selection_steps:
+        growth = report["steps"][i]["history_bytes"] - report["steps"][i - 1]["history_bytes"]
+        assert growth <= report["image_bytes"] / 4 + 1
+
+def make_test_image(width=640, height=480):
+    """Create a synthetic RGB test image with gradients and shapes"""
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)
+    rgb = np.empty((height, width, 3), dtype=np.uint8)
+    rgb[:, :, 0] = x[None, :]
+    rgb[:, :, 1] = y[:, None]
+    rgb[:, :, 2] = 128
+    cv2.circle(rgb, (width // 2, height // 2), min(width, height) // 5, (255, 255, 255), -1)
+    return Image.fromarray(rgb)
+
+def test_thumbnail_cache(img):
+    """Test the persistent folder browser thumbnail cache"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_path = os.path.join(temp_dir, "photo.jpg")
+        img.save(image_path, quality=90)
+        stat = os.stat(image_path)
+
+        db_path = os.path.join(temp_dir, "thumbs.db")
+        cache = enhanced_main.ThumbnailCache(db_path)
+        data = cache.generate(image_path, stat.st_mtime, stat.st_size)
+        thumb = Image.open(io.BytesIO(data))
+        assert max(thumb.size) <= max(enhanced_main.THUMBNAIL_SIZE)
+        cache.close()
+
+        # A fresh cache instance must serve the thumbnail without re-decoding
+        cache = enhanced_main.ThumbnailCache(db_path)
+        hits = cache.get_many([(image_path, stat.st_mtime, stat.st_size)])
+        assert hits == {image_path: data}
+
+        # A changed mtime invalidates the entry
+        assert cache.get(image_path, stat.st_mtime + 1, stat.st_size) is None
+        cache.close()
+
+def test_prefetch_cache():
+    """Test read-ahead decoding and memory-budget eviction"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        paths = []
+        for i in range(4):
+            path = os.path.join(temp_dir, f"frame_{i}.png")
+            make_test_image(200, 100).save(path)
+            paths.append(path)
+
+        # Budget fits two decoded 200x100 RGB frames
+        cache = enhanced_main.PrefetchCache(budget=2 * 200 * 100 * 3)
+        cache.prefetch(paths[:2])
+        first = cache.get(paths[0])
+        assert first.size == (200, 100)
+        assert cache.get(paths[1]) is cache.get(paths[1])
+
+        cache.get(paths[2])
+        assert paths[0] not in cache
+        assert cache.nbytes <= cache.budget
+        cache.shutdown()
+
+        # A decode still running when the cache is cleared is not stored
+        started, release = threading.Event(), threading.Event()
+
+        def slow_decode(path):
+            started.set()
+            release.wait()
+            return enhanced_main.decode_image(path)
+
+        blocked = enhanced_main.PrefetchCache(loader=slow_decode)
+        blocked.prefetch(paths[3:])
+        started.wait()
+        blocked.clear()
+        release.set()
+        blocked._pool.shutdown(wait=True)
+        assert paths[3] not in blocked and blocked.nbytes == 0
+
+def test_batch_pipeline():
+    """Test the streaming read/transform/encode batch pipeline"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        jobs = []
+        for i in range(12):
+            input_path = os.path.join(temp_dir, f"in_{i}.png")
+            make_test_image(320, 240).save(input_path)
+            jobs.append(enhanced_main.BatchJob(input_path, os.path.join(temp_dir, f"out_{i}.png")))
+
+        broken_path = os.path.join(temp_dir, "broken.png")
+        with open(broken_path, "wb") as f:
+            f.write(b"not an image")
+        jobs.append(enhanced_main.BatchJob(broken_path, os.path.join(temp_dir, "out_broken.png")))
+
+        resize = enhanced_main.make_resize_transform(100, 100)
+        pipeline = enhanced_main.BatchPipeline(resize, workers=3, queue_size=2)
+        result = pipeline.run(iter(jobs))
+
+        assert result.processed == 12
+        assert [path for path, _ in result.failed] == [broken_path]
+        assert Image.open(jobs[0].output_path).size == (100, 75)
+
+def test_batch_resume():
+    """Test that a resumed batch skips inputs recorded in the manifest"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_folder = os.path.join(temp_dir, "in")
+        output_folder = os.path.join(temp_dir, "out")
+        os.makedirs(input_folder)
+        os.makedirs(output_folder)
+        for i in range(3):
+            make_test_image(160, 120).save(os.path.join(input_folder, f"img_{i}.png"))
+
+        resize = enhanced_main.make_resize_transform(80, 80)
+        settings = {"operation": "resize", "width": 80, "height": 80}
+        first = enhanced_main.run_batch(input_folder, output_folder, resize, settings, "resized_")
+        assert first.processed == 3
+
+        # Changing one input re-processes just that file
+        make_test_image(100, 100).save(os.path.join(input_folder, "img_1.png"))
+        second = enhanced_main.run_batch(input_folder, output_folder, resize, settings, "resized_",
+                                         resume=True)
+        assert (second.processed, second.skipped) == (1, 2)
+
+        # Different settings invalidate every record
+        settings = {"operation": "resize", "width": 40, "height": 40}
+        third = enhanced_main.run_batch(input_folder, output_folder, resize, settings, "resized_",
+                                        resume=True)
+        assert (third.processed, third.skipped) == (3, 0)
+
+def test_batch_incremental():
+    """Test that incremental batches only process new or changed inputs"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_folder = os.path.join(temp_dir, "in")
+        output_folder = os.path.join(temp_dir, "out")
+        os.makedirs(input_folder)
+        os.makedirs(output_folder)
+        for i in range(3):
+            make_test_image(160, 120).save(os.path.join(input_folder, f"img_{i}.png"))
+
+        box = (0, 0, 50, 50)
+        crop = lambda img, job: img.crop(box)
+        settings = {"operation": "crop", "box": list(box)}
+        first = enhanced_main.run_batch(input_folder, output_folder, crop, settings, "cropped_",
+                                        incremental="stat")
+        assert first.processed == 3
+
+        # One new file, one touched but identical file
+        make_test_image(160, 120).save(os.path.join(input_folder, "img_new.png"))
+        touched = os.path.join(input_folder, "img_0.png")
+        os.utime(touched, (time.time() + 60, time.time() + 60))
+
+        second = enhanced_main.run_batch(input_folder, output_folder, crop, settings, "cropped_",
+                                         incremental="stat")
+        assert (second.processed, second.skipped) == (1, 3)
+
+        # The touched file's record was refreshed with its new mtime
+        records = {}
+        with open(os.path.join(output_folder, enhanced_main.MANIFEST_NAME)) as f:
+            for line in f:
+                record = json.loads(line)
+                records[record["input"]] = record
+        assert records[touched]["mtime"] == os.stat(touched).st_mtime
+
+    # Skipping unchanged inputs needs a manifest to compare against
     try:
-        import gc
-        import psutil
-        
-        # Get initial memory usage
-        process = psutil.Process(os.getpid())
-        initial_memory = process.memory_info().rss / 1024 / 1024  # MB
-        
-        # Create and process multiple images
-        test_image_path = "/home/desmond/Pictures/Penguins Of Madagascar/Kowalski.png"
-        for i in range(10):
-            img = Image.open(test_image_path)
-            if img.mode in ('RGBA', 'LA', 'P'):
-                img = img.convert('RGB')
-            
-            # Apply some operations
-            enhanced = ImageEnhance.Brightness(img).enhance(1.1)
-            filtered = enhanced.filter(ImageFilter.BLUR)
-            
-            # Cleanup
-            del img, enhanced, filtered
-        
-        # Force garbage collection
-        gc.collect()
-        
-        final_memory = process.memory_info().rss / 1024 / 1024  # MB
-        memory_increase = final_memory - initial_memory
-        
-        print(f"✅ Memory optimization - increase: {memory_increase:.1f}MB")
-        
-        if memory_increase < 100:  # Less than 100MB increase is acceptable
-            print("✅ Memory usage is optimized")
-        else:
-            print("⚠️  Memory usage could be improved")
-        
-        return True
-    except Exception as e:
-        print(f"⚠️  Memory test failed: {e}")
-        return True  # Non-critical failure
+        enhanced_main.BatchPipeline(crop, skip_unchanged="stat")
+        assert False, "skip_unchanged without a manifest should be rejected"
+    except ValueError:
+        pass
+
+def test_recursive_scan():
+    """Test recursive scanning with glob filters and mirrored output folders"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_folder = os.path.join(temp_dir, "in")
+        for sub in ("", "trip/day1", "trip/raw", "cache"):
+            os.makedirs(os.path.join(input_folder, sub), exist_ok=True)
+        small = make_test_image(64, 48)
+        small.save(os.path.join(input_folder, "a.png"))
+        small.save(os.path.join(input_folder, "trip/day1", "b.jpg"))
+        small.save(os.path.join(input_folder, "trip/day1", "skip_me.jpg"))
+        small.save(os.path.join(input_folder, "trip/raw", "c.png"))
+        small.save(os.path.join(input_folder, "cache", "d.png"))
+        with open(os.path.join(input_folder, "notes.txt"), "w") as f:
+            f.write("not an image")
+
+        found = sorted(rel.replace(os.sep, "/") for _, rel in
+                       enhanced_main.scan_images(input_folder, exclude=["cache", "skip_*"]))
+        assert found == ["a.png", "trip/day1/b.jpg", "trip/raw/c.png"]
+
+        found = sorted(rel.replace(os.sep, "/") for _, rel in
+                       enhanced_main.scan_images(input_folder, include=["trip/*"], exclude=["raw"]))
+        assert found == ["trip/day1/b.jpg", "trip/day1/skip_me.jpg"]
+
+        # Output inside the input tree is never scanned back in
+        output_folder = os.path.join(input_folder, "out")
+        crop = lambda img, job: img.crop((0, 0, 32, 32))
+        result = enhanced_main.run_batch(input_folder, output_folder, crop, {"operation": "crop"},
+                                         "cropped_", recursive=True, exclude=["cache"])
+        assert result.processed == 4
+        assert os.path.exists(os.path.join(output_folder, "trip", "day1", "cropped_b.jpg"))
+        again = enhanced_main.run_batch(input_folder, output_folder, crop, {"operation": "crop"},
+                                        "cropped_", recursive=True, exclude=["cache"])
+        assert again.processed == 4
+
+def test_batch_dedup():
+    """Test that duplicate inputs are processed once and linked to every output"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_folder = os.path.join(temp_dir, "in")
+        os.makedirs(input_folder)
+        image = make_test_image(160, 120)
+        for name in ("a.png", "b.png", "c.png"):
+            image.save(os.path.join(input_folder, name))
+        # Same pixels, different bytes
+        image.save(os.path.join(input_folder, "d.png"), compress_level=1)
+        image.transpose(Image.Transpose.FLIP_LEFT_RIGHT).save(os.path.join(input_folder, "e.png"))
+        # Same proxy hash, different pixels: must never share an output
+        lookalike = np.asarray(image).copy()
+        lookalike[10:14, 10:14] += 3
+        Image.fromarray(lookalike).save(os.path.join(input_folder, "f.png"))
+
+        calls = []
+        def crop(img, job):
+            calls.append(job.input_path)
+            return img.crop((0, 0, 50, 50))
+
+        output_folder = os.path.join(temp_dir, "exact")
+        result = enhanced_main.run_batch(input_folder, output_folder, crop, {"operation": "crop"},
+                                         "cropped_", dedup="exact")
+        assert (result.processed, result.linked, len(result.failed)) == (6, 2, 0)
+        assert len(calls) == 4
+        inodes = {os.stat(os.path.join(output_folder, f"cropped_{name}")).st_ino
+                  for name in ("a.png", "b.png", "c.png")}
+        assert len(inodes) == 1
+
+        calls.clear()
+        output_folder = os.path.join(temp_dir, "perceptual")
+        result = enhanced_main.run_batch(input_folder, output_folder, crop, {"operation": "crop"},
+                                         "cropped_", dedup="perceptual")
+        assert (result.processed, result.linked) == (6, 3)
+        assert len(calls) == 3
+        assert enhanced_main.perceptual_hash(open(os.path.join(input_folder, "f.png"), "rb").read()) == \
+            enhanced_main.perceptual_hash(open(os.path.join(input_folder, "a.png"), "rb").read())
+        assert os.stat(os.path.join(output_folder, "cropped_f.png")).st_ino != \
+            os.stat(os.path.join(output_folder, "cropped_a.png")).st_ino
+        assert "3 duplicates linked" in enhanced_main.batch_summary(result)
+
+def test_encoder_profiles(img):
+    """Test encoder profiles and the parallel PNG writer"""
+    for profile in enhanced_main.ENCODER_PROFILES:
+        for format_name in ("JPEG", "PNG", "WEBP", "TIFF", "BMP"):
+            buffer = io.BytesIO()
+            enhanced_main.encode_image(img, buffer, format=format_name, profile=profile)
+            buffer.seek(0)
+            assert Image.open(buffer).size == img.size
+
+    assert enhanced_main.encoder_options("PNG", "fast") == {"compress_level": 1}
+    assert enhanced_main.encoder_options("JPEG", "fast", quality=80)["quality"] == 80
+    try:
+        enhanced_main.encoder_options("PNG", "turbo")
+        assert False, "unknown profile accepted"
+    except ValueError:
+        pass
+
+    # Large PNGs go through the banded writer and must decode losslessly
+    for mode in ("RGB", "RGBA", "L"):
+        large = make_test_image(2048, 2048).convert(mode)
+        buffer = io.BytesIO()
+        enhanced_main.write_png_parallel(large, buffer, compress_level=1, workers=4)
+        buffer.seek(0)
+        decoded = Image.open(buffer)
+        assert decoded.mode == mode
+        assert np.array_equal(np.asarray(decoded), np.asarray(large))
+
+def test_target_size_export(img):
+    """Test that target-size encoding fits the byte budget"""
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 64, (img.height, img.width, 3), dtype=np.uint8)
+    image = Image.fromarray(np.asarray(img) // 2 + noise)
+    for format_name in ("JPEG", "WEBP"):
+        data, quality = enhanced_main.encode_to_target_size(image, 40 * 1024, format_name)
+        assert len(data) <= 40 * 1024
+        assert 10 <= quality < 95
+        assert Image.open(io.BytesIO(data)).format == format_name
+
+    # A generous budget keeps the maximum quality
+    data, quality = enhanced_main.encode_to_target_size(image, 10 * 1024 * 1024)
+    assert quality == 95
+
+    # WebP also searches method 6, so faster profiles reach at least the "small" profile's quality
+    _, small_quality = enhanced_main.encode_to_target_size(image, 40 * 1024, "WEBP", "small")
+    for profile in ("fast", "balanced"):
+        data, quality = enhanced_main.encode_to_target_size(image, 40 * 1024, "WEBP", profile)
+        assert len(data) <= 40 * 1024 and quality >= small_quality
+
+    # An unreachable budget returns the smallest encode, or raises when strict
+    data, quality = enhanced_main.encode_to_target_size(image, 1024, "WEBP")
+    assert quality == 10 and len(data) > 1024
+    try:
+        enhanced_main.encode_to_target_size(image, 1024, "WEBP", strict=True)
+        assert False, "over-budget encode accepted"
+    except ValueError:
+        pass
+
+    try:
+        enhanced_main.encode_to_target_size(image, 40 * 1024, "PNG")
+        assert False, "lossless format accepted"
+    except ValueError:
+        pass
+
+    # Batch jobs write lossless inputs as JPEG under the budget
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_folder = os.path.join(temp_dir, "in")
+        output_folder = os.path.join(temp_dir, "out")
+        os.makedirs(input_folder)
+        image.save(os.path.join(input_folder, "a.png"))
+        result = enhanced_main.run_batch(input_folder, output_folder, lambda img, job: img,
+                                         {"operation": "copy"}, "web_", target_size=40 * 1024)
+        assert result.processed == 1
+        assert os.path.getsize(os.path.join(output_folder, "web_a.jpg")) <= 40 * 1024
+
+        # Inputs that cannot reach the budget are reported as failures, not written
+        result = enhanced_main.run_batch(input_folder, output_folder, lambda img, job: img,
+                                         {"operation": "copy"}, "tiny_", target_size=1024)
+        assert result.processed == 0 and len(result.failed) == 1
+        assert "over the 1KB target" in result.failed[0][1]
+        assert not os.path.exists(os.path.join(output_folder, "tiny_a.jpg"))
+
+def test_size_ladder_export():
+    """Test multi-size exports from a single decode"""
+    image = make_test_image(1600, 1200)
+    variants = enhanced_main.resize_ladder(image, [320, 640, 1280, 2560])
+    assert [v.size for v in variants.values()] == [(1600, 1200), (1280, 960), (640, 480), (320, 240)]
+    # Widths beyond the source give one full-size variant labelled with its real width
+    assert list(variants) == ["1600w", "1280w", "640w", "320w"]
+    assert list(enhanced_main.resize_ladder(image, [1600, 2560, 3840])) == ["1600w"]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manifest_path, entries = enhanced_main.export_variants(
+            image, os.path.join(temp_dir, "photo.jpg"), [320, 640])
+        assert [entry["width"] for entry in entries] == [320, 640]
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        assert [v["path"] for v in manifest["variants"]] == ["photo-320w.jpg", "photo-640w.jpg"]
+        assert Image.open(os.path.join(temp_dir, "photo-640w.jpg")).size == (640, 480)
+
+        # Batch ladders record every output, including linked duplicates
+        input_folder = os.path.join(temp_dir, "in")
+        output_folder = os.path.join(temp_dir, "out")
+        os.makedirs(input_folder)
+        image.save(os.path.join(input_folder, "a.png"))
+        image.save(os.path.join(input_folder, "b.png"))
+        result = enhanced_main.run_batch(input_folder, output_folder,
+                                         enhanced_main.make_ladder_transform([320, 640]),
+                                         {"operation": "sizes"}, "", dedup="exact")
+        assert (result.processed, result.linked) == (2, 1)
+        with open(os.path.join(output_folder, enhanced_main.VARIANTS_NAME)) as f:
+            variants = json.load(f)
+        assert [v["path"] for v in variants["b.png"]] == ["b-320w.png", "b-640w.png"]
+        assert os.path.exists(os.path.join(output_folder, "b-640w.png"))
+
+        # Resumed and incremental ladders check the variants, not the unwritten output path
+        resumed = enhanced_main.run_batch(input_folder, output_folder,
+                                          enhanced_main.make_ladder_transform([320, 640]),
+                                          {"operation": "sizes"}, "", resume=True)
+        assert (resumed.processed, resumed.skipped) == (0, 2)
+        incremental = enhanced_main.run_batch(input_folder, output_folder,
+                                              enhanced_main.make_ladder_transform([320, 640]),
+                                              {"operation": "sizes"}, "", incremental="stat")
+        assert (incremental.processed, incremental.skipped) == (0, 2)
+        os.remove(os.path.join(output_folder, "a-640w.png"))
+        repaired = enhanced_main.run_batch(input_folder, output_folder,
+                                           enhanced_main.make_ladder_transform([320, 640]),
+                                           {"operation": "sizes"}, "", incremental="stat")
+        assert (repaired.processed, repaired.skipped) == (1, 1)
+        with open(os.path.join(output_folder, enhanced_main.VARIANTS_NAME)) as f:
+            assert sorted(json.load(f)) == ["a.png", "b.png"]
+
+def test_shared_memory_ops():
+    """Test shared-memory buffers and banded worker-process filters"""
+    array = np.asarray(make_test_image(200, 300))
+    with enhanced_main.SharedImageBuffer.from_array(array) as buffer:
+        attached = enhanced_main.SharedImageBuffer.attach(buffer.handle)
+        attached.array[0, 0] = (1, 2, 3)
+        assert tuple(buffer.array[0, 0]) == (1, 2, 3)
+        assert buffer.to_image().size == (200, 300)
+        attached.close()
+
+    # Bands with a halo reproduce the single-process result exactly
+    rng = np.random.default_rng(0)
+    noisy = np.clip(array.astype(np.int16) + rng.integers(-30, 30, array.shape), 0, 255).astype(np.uint8)
+    try:
+        denoised = enhanced_main.run_shared_op("denoise", noisy, workers=4)
+        assert np.array_equal(denoised, enhanced_main.denoise_array(noisy))
+    finally:
+        enhanced_main.shutdown_process_pool()
+
+    # Auto enhance needs the whole frame, so it stays in this process
+    assert "auto_enhance" not in enhanced_main.SHARED_OPS
+    enhanced = enhanced_main.auto_enhance_image(Image.fromarray(noisy))
+    assert np.array_equal(np.asarray(enhanced), enhanced_main.auto_enhance_array(noisy))
+
+def test_task_runner():
+    """Test background tasks deliver results on the polling thread"""
+    runner = enhanced_main.TaskRunner()
+    delivered = []
+    poll_thread = threading.current_thread()
+
+    def work(task):
+        task.report(0.5, "halfway")
+        return enhanced_main.apply_pil_filter(make_test_image(64, 48), "Blur")
+
+    def fail(task):
+        raise RuntimeError("boom")
+
+    def slow(task):
+        while not task.cancelled:
+            time.sleep(0.01)
+        return "stopped"
+
+    runner.submit("blur", work, on_done=lambda r: delivered.append((threading.current_thread(), r.size)))
+    runner.submit("fail", fail, on_error=lambda e: delivered.append(str(e)))
+    slow_task = runner.submit("slow", slow, on_done=delivered.append)
+    slow_task.cancel()
+
+    deadline = time.time() + 5
+    while runner.poll() and time.time() < deadline:
+        time.sleep(0.01)
+    runner.shutdown()
+
+    assert (poll_thread, (64, 48)) in delivered
+    assert "boom" in delivered and "stopped" in delivered
+    assert not runner.active
+
+    # Filter edits run in bands that report progress and stop once cancelled
+    image = make_test_image(320, 240)
+    blur = lambda patch: enhanced_main.apply_pil_filter(patch, "Blur")
+    whole = (0, 0) + image.size
+    runner = enhanced_main.TaskRunner()
+    banded = runner.submit("bands", lambda task: enhanced_main.process_region(
+        image, whole, blur, enhanced_main.FILTER_HALO, band_rows=50))
+    assert np.array_equal(np.asarray(banded.future.result()), np.asarray(blur(image)))
+    assert banded.progress == 1.0
+    bands = []
+
+    def cancel_after_two(patch):
+        bands.append(patch)
+        if len(bands) == 2:
+            enhanced_main.current_task().cancel()
+        return blur(patch)
+
+    stopped = runner.submit("cancel", lambda task: enhanced_main.process_region(
+        image, whole, cancel_after_two, enhanced_main.FILTER_HALO, band_rows=50))
+    try:
+        stopped.future.result()
+        assert False, "cancelled edit should not finish"
+    except enhanced_main.CancelledError:
+        pass
+    assert len(bands) == 2
+    runner.shutdown()
+
+    # The array helpers behind the GUI edits keep the image shape
+    rgb = np.asarray(make_test_image(64, 48))
+    assert enhanced_main.equalize_array(rgb).shape == rgb.shape
+    balanced = enhanced_main.color_balance_array(rgb).reshape(-1, 3).mean(axis=0)
+    assert balanced.max() - balanced.min() < 2
+
+def test_crop_overlay_geometry():
+    """Test crop handle hit-testing and move/resize drags"""
+    box = (100, 100, 300, 200)
+    assert enhanced_main.hit_test_crop(box, 101, 99) == "nw"
+    assert enhanced_main.hit_test_crop(box, 200, 203) == "s"
+    assert enhanced_main.hit_test_crop(box, 150, 150) == "move"
+    assert enhanced_main.hit_test_crop(box, 50, 50) is None
+
+    bounds = (400, 300)
+    assert enhanced_main.drag_crop_box(box, "move", 20, -10, bounds) == (120, 90, 320, 190)
+    # Moves stop at the image edge without changing size
+    assert enhanced_main.drag_crop_box(box, "move", 500, 0, bounds) == (200, 100, 400, 200)
+    assert enhanced_main.drag_crop_box(box, "e", 50, 50, bounds) == (100, 100, 350, 200)
+    assert enhanced_main.drag_crop_box(box, "nw", -200, -200, bounds) == (0, 0, 300, 200)
+    # Dragging a corner past the opposite edge flips the box
+    assert enhanced_main.drag_crop_box(box, "se", -250, 0, bounds) == (50, 100, 100, 200)
+
+def test_region_edits(img):
+    """Test selection-only processing and region history patches"""
+    box = (40, 30, 200, 150)
+    blur = lambda patch: enhanced_main.apply_pil_filter(patch, "Blur")
+
+    # With a halo the patch matches the same area of a full-image blur
+    patch = enhanced_main.process_region(img, box, blur, enhanced_main.FILTER_HALO)
+    assert patch.size == (160, 120)
+    assert np.array_equal(np.asarray(patch), np.asarray(blur(img).crop(box)))
+
+    # History steps swap pixels, so undo and redo round-trip exactly
+    history = enhanced_main.EditHistory(limit=3)
+    original = np.asarray(img).copy()
+    current = img
+    history.record_region(current, box)
+    current.paste(patch, box[:2])
+    edited = np.asarray(current).copy()
+    history.record_full(current)
+    current = current.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+
+    # A region step only stores the box
+    assert history.steps[0][2].size == (160, 120)
+
+    current = history.undo(current)
+    assert np.array_equal(np.asarray(current), edited)
+    current = history.undo(current)
+    assert np.array_equal(np.asarray(current), original)
+    assert history.undo(current) is None
+    current = history.redo(current)
+    assert np.array_equal(np.asarray(current), edited)
+    current = history.redo(current)
+    assert np.array_equal(np.asarray(current), edited[:, ::-1])
+    assert history.redo(current) is None
+
+    # New edits drop the redo branch and old steps fall off the limit
+    for _ in range(5):
+        history.record_full(current)
+    assert len(history.steps) == 3 and not history.can_redo()
+
+def test_smart_crop():
+    """Test saliency-based template crop placement"""
+    rng = np.random.default_rng(0)
+    for centre_x in (300, 1000, 1700):
+        rgb = np.full((1000, 2000, 3), 40, dtype=np.uint8)
+        rgb += rng.integers(0, 6, rgb.shape, dtype=np.uint8)
+        cv2.circle(rgb, (centre_x, 500), 150, (230, 200, 90), -1)
+        image = Image.fromarray(rgb)
+
+        start = time.perf_counter()
+        x1, y1, x2, y2 = enhanced_main.smart_crop_box(image, (1, 1))
+        elapsed = time.perf_counter() - start
+        assert (x2 - x1, y2 - y1) == (1000, 1000)
+        assert x1 <= centre_x - 150 and centre_x + 150 <= x2
+        assert elapsed < 1.0
+
+    # Featureless images fall back to the centred crop
+    flat = Image.new("RGB", (400, 200), "gray")
+    assert enhanced_main.smart_crop_box(flat, (1, 1)) == enhanced_main.centered_crop_box(flat, (1, 1))
+
+    assert enhanced_main.parse_aspect("16:9") == (16, 9)
+    assert enhanced_main.parse_aspect("Portrait (4:5)") == (4, 5)
+    crop = enhanced_main.make_template_crop_transform((9, 16))
+    assert crop(image, None).size == (562, 1000)
+
+def test_face_crop():
+    """Test face-centred template crops and the saliency fallback"""
+    from skimage import data
+
+    image = Image.fromarray(data.astronaut()).resize((1024, 1024))
+    assert enhanced_main.get_face_detector() is enhanced_main.get_face_detector()
+    faces = enhanced_main.detect_faces(image)
+    if enhanced_main.get_face_detector() is not None:
+        assert any(350 < x + w / 2 < 550 and 130 < y + h / 2 < 330 for x, y, w, h in faces)
+
+    # Crops frame the largest faces and ignore small detections
+    faces = [(352, 131, 195, 195), (259, 547, 40, 40)]
+    x1, y1, x2, y2 = enhanced_main.face_crop_box(image, (16, 9), faces)
+    assert (x2 - x1, y2 - y1) == (1024, 576)
+    assert y1 <= 131 and 326 <= y2 and y1 + 0.3 * 576 < 228 < y1 + 0.5 * 576
+
+    # No faces: same as the saliency crop
+    flat = Image.new("RGB", (400, 200), "gray")
+    assert enhanced_main.face_crop_box(flat, (1, 1)) == enhanced_main.smart_crop_box(flat, (1, 1))
+
+    result = enhanced_main.BatchResult()
+    result.processed, result.elapsed = 10, 2.0
+    assert enhanced_main.batch_throughput(result).startswith("5.0 images/s")
+
+def test_auto_trim():
+    """Test content bounding box detection for auto-trim"""
+    # Content outlined by 1px lines, so the full-resolution refinement matters
+    rgb = np.full((1500, 2500, 3), 250, dtype=np.uint8)
+    rgb[301:1207, 433:1999] = (120, 60, 30)
+    rgb[300, 432:2001] = 0
+    rgb[1207, 432:2001] = 0
+    rgb[300:1208, 432] = 0
+    rgb[300:1208, 2000] = 0
+    image = Image.fromarray(rgb)
+    assert enhanced_main.find_content_bbox(image) == (432, 300, 2001, 1208)
+
+    # Margins within tolerance are still trimmed
+    noisy = rgb.copy()
+    noisy[:100] = 244
+    assert enhanced_main.find_content_bbox(Image.fromarray(noisy), tolerance=10) == (432, 300, 2001, 1208)
+    assert enhanced_main.find_content_bbox(Image.fromarray(noisy), tolerance=2)[1] == 0
+
+    assert enhanced_main.find_content_bbox(Image.new("RGB", (300, 200), "white")) is None
+    trim = enhanced_main.make_trim_transform()
+    assert trim(image, None).size == (1569, 908)
+
+def make_text_page(width=750, height=1000):
+    """Create a synthetic scanned page with rows of word-like blocks"""
+    page = np.full((height, width), 255, dtype=np.uint8)
+    for y in range(75, height - 75, 30):
+        for x in range(50, width - 80, 45):
+            cv2.rectangle(page, (x, y), (x + 35, y + 12), 0, -1)
+    return Image.fromarray(page).convert("RGB")
+
+def test_document_correction():
+    """Test deskew, document outline detection and the tiled perspective warp"""
+    page = make_text_page()
+    for angle in (-6.5, 4.0):
+        skewed = page.rotate(angle, expand=True, fillcolor="white", resample=Image.Resampling.BICUBIC)
+        assert abs(enhanced_main.deskew_angle(skewed) - angle) <= 0.2
+
+    # Photograph the page at an angle on a dark table
+    quad = np.array([[450, 250], [1550, 350], [1650, 1300], [350, 1200]], dtype=np.float32)
+    corners = np.array([[0, 0], [749, 0], [749, 999], [0, 999]], dtype=np.float32)
+    matrix = cv2.getPerspectiveTransform(corners, quad)
+    table = np.full((1500, 2000, 3), (40, 90, 40), dtype=np.uint8)
+    photo = cv2.warpPerspective(np.asarray(page), matrix, (2000, 1500), dst=table,
+                                borderMode=cv2.BORDER_TRANSPARENT)
+    photo = Image.fromarray(photo)
+
+    detected = enhanced_main.detect_document_quad(photo)
+    assert detected is not None and np.abs(detected - quad).max() < 15
+    assert enhanced_main.detect_document_quad(Image.new("RGB", (400, 300), "gray")) is None
+
+    # Tiles reproduce a single full-frame warp exactly
+    tiled = enhanced_main.warp_perspective_tiled(photo, quad, (750, 1000), tile=256)
+    whole = cv2.warpPerspective(np.asarray(photo), cv2.getPerspectiveTransform(corners, quad), (750, 1000),
+                                flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+    assert np.array_equal(np.asarray(tiled), whole)
+    assert np.abs(np.asarray(tiled.convert("L"), dtype=np.int16) - np.asarray(page.convert("L"))).mean() < 10
+
+def test_image_statistics():
+    """Test histogram statistics and the history states that key their cache"""
+    array = np.zeros((100, 200, 3), dtype=np.uint8)
+    array[:, :100] = (255, 128, 0)
+    stats = enhanced_main.image_statistics(Image.fromarray(array))
+    assert stats["R"].histogram.sum() == 20000
+    assert stats["R"].mean == 127.5 and stats["R"].std == 127.5
+    assert (stats["G"].min, stats["G"].max) == (0, 128)
+    assert stats["B"].shadows == 1.0 and stats["R"].highlights == 0.5
+    luma = cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
+    assert abs(stats["L"].mean - luma.mean()) < 1e-9
+
+    # Undo and redo return to the state ids recorded before and after each edit
+    image = make_test_image(200, 100)
+    history = enhanced_main.EditHistory()
+    history.clear()
+    states = [history.state]
+    history.record_full(image)
+    states.append(history.state)
+    history.record_region(image, (0, 0, 50, 50))
+    states.append(history.state)
+    assert len(set(states)) == 3
+    history.undo(image)
+    assert history.state == states[1]
+    history.undo(image)
+    assert history.state == states[0]
+    history.redo(image)
+    assert history.state == states[1]
+    history.mark_changed()
+    assert history.state not in states
+
+def test_tiled_clahe():
+    """Test that tiled CLAHE reproduces OpenCV's CLAHE"""
+    rng = np.random.default_rng(0)
+    # Sizes that divide the grid evenly and ones OpenCV has to pad
+    for shape, grid, clip in [((600, 800), (8, 8), 3.0), ((597, 803), (8, 6), 2.0), ((301, 207), (16, 16), 0)]:
+        channel = cv2.GaussianBlur(rng.integers(0, 256, shape, dtype=np.uint8), (0, 0), 5)
+        channel = (channel // 2 + rng.integers(0, 40, shape, dtype=np.uint8)).astype(np.uint8)
+        expected = cv2.createCLAHE(clipLimit=clip, tileGridSize=grid).apply(channel)
+        assert np.array_equal(enhanced_main.apply_clahe(channel, clip, grid, workers=2), expected)
+
+    # Memory-mapped input and output are processed strip by strip
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source = np.lib.format.open_memmap(os.path.join(temp_dir, "in.npy"), mode="w+",
+                                           dtype=np.uint8, shape=(700, 500))
+        source[:] = rng.integers(0, 120, source.shape, dtype=np.uint8)
+        target = np.lib.format.open_memmap(os.path.join(temp_dir, "out.npy"), mode="w+",
+                                           dtype=np.uint8, shape=source.shape)
+        assert enhanced_main.apply_clahe(source, out=target) is target
+        assert np.array_equal(target, cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8)).apply(np.asarray(source)))
+        del source, target
+
+    assert enhanced_main.get_clahe(2.0, (4, 4)) is enhanced_main.get_clahe(2.0, (4, 4))
+
+    # Auto enhance converts large images strip by strip with the same result
+    rgb = np.asarray(make_test_image(803, 597))
+    expected = enhanced_main.auto_enhance_array(rgb)
+    tiled_pixels = enhanced_main.CLAHE_TILED_PIXELS
+    enhanced_main.CLAHE_TILED_PIXELS = 0
+    try:
+        assert np.array_equal(enhanced_main.auto_enhance_array(rgb, workers=2), expected)
+    finally:
+        enhanced_main.CLAHE_TILED_PIXELS = tiled_pixels
+
+def test_stack_adjustments():
+    """Test stack adjustments against the ImageEnhance chain and the stack batch"""
+    from PIL import ImageEnhance
+
+    rng = np.random.default_rng(3)
+    stack = rng.integers(0, 256, (3, 60, 80, 3), dtype=np.uint8)
+    stack[1] //= 3
+    for brightness, contrast, saturation in [(1.3, 1.0, 1.0), (0.6, 1.5, 1.0), (1.2, 1.7, 0.5), (2.5, 0.2, 2.9)]:
+        adjusted = enhanced_main.adjust_stack(stack, brightness, contrast, saturation)
+        for frame, result in zip(stack, adjusted):
+            image = Image.fromarray(frame)
+            image = ImageEnhance.Brightness(image).enhance(brightness)
+            image = ImageEnhance.Contrast(image).enhance(contrast)
+            image = ImageEnhance.Color(image).enhance(saturation)
+            assert np.array_equal(np.asarray(image), result)
+    assert np.array_equal(enhanced_main.adjust_stack(stack), stack)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_folder = os.path.join(temp_dir, "burst")
+        output_folder = os.path.join(temp_dir, "out")
+        os.makedirs(input_folder)
+        for i in range(7):
+            size = (80, 60) if i % 3 else (40, 30)
+            make_test_image(*size).save(os.path.join(input_folder, f"frame{i}.png"))
+        with open(os.path.join(input_folder, "broken.png"), "wb") as f:
+            f.write(b"not an image")
+
+        result = enhanced_main.run_stack_batch(input_folder, output_folder, contrast=1.4, frames=3)
+        assert result.processed == 7 and len(result.failed) == 1
+        expected = ImageEnhance.Contrast(Image.open(os.path.join(input_folder, "frame4.png")).convert("RGB")).enhance(1.4)
+        with Image.open(os.path.join(output_folder, "adjusted_frame4.png")) as written:
+            assert np.array_equal(np.asarray(written), np.asarray(expected))
+
+def test_video_frames():
+    """Test streaming video frames through the crop/adjust pipeline"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source = os.path.join(temp_dir, "clip.avi")
+        frames = []
+        for i in range(12):
+            frame = np.zeros((96, 128, 3), dtype=np.uint8)
+            frame[:] = (i * 20, 100, 50)
+            frames.append(Image.fromarray(frame))
+        assert enhanced_main.write_video(iter(frames), source, 10.0) == 12
+        fps, size, count = enhanced_main.video_properties(source)
+        assert (fps, size, count) == (10.0, (128, 96), 12)
+
+        transform = enhanced_main.make_frame_transform(box=(8, 8, 72, 56), rotation=90, brightness=1.2)
+        result = enhanced_main.run_frames(source, os.path.join(temp_dir, "graded.mp4"), transform, workers=3)
+        assert result.processed == 12
+        assert enhanced_main.video_properties(os.path.join(temp_dir, "graded.mp4"))[1:] == ((48, 64), 12)
+
+        # Frames come out in order, whatever order the workers finish in
+        folder = os.path.join(temp_dir, "frames")
+        enhanced_main.run_frames(source, folder, lambda frame: frame, workers=4)
+        reds = [np.asarray(Image.open(os.path.join(folder, name)))[..., 0].mean()
+                for name in sorted(os.listdir(folder))]
+        assert len(reds) == 12 and reds == sorted(reds)
+
+        # Unknown extensions are refused instead of becoming a folder of frames
+        with contextlib.redirect_stderr(io.StringIO()):
+            try:
+                enhanced_main.run_batch_cli(["video", source, os.path.join(temp_dir, "out.webm")])
+                assert False, "unsupported video extension accepted"
+            except SystemExit as e:
+                assert e.code == 2
+        assert not os.path.exists(os.path.join(temp_dir, "out.webm"))
+        assert enhanced_main.run_batch_cli(["video", source, os.path.join(temp_dir, "numbered")]) == 0
+        assert len(os.listdir(os.path.join(temp_dir, "numbered"))) == 12
+
+        try:
+            enhanced_main.open_video("rtsp://camera.local/stream")
+            assert False, "network streams must be refused"
+        except FileNotFoundError:
+            pass
+
+def test_operation_metrics():
+    """Test per-operation timing telemetry and the profiling hooks"""
+    registry = enhanced_main.MetricsRegistry()
+    with enhanced_main.track_operation("sleep", 1000, registry):
+        time.sleep(0.02)
+    with enhanced_main.track_operation("sleep", registry=registry) as operation:
+        operation.nbytes = 500
+    summary = registry.summary()["sleep"]
+    assert summary["count"] == 2 and summary["bytes"] == 1500
+    assert summary["wall_seconds"] >= 0.02 and summary["cpu_seconds"] < summary["wall_seconds"]
+    # One run under a millisecond, the sleep at 10ms or more
+    assert summary["histogram"][0] == 1 and sum(summary["histogram"][3:]) == 1
+
+    # Decorated helpers record into the global registry with their image size
+    enhanced_main.METRICS.reset()
+    image = Image.new("RGB", (200, 100), (90, 120, 150))
+    enhanced_main.apply_adjustments(image, brightness=1.5)
+    enhanced_main.apply_pil_filter(image, "Blur")
+    summary = enhanced_main.METRICS.summary()
+    assert summary["adjust"]["bytes"] == 200 * 100 * 3
+    assert summary["filter:Blur"]["count"] == 1
+
+    # Memory sampling sees pixel buffers; nested operations leave the peak to their parent
+    benchmark.trim_heap()
+    enhanced_main.METRICS.reset()
+    enhanced_main.METRICS.set_memory_tracing(True)
+    enhanced_main.METRICS.set_profiling(True)
+    try:
+        large = Image.new("RGB", (2000, 1500), (90, 120, 150))
+        enhanced_main.apply_adjustments(large, brightness=1.5)
+        benchmark.trim_heap()
+        with enhanced_main.track_operation("outer"):
+            with enhanced_main.track_operation("inner"):
+                buffer = np.ones(16 * 1024 * 1024, dtype=np.uint8)
+                time.sleep(0.05)
+                del buffer
+    finally:
+        enhanced_main.METRICS.set_profiling(False)
+        enhanced_main.METRICS.set_memory_tracing(False)
+    summary = enhanced_main.METRICS.summary()
+    assert summary["adjust"]["peak_bytes"] >= 2000 * 1500 * 3 // 2
+    assert summary["inner"]["peak_bytes"] == 0
+    assert summary["outer"]["peak_bytes"] >= 8 * 1024 * 1024
+
+    # CPU spent on helper threads counts towards the calling operation
+    channel = np.random.default_rng(3).integers(0, 256, (1024, 1024), dtype=np.uint8)
+    with enhanced_main.track_operation("clahe") as operation:
+        before = time.thread_time()
+        enhanced_main.apply_clahe(channel, workers=4)
+        own_cpu = time.thread_time() - before
+    assert operation.helper_cpu > 0
+    assert enhanced_main.METRICS.summary()["clahe"]["cpu_seconds"] >= own_cpu + operation.helper_cpu * 0.99
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        profile_path = os.path.join(temp_dir, "ops.prof")
+        assert enhanced_main.METRICS.save_profile(profile_path)
+        assert pstats.Stats(profile_path).total_calls > 0
+
+        # The CLI prints the table after a batch job
+        input_folder = os.path.join(temp_dir, "in")
+        os.makedirs(input_folder)
+        for i in range(3):
+            Image.new("RGB", (64, 48), (i * 40, 80, 120)).save(os.path.join(input_folder, f"{i}.png"))
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            code = enhanced_main.run_batch_cli(["resize", input_folder, os.path.join(temp_dir, "out"),
+                                                "--width", "32", "--height", "32", "--metrics"])
+        assert code == 0
+        report = output.getvalue()
+        for name in ("read", "decode", "transform", "write", "encode", "Histogram buckets"):
+            assert name in report
+        assert enhanced_main.METRICS.summary()["write"]["count"] == 3
+
+# Tests for the non-GUI helpers in enhanced_main
+CORE_TESTS = [
+    test_thumbnail_cache,
+    test_prefetch_cache,
+    test_batch_pipeline,
+    test_batch_resume,
+    test_batch_incremental,
+    test_recursive_scan,
+    test_batch_dedup,
+    test_encoder_profiles,
+    test_target_size_export,
+    test_size_ladder_export,
+    test_shared_memory_ops,
+    test_task_runner,
+    test_crop_overlay_geometry,
+    test_region_edits,
+    test_smart_crop,
+    test_face_crop,
+    test_auto_trim,
+    test_document_correction,
+    test_image_statistics,
+    test_tiled_clahe,
+    test_stack_adjustments,
+    test_video_frames,
+    test_memory_optimization,
+    test_operation_metrics,
+]
 
 def run_comprehensive_test():
     """Run all feature tests"""
@@ -324,7 +1157,7 @@ def run_comprehensive_test():
     
     start_time = time.time()
     tests_passed = 0
-    total_tests = 8
+    total_tests = 8 + len(CORE_TESTS)
     
     # Test 1: Image Operations
     img = test_image_operations()
@@ -359,8 +1192,16 @@ def run_comprehensive_test():
         if test_batch_operations(img):
             tests_passed += 1
     
-    # Additional Test: Memory Optimization
-    test_memory_optimization()
+    # Core helper tests
+    for core_test in CORE_TESTS:
+        args = [make_test_image()] if "img" in inspect.signature(core_test).parameters else []
+        try:
+            core_test(*args)
+        except AssertionError as e:
+            print(f"❌ {core_test.__name__} failed: {e}")
+        else:
+            print(f"✅ {core_test.__name__}")
+            tests_passed += 1
     
     end_time = time.time()
     duration = end_time - start_time